@@ -0,0 +1,69 @@
+"""
+运行全部基准测试并把结果保存为 JSON，便于在提交之间比较。
+
+    python -m benchmarks                        # 结果写入 benchmarks/results/<commit>.json
+    python -m benchmarks -k response_stream     # 只运行名称包含该字符串的基准
+    python -m benchmarks --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from dataclasses import asdict
+
+from . import anthropic_stream, request_pipeline, response_pipeline, usage_writer  # noqa: F401  注册基准
+from .harness import run_all
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def _compare(results, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get(result.name)
+        if old is None:
+            continue
+        ratio = result.us_per_op / old["us_per_op"]
+        flag = "  REGRESSION" if ratio > 1.1 else ""
+        print(f"{result.name:<48} {old['us_per_op']:12.3f} -> {result.us_per_op:12.3f} us/op ({ratio:5.2f}x){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="unify-openai-api micro benchmarks")
+    parser.add_argument("-k", dest="selected", action="append", help="只运行名称包含该字符串的基准，可重复")
+    parser.add_argument("-o", "--output", help="结果 JSON 路径，默认 benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    commit = _git_commit()
+    results = run_all(args.selected)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": [asdict(r) for r in results],
+        }, f, indent=2)
+    print(f"\nresults saved to {output}")
+
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
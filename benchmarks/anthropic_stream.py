@@ -0,0 +1,88 @@
+"""
+Anthropic -> OpenAI 流式转换的微基准。
+
+对比旧的 to_openai_chunk_format + model_dump + json.dumps 路径
+与按流构建的 AnthropicStreamConverter。
+
+    python -m benchmarks.anthropic_stream
+"""
+import json
+
+from anthropic.types import (
+    Message,
+    MessageDeltaUsage,
+    RawContentBlockDeltaEvent,
+    RawMessageDeltaEvent,
+    RawMessageStartEvent,
+    TextDelta,
+    Usage,
+)
+from anthropic.types.raw_message_delta_event import Delta
+
+from unify_openai_api.response_handlers.anthropic import AnthropicToOpenAI, to_openai_chunk_format
+
+from .harness import Case, benchmark, measure
+
+
+def make_message(content=None, stop_reason=None) -> Message:
+    return Message(
+        id="msg_01XFDUDYJgAACzvnptvVoYEL",
+        type="message",
+        role="assistant",
+        model="claude-sonnet-4-5-20250929",
+        content=content or [],
+        stop_reason=stop_reason,
+        stop_sequence=None,
+        usage=Usage(input_tokens=1200, output_tokens=1),
+    )
+
+
+def make_events(n_tokens: int = 500) -> list:
+    start = RawMessageStartEvent(type="message_start", message=make_message())
+    deltas = [
+        RawContentBlockDeltaEvent(type="content_block_delta", index=0, delta=TextDelta(type="text_delta", text=f"token{i} 你好 "))
+        for i in range(n_tokens)
+    ]
+    stop = RawMessageDeltaEvent(
+        type="message_delta",
+        delta=Delta(stop_reason="end_turn", stop_sequence=None),
+        usage=MessageDeltaUsage(input_tokens=1200, output_tokens=n_tokens),
+    )
+    return [start, *deltas, stop]
+
+
+@benchmark("anthropic_chunk[to_openai_chunk_format]")
+def _legacy() -> Case:
+    events = make_events()
+
+    def run():
+        for event in events:
+            chunk = to_openai_chunk_format(event)
+            if chunk is not None:
+                f"data: {json.dumps(chunk.model_dump())}\n\n"
+    return Case(run, ops=len(events))
+
+
+@benchmark("anthropic_chunk[stream_converter]")
+def _converter() -> Case:
+    events = make_events()
+
+    def run():
+        converter = AnthropicToOpenAI().for_stream()
+        for event in events:
+            chunk = converter.handle_response_frame(None, None, event)
+            if chunk is not None:
+                chunk.data
+    return Case(run, ops=len(events))
+
+
+def main():
+    legacy = measure("legacy", _legacy())
+    converter = measure("converter", _converter())
+    print(f"to_openai_chunk_format:   {legacy.us_per_op:8.2f} us/event")
+    print(f"AnthropicStreamConverter: {converter.us_per_op:8.2f} us/event")
+    print(f"speedup:                  {legacy.us_per_op / converter.us_per_op:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""基准测试共用的请求与响应数据。"""
+import os
+from functools import lru_cache
+from typing import List, Mapping
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from unify_openai_api.metrics.gateway import GatewayMetrics
+from unify_openai_api.registry.config import load_config
+from unify_openai_api.registry.registry import ModelRegistry
+from unify_openai_api.types.llm_api import LLMApi
+
+
+class _NoPool:
+    """不创建共享连接池，SDK 使用默认 http client，基准测试不会发出网络请求。"""
+
+    def client_for(self, base_url: str, lib=None):
+        return None
+
+
+@lru_cache(maxsize=None)
+def registered_models() -> Mapping[str, LLMApi]:
+    """按 main.py 的方式从 models.toml 加载模型表。"""
+    config = load_config(os.path.join(os.path.dirname(__file__), "..", "models.toml"))
+    for provider in config.providers.values():
+        os.environ.setdefault(provider.api_key_env, "benchmark")
+    return ModelRegistry(config, _NoPool())
+
+
+def chat_request(turns: int = 10, turn_chars: int = 400, stream: bool = True) -> dict:
+    """模拟 Open WebUI 发来的多轮对话请求。"""
+    messages: List[dict] = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "x" * turn_chars})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "y" * turn_chars})
+    messages.append({"role": "user", "content": "final question"})
+    return {
+        "model": "placeholder",
+        "messages": messages,
+        "stream": stream,
+        "temperature": 0.7,
+        "openwebui_middleware": {"user_id": "user-1", "chat_id": "chat-1"},
+    }
+
+
+def text_chunks(n_tokens: int = 500) -> List[ChatCompletionChunk]:
+    """OpenAI 格式的流式 chunk，最后一个携带 usage。"""
+    chunks = [
+        ChatCompletionChunk.model_validate({
+            "id": "chatcmpl-1",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "gpt-4o-2024-11-20",
+            "choices": [{"index": 0, "delta": {"content": f"token{i} "}, "finish_reason": None}],
+        })
+        for i in range(n_tokens)
+    ]
+    chunks.append(ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": "gpt-4o-2024-11-20",
+        "choices": [],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": n_tokens, "total_tokens": 1200 + n_tokens},
+    }))
+    return chunks
+
+
+def sse_bytes(chunks: List[ChatCompletionChunk]) -> bytes:
+    return b"".join(b"data: " + chunk.model_dump_json(exclude_unset=True).encode() + b"\n\n" for chunk in chunks) + b"data: [DONE]\n\n"
+
+
+def completion() -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1700000000,
+        "model": "gpt-4o-2024-11-20",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hello " * 200}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1200, "completion_tokens": 200, "total_tokens": 1400},
+    })
+
+
+class NullWriter:
+    """替代 AsyncDBWriter，只计数不写库。"""
+
+    def __init__(self):
+        self.count = 0
+
+    def add_usage(self, **kwargs):
+        self.count += 1
+
+
+class BenchState:
+    """最小的 AppState，只提供基准测试用到的字段。"""
+
+    def __init__(self):
+        self.writer = NullWriter()
+        self.response_cache = None
+        self.coalescer = None
+        self.metrics = GatewayMetrics()
@@ -0,0 +1,63 @@
+"""基准测试注册与计时工具。"""
+import asyncio
+import timeit
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+# name -> setup 函数，setup 返回 (被测函数, 每次调用包含的操作数)
+BENCHMARKS: Dict[str, Callable[[], "Case"]] = dict()
+
+
+@dataclass
+class Case:
+    func: Callable[[], object]
+    ops: int = 1
+
+
+@dataclass
+class Result:
+    name: str
+    us_per_op: float
+    ops_per_sec: float
+    ops: int
+    repeat: int
+
+
+def benchmark(name: str):
+    """注册一个基准测试，被装饰的函数负责构造数据并返回 Case。"""
+    def decorator(setup: Callable[[], Case]):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def run_async(coro_factory: Callable[[], object]) -> Callable[[], object]:
+    """把协程工厂包装为同步可计时的函数，复用同一个事件循环。"""
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(coro_factory())
+
+
+def measure(name: str, case: Case, min_time: float = 0.2, repeat: int = 5) -> Result:
+    timer = timeit.Timer(case.func)
+    # 自动选择 number，使单轮耗时不少于 min_time
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return Result(
+        name=name,
+        us_per_op=best / case.ops * 1e6,
+        ops_per_sec=case.ops / best,
+        ops=case.ops,
+        repeat=repeat,
+    )
+
+
+def run_all(selected: List[str] = None) -> List[Result]:
+    results = []
+    for name, setup in BENCHMARKS.items():
+        if selected and not any(s in name for s in selected):
+            continue
+        result = measure(name, setup())
+        print(f"{name:<48} {result.us_per_op:12.3f} us/op {result.ops_per_sec:14.0f} op/s")
+        results.append(result)
+    return results
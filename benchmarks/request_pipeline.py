@@ -0,0 +1,71 @@
+"""请求侧热路径：逐个 modifier + split_params 与编译后的 RequestPipeline 对比。"""
+from unify_openai_api.request_modifers.interface import modify_request
+from unify_openai_api.utils.split_params import split_params
+from unify_openai_api.utils.token_estimator import TokenCache, TokenEstimator
+
+from .fixtures import chat_request, registered_models
+from .harness import Case, benchmark
+
+# 每类 provider 选一个代表模型
+MODIFIER_CHAINS = {
+    "aliyun": "qwen-plus",
+    "volcengine": "doubao-2.0-pro",
+    "deerapi_openai": "gpt-4o",
+    "deerapi_anthropic": "claude-sonnet-4.5",
+}
+
+# 普通对话与长上下文多轮对话
+PAYLOADS = {
+    "10turns": dict(turns=10, turn_chars=400),
+    "200turns": dict(turns=200, turn_chars=2000),
+}
+
+
+def _fresh(request: dict) -> dict:
+    # modifier 会修改传入的 dict，每次复制一份浅层结构
+    return {**request, "openwebui_middleware": dict(request["openwebui_middleware"])}
+
+
+def _chain_case(model_name: str, payload: str) -> Case:
+    """编译前的做法：依次调用 modify_data，再在 _make_request_inner 中拆分字段。"""
+    model = registered_models()[model_name]
+    modifiers, field_set = model.request_modifiers, model.pipeline.field_set
+    request = chat_request(**PAYLOADS[payload])
+
+    def run():
+        data = modify_request(modifiers, _fresh(request))
+        supported, extra = split_params(field_set, data)
+        supported["extra_body"] = {**supported.get("extra_body", dict()), **extra}
+        return supported
+
+    return Case(run)
+
+
+def _compiled_case(model_name: str, payload: str) -> Case:
+    pipeline = registered_models()[model_name].pipeline
+    request = chat_request(**PAYLOADS[payload])
+    return Case(lambda: pipeline(_fresh(request)))
+
+
+for _provider, _model in MODIFIER_CHAINS.items():
+    for _payload in PAYLOADS:
+        benchmark(f"request_chain[{_provider},{_payload}]")(
+            lambda _model=_model, _payload=_payload: _chain_case(_model, _payload))
+        benchmark(f"request_compiled[{_provider},{_payload}]")(
+            lambda _model=_model, _payload=_payload: _compiled_case(_model, _payload))
+
+
+def _estimate_case(model_name: str, payload: str, cached: bool) -> Case:
+    """发出请求前的本地 token 估计；cached 为真时所有消息都已计数过，cold 为全新的缓存。"""
+    estimator = registered_models()[model_name].estimator
+    request = chat_request(**PAYLOADS[payload])
+    if cached:
+        estimator.count_request(request)
+        return Case(lambda: estimator.count_request(request))
+    return Case(lambda: TokenEstimator(estimator.family, TokenCache()).count_request(request))
+
+
+for _payload in PAYLOADS:
+    for _cached in (False, True):
+        benchmark(f"token_estimate[{_payload},{'cached' if _cached else 'cold'}]")(
+            lambda _payload=_payload, _cached=_cached: _estimate_case("qwen-plus", _payload, _cached))
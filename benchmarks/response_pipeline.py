@@ -0,0 +1,109 @@
+"""响应侧热路径：handler 链、格式转换与 SSE 编码。"""
+from anthropic.types import TextBlock
+
+from unify_openai_api.backends.aggregate import ChatCompletionAggregator
+from unify_openai_api.response_handlers.anthropic import to_openai_format
+from unify_openai_api.response_handlers.cost_record import ChatCompletionCostRecord
+from unify_openai_api.response_handlers.interface import handle_response_frames
+from unify_openai_api.types.response import ApiResponse
+
+from .anthropic_stream import make_events, make_message
+from .fixtures import BenchState, chat_request, registered_models, sse_bytes, text_chunks
+from .harness import Case, benchmark, run_async
+
+
+@benchmark("handle_response_frames[cost_record]")
+def _handle_frames() -> Case:
+    handlers = [ChatCompletionCostRecord(model_id="gpt-4o", input_price=2.5, output_price=10)]
+    state = BenchState()
+    chunks = text_chunks()
+
+    def run():
+        for chunk in chunks:
+            handle_response_frames(handlers, state, "user-1", chunk)
+    return Case(run, ops=len(chunks))
+
+
+@benchmark("to_openai_format")
+def _to_openai_format() -> Case:
+    message = make_message(content=[TextBlock(type="text", text="hello " * 200)], stop_reason="end_turn")
+    return Case(lambda: to_openai_format(message))
+
+
+class _Stream:
+    """模拟 SDK 的 AsyncStream。"""
+
+    def __init__(self, items):
+        self.items = items
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+    async def close(self):
+        pass
+
+
+class _RawResponse:
+    """模拟 AsyncAPIResponse，按固定大小切分 SSE 字节。"""
+
+    def __init__(self, data: bytes, chunk_size: int = 512):
+        self.parts = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+    async def iter_bytes(self):
+        for part in self.parts:
+            yield part
+
+    async def close(self):
+        pass
+
+
+def _drain(generator_factory):
+    async def run():
+        async for _ in generator_factory():
+            pass
+    return run_async(run)
+
+
+@benchmark("response_stream[openai]")
+def _response_stream_openai() -> Case:
+    model = registered_models()["gpt-4o"]
+    state = BenchState()
+    chunks = text_chunks()
+    obj = ApiResponse(request=chat_request(), user_id="user-1", stream=True)
+    # 调用基类实现，绕过透传，衡量 pydantic 解析后的重新编码开销
+    stream = super(type(model), model)._response_stream
+    return Case(_drain(lambda: stream(obj, state, _Stream(chunks))), ops=len(chunks))
+
+
+@benchmark("response_stream[openai_passthrough]")
+def _response_stream_passthrough() -> Case:
+    model = registered_models()["gpt-4o"]
+    state = BenchState()
+    chunks = text_chunks()
+    data = sse_bytes(chunks)
+    obj = ApiResponse(request=chat_request(), user_id="user-1", stream=True)
+    return Case(_drain(lambda: model._passthrough_stream(obj, state, _RawResponse(data))), ops=len(chunks))
+
+
+@benchmark("response_stream[anthropic]")
+def _response_stream_anthropic() -> Case:
+    model = registered_models()["claude-sonnet-4.5"]
+    state = BenchState()
+    events = make_events()
+    obj = ApiResponse(request=chat_request(), user_id="user-1", stream=True)
+    return Case(_drain(lambda: model._response_stream(obj, state, _Stream(events))), ops=len(events))
+
+
+@benchmark("aggregate[openai_passthrough]")
+def _aggregate_passthrough() -> Case:
+    """stream_upstream 时把透传的 SSE 字节合并为非流式 body。"""
+    chunks = text_chunks()
+    parts = _RawResponse(sse_bytes(chunks)).parts
+
+    def run():
+        aggregator = ChatCompletionAggregator()
+        for part in parts:
+            aggregator.add(part)
+        return aggregator.result()
+    return Case(run, ops=len(chunks))
@@ -0,0 +1,60 @@
+"""AsyncDBWriter 的入队开销与端到端落库吞吐（ops_per_sec 即每秒写入行数）。"""
+import os
+import tempfile
+
+from unify_openai_api.usage_db.writer import AsyncDBWriter, WriterConfig
+
+from .harness import Case, benchmark
+
+ROWS = 2000
+
+
+def _usage(i: int) -> dict:
+    return dict(
+        model_id="gpt-4o-2024-11-20",
+        input_tokens=1200 + i,
+        input_price=2.5,
+        output_tokens=300,
+        output_price=10,
+        user_id=f"user-{i % 16}",
+    )
+
+
+@benchmark("usage_writer[add_usage_enqueue]")
+def _enqueue() -> Case:
+    writer = AsyncDBWriter(db_path=os.path.join(tempfile.mkdtemp(), "bench.db"))
+    rows = [_usage(i) for i in range(ROWS)]
+
+    def run():
+        for row in rows:
+            writer.add_usage(**row)
+        # 未启动消费线程，清空队列以免内存增长
+        with writer.queue.mutex:
+            writer.queue.queue.clear()
+            writer.queue.unfinished_tasks = 0
+    return Case(run, ops=ROWS)
+
+
+def _end_to_end(config: WriterConfig) -> Case:
+    directory = tempfile.mkdtemp()
+    rows = [_usage(i) for i in range(ROWS)]
+    counter = iter(range(1 << 30))
+
+    def run():
+        writer = AsyncDBWriter(db_path=os.path.join(directory, f"bench-{next(counter)}.db"), config=config)
+        writer.start()
+        for row in rows:
+            writer.add_usage(**row)
+        writer.stop()
+    return Case(run, ops=ROWS)
+
+
+@benchmark("usage_writer[rows_to_sqlite]")
+def _batched() -> Case:
+    return _end_to_end(WriterConfig())
+
+
+@benchmark("usage_writer[rows_to_sqlite_commit_per_row]")
+def _per_row() -> Case:
+    # 每行提交一次，对应批量提交之前的写入方式
+    return _end_to_end(WriterConfig(batch_size=1))
@@ -1,47 +1,110 @@
-import logging
-logging.basicConfig(
-        level=logging.DEBUG,  # 设置最低输出级别
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        # handlers=[
-        #     logging.FileHandler("app.log"),  # 输出到文件
-        #     logging.StreamHandler()         # 输出到控制台
-        # ]
-    )
+from unify_openai_api.logger import setup_logging, start_request, is_sampled
+setup_logging()
 
+import asyncio
 import logging
+import math
+import signal
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse, Response
 from contextlib import asynccontextmanager
 
 from unify_openai_api.types.llm_api import LLMApi, AppState, get_typed_state
-from unify_openai_api.usage_db.writer import AsyncDBWriter
-
-import unify_openai_api.providers.aliyun
-import unify_openai_api.providers.volcengine
-import unify_openai_api.providers.deerapi
+from unify_openai_api.metrics.gateway import GatewayMetrics
+from unify_openai_api.registry.config import load_config
+from unify_openai_api.registry.registry import ModelRegistry, ModelUnavailable
+from unify_openai_api.response_cache.cache import ResponseCache, ResponseCacheConfig
+from unify_openai_api.usage_db.spend import BudgetExceeded, SpendTracker
+from unify_openai_api.usage_db.writer import AsyncDBWriter, WriterConfig
+from unify_openai_api.utils.circuit_breaker import CircuitOpen
+from unify_openai_api.utils.disconnect import ClientDisconnected, cancel_on_disconnect
+from unify_openai_api.utils.http_pool import HttpPool, HttpPoolConfig
+from unify_openai_api.utils.singleflight import SingleFlight
+from unify_openai_api.utils.token_estimator import ContextWindowExceeded
 
 logger = logging.getLogger(__name__)
 
+# 关闭时等待使用记录写完的最长时间（秒）
+WRITER_STOP_TIMEOUT = 30
+
+# 客户端已断开，响应不会被读取（沿用 nginx 的约定）
+CLIENT_CLOSED_REQUEST = 499
+
+# 重新加载后被替换的客户端在这段时间之后关闭，旧模型表中排队或重试的请求仍可使用（秒）
+RETIRED_CLIENT_GRACE = 300.0
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # ✅ 这里是原 startup 函数的内容
-    models: dict[str, LLMApi] = dict()
-    writer = AsyncDBWriter()
+    # 先读取已有花费，再开始接收新的使用记录
+    spend = SpendTracker()
+    writer = AsyncDBWriter(spend=spend, config=WriterConfig.from_env())
+    await asyncio.to_thread(spend.seed, writer.db_path)
     writer.start()
+    pool = HttpPool(HttpPoolConfig.from_env())
+    cache_config = ResponseCacheConfig.from_env()
+    response_cache = ResponseCache(cache_config) if cache_config.enabled else None
+
+    # 模型与客户端在第一次请求时才构造
+    models = ModelRegistry(load_config(), pool)
+    models.prepare_pool()
 
-    unify_openai_api.providers.aliyun.regiester_models(models)
-    unify_openai_api.providers.volcengine.regiester_models(models)
-    unify_openai_api.providers.deerapi.regiester_models(models)
+    # 预热上游连接
+    await pool.warmup()
 
     app.state.models = models
     app.state.writer = writer
+    app.state.pool = pool
+    app.state.response_cache = response_cache
+    app.state.coalescer = SingleFlight.from_env()
+    app.state.metrics = GatewayMetrics()
+    app.state.spend = spend
+
+    # SIGHUP 触发热加载（仅 Unix 且在主线程运行事件循环时可用）
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(_reload_on_signal(app)))
+    except (AttributeError, NotImplementedError, RuntimeError):
+        logger.info("SIGHUP reload is unavailable, use POST /admin/reload-models")
 
     yield
 
-    writer.stop()
+    await app.state.models.aclose()
+    if response_cache is not None:
+        response_cache.close()
+    await pool.aclose()
+    # 在后台线程等待剩余记录写完
+    await asyncio.to_thread(writer.stop, WRITER_STOP_TIMEOUT)
 
 app = FastAPI(lifespan=lifespan)  # 关键：传递 lifespan
 
 
+async def reload_models(app: FastAPI) -> ModelRegistry:
+    """
+    重新读取模型配置并整体替换模型表，进行中的请求继续使用旧的模型对象。
+    配置未变的熔断器、限流器、客户端等沿用旧模型表中的对象，被替换的客户端稍后关闭。
+    """
+    state = app.state
+    try:
+        config = await asyncio.to_thread(load_config)
+        models = ModelRegistry(config, state.pool, previous=state.models)
+    except Exception as e:
+        logger.error("Failed to reload model config, keeping the current registry: %s", e)
+        raise
+    models.prepare_pool()
+    state.models = models
+    if models.retired:
+        asyncio.ensure_future(_close_retired(models.retired))
+    logger.info("Reloaded model registry with %d models", len(models))
+    return models
+
+
+async def _close_retired(clients):
+    await asyncio.sleep(RETIRED_CLIENT_GRACE)
+    for client in clients:
+        await client.aclose()
+
+
 @app.get("/v1/models")
 async def list_models(request: Request):
     return {
@@ -55,29 +118,93 @@ async def list_models(request: Request):
     }
 
 
+async def _reload_on_signal(app: FastAPI):
+    try:
+        await reload_models(app)
+    except Exception:
+        # 错误已记录，保留当前模型表
+        pass
+
+
+@app.post("/admin/reload-models")
+async def reload_models_endpoint(request: Request):
+    try:
+        models = await reload_models(request.app)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid model config: {e}")
+    return {"models": len(models)}
+
+
+@app.get("/admin/breakers")
+async def breaker_stats(request: Request):
+    models: ModelRegistry = get_typed_state(request).models
+    return models.breaker_stats()
+
+
+@app.get("/admin/endpoints")
+async def endpoint_stats(request: Request):
+    models: ModelRegistry = get_typed_state(request).models
+    return models.endpoint_stats()
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    state = get_typed_state(request)
+    state.metrics.observe_writer(state.writer)
+    return PlainTextResponse(state.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request):
     """
     代理处理 OpenAI 的 chat.completions 请求，支持 stream 和 non-stream 模式。
     """
+    start_request(request.headers.get("x-request-id"))
     state = get_typed_state(request)
     models = state.models
     try:
         data = await request.json()
-        logger.debug(f"request: {data}")
+        if is_sampled():
+            # 复制一份，后续 modifier 会修改 data，而格式化在后台线程进行
+            logger.info("request: %s", dict(data))
         model_id = data["model"]
     except Exception as e:
-        logger.error(f"Error parsing request JSON: {e}")
+        logger.error("Error parsing request JSON: %s", e)
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     if model_id not in models:
         raise HTTPException(
             status_code=400, detail=f"Unknown Model {model_id}")
 
-    model: LLMApi = models[model_id]
+    try:
+        model: LLMApi = models[model_id]
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-    response = await model.make_request(data)
-    return await model.handle_response(response, state)
+    try:
+        response = await model.make_request(data)
+    except ContextWindowExceeded as e:
+        state.metrics.context_rejections.inc((e.model, models.config.models[model_id].provider))
+        raise HTTPException(status_code=400, detail=str(e))
+    response.lane = request.headers.get("x-priority")
+    user = models.config.users.get(response.user_id or "")
+    if user is not None:
+        try:
+            # 输出长度未知，只按估计的输入计入本次请求
+            estimated = models.estimate_fee(model_id, response.prompt_tokens or 0)
+            state.spend.check(user, model_id, estimated)
+        except BudgetExceeded as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    try:
+        # 非流式请求的上游调用（以及流式请求的排队与建立连接）在客户端断开时取消；流式响应开始后由 StreamingResponse 处理
+        return await cancel_on_disconnect(model.handle_response(response, state), request.receive)
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except ClientDisconnected:
+        mode = "stream" if response.stream else "non_stream"
+        state.metrics.client_disconnects.inc((response.request.get("model", ""), models.config.models[model_id].provider, mode))
+        logger.info("Client disconnected, cancelled %s request for %s", mode, model_id)
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
 
 # 启动服务
 if __name__ == "__main__":
@@ -1,127 +1,176 @@
+"""
+按天统计用户与模型的消费。聚合与时区分桶都在 SQLite 中完成，内存占用与记录数无关。
+
+    python print_usage.py --days 14 --tz Asia/Shanghai
+"""
+import argparse
 import sqlite3
-import pandas as pd
-from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
 from prettytable import PrettyTable
-import pytz
-import locale
+
+from unify_openai_api.usage_db.partitions import list_partitions, month_of
+
+# total_fee 以价格（每百万 token）乘以 token 数记录
+FEE_SCALE = 1_000_000
+
+# 没有 user_id 的记录显示为 NULL；汇总表中以空字符串保存
+USER_EXPR = "COALESCE(NULLIF(u.user_id, ''), 'NULL')"
+
+TOTAL = '总计'
+
 
 def connect_to_db(db_path="model_usage.db"):
-    """连接到数据库"""
-    conn = sqlite3.connect(db_path)
+    """以只读方式连接到数据库"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
     return conn
 
-def get_last_n_days_data(conn, days=7):
-    """获取过去n天的数据"""
-    # 获取当前UTC时间
-    now = datetime.now(pytz.UTC)
-    # 计算n天前的UTC时间
-    n_days_ago = now - timedelta(days=days)
-    
-    query = """
-    SELECT 
-        timestamp, 
-        model_id, 
-        input_tokens, 
-        output_tokens, 
-        total_fee,
-        COALESCE(user_id, 'NULL') as user_id
-    FROM model_usage
-    WHERE timestamp >= ?
+
+@dataclass
+class Window:
+    """统计范围：每个本地自然日的 UTC 起止时间，以及读取的表。"""
+    # (本地日期, UTC 开始, UTC 结束)，时间格式与数据库中的 timestamp 一致
+    days: List[Tuple[str, str, str]]
+    # 数据来源：按小时汇总表或原始记录
+    table: str
+    time_column: str
+    # 与统计范围重叠的原始记录分区文件，逐个附加读取后在 Python 中合并
+    partitions: List[str] = field(default_factory=list)
+
+    def sources(self, conn) -> Iterator[str]:
+        """依次给出要读取的表名；分区只在读取期间附加，不受同时附加数量的限制。"""
+        yield f"main.{self.table}"
+        for path in self.partitions:
+            conn.execute("ATTACH DATABASE ? AS part", (f"file:{path}?mode=ro",))
+            try:
+                yield f"part.{self.table}"
+            finally:
+                conn.execute("DETACH DATABASE part")
+
+    def cte(self) -> Tuple[str, List[str]]:
+        values = ", ".join("(?, ?, ?)" for _ in self.days)
+        params = [value for day in self.days for value in day]
+        return f"WITH days(day, start, stop) AS (VALUES {values})", params
+
+    def join(self, table: str) -> str:
+        return f"days JOIN {table} u ON u.{self.time_column} >= days.start AND u.{self.time_column} < days.stop"
+
+
+def get_window(conn, days=7, tz=timezone.utc, now=None, db_path: Optional[str] = None) -> Window:
     """
-    
-    # 将查询结果加载到Pandas DataFrame
-    df = pd.read_sql_query(query, conn, params=(n_days_ago.strftime('%Y-%m-%d %H:%M:%S'),))
-    
-    # 将timestamp转换为datetime类型
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    
-    # 将UTC时间转换为UTC+8时间
-    df['timestamp'] = df['timestamp'].dt.tz_localize(pytz.UTC)
-    df['timestamp'] = df['timestamp'].dt.tz_convert('Asia/Shanghai')
-    
-    # 创建日期列，只保留日期部分
-    df['date'] = df['timestamp'].dt.date
-    
-    # 将total_fee除以1,000,000
-    df['total_fee'] = df['total_fee'] / 1_000_000
-    
-    return df
-
-def daily_user_fee_stats(df):
-    """统计过去7天，每天每个user的total fee"""
-    # 按日期和用户分组，计算total_fee总和
-    daily_user_fees = df.groupby(['date', 'user_id'])['total_fee'].sum().reset_index()
-    
-    # 计算每个用户的总费用以便排序
-    user_total_fees = daily_user_fees.groupby('user_id')['total_fee'].sum().sort_values(ascending=False)
-    
-    # 按总费用排序的用户列表
-    sorted_users = user_total_fees.index.tolist()
-    
-    # 按日期和用户分组，计算total_fee总和，并按用户总费用排序列
-    pivot = pd.pivot_table(
-        data=df,
-        values='total_fee',
-        index='date',
-        columns='user_id',
-        aggfunc='sum',
-        fill_value=0
-    )
-    
-    # 重新排序列，按用户总费用降序
-    pivot = pivot[sorted_users]
-    
-    # 添加日合计列
-    pivot['总计'] = pivot.sum(axis=1)
-    
-    # 添加用户合计行
-    pivot.loc['总计'] = pivot.sum()
-    
-    return pivot
-
-def model_token_fee_stats(df):
-    """统计过去7天，每个模型的总计input token, output token和total fee"""
-    # 按模型分组，计算input_tokens, output_tokens和total_fee的总和
-    result = df.groupby('model_id').agg({
-        'input_tokens': 'sum',
-        'output_tokens': 'sum',
-        'total_fee': 'sum'
-    }).reset_index()
-    
-    # 按total_fee降序排序
-    result = result.sort_values('total_fee', ascending=False)
-    
-    return result
-
-def top_models_daily_fee(df, top_n=3):
+    最近 days 个本地自然日（含今天）。边界都在整点且存在按小时汇总表时读汇总表，
+    否则读原始记录（传入 db_path 时包括与范围重叠的月份分区）。
+    """
+    today = (now or datetime.now(timezone.utc)).astimezone(tz).date()
+    bounds = []
+    for offset in range(days - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        start = datetime.combine(day, time(), tz).astimezone(timezone.utc)
+        stop = datetime.combine(day + timedelta(days=1), time(), tz).astimezone(timezone.utc)
+        bounds.append((day.isoformat(), start, stop))
+
+    hourly = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='usage_hourly'").fetchone() is not None
+    whole_hours = all(t.minute == 0 and t.second == 0 for _, start, stop in bounds for t in (start, stop))
+    fmt = "%Y-%m-%d %H:%M:%S"
+    days = [(day, start.strftime(fmt), stop.strftime(fmt)) for day, start, stop in bounds]
+    if hourly and whole_hours:
+        return Window(days, "usage_hourly", "hour")
+    # 原始记录由 (timestamp, user_id, model_id, ...) 覆盖索引支持
+    first, last = month_of(days[0][1]), month_of(days[-1][2])
+    partitions = [path for month, path in list_partitions(db_path).items() if first <= month <= last] if db_path else []
+    return Window(days, "model_usage", "timestamp", partitions)
+
+
+def _pivot(cells: Sequence[Tuple[str, str, int]]) -> Tuple[List[str], List[List[Any]]]:
+    """(日期, 列, 费用) -> 以日期为行、按总费用降序排列的列，附加合计行与合计列。"""
+    totals = dict()
+    by_day = dict()
+    for day, column, fee in cells:
+        totals[column] = totals.get(column, 0) + fee
+        by_day.setdefault(day, dict())[column] = fee
+    columns = sorted(totals, key=totals.get, reverse=True)
+
+    rows = []
+    for day in sorted(by_day):
+        fees = [by_day[day].get(column, 0) / FEE_SCALE for column in columns]
+        rows.append([day, *fees, sum(fees)])
+    grand = [totals[column] / FEE_SCALE for column in columns]
+    rows.append([TOTAL, *grand, sum(grand)])
+    return ['date', *columns, TOTAL], rows
+
+
+def daily_user_fee_stats(conn, window: Window):
+    """统计每天每个user的total fee"""
+    cte, params = window.cte()
+    cells = []
+    for table in window.sources(conn):
+        cells += conn.execute(f"""
+            {cte}
+            SELECT days.day, {USER_EXPR}, SUM(u.total_fee)
+            FROM {window.join(table)}
+            GROUP BY 1, 2
+        """, params).fetchall()
+    return _pivot(_merge(cells))
+
+
+def _merge(cells: Sequence[Tuple[str, str, int]]) -> List[Tuple[str, str, int]]:
+    """合并不同来源中相同 (日期, 列) 的费用。"""
+    merged: Dict[Tuple[str, str], int] = dict()
+    for day, column, fee in cells:
+        merged[day, column] = merged.get((day, column), 0) + fee
+    return [(day, column, fee) for (day, column), fee in merged.items()]
+
+
+def model_token_fee_stats(conn, window: Window):
+    """统计每个模型的总计input token, output token和total fee"""
+    cte, params = window.cte()
+    totals: Dict[str, List[int]] = dict()
+    for table in window.sources(conn):
+        for model, *sums in conn.execute(f"""
+            {cte}
+            SELECT u.model_id, SUM(u.input_tokens), SUM(u.output_tokens), SUM(u.total_fee)
+            FROM {window.join(table)}
+            GROUP BY 1
+        """, params):
+            totals[model] = [a + b for a, b in zip(totals.get(model, [0, 0, 0]), sums)]
+    rows = sorted(totals.items(), key=lambda item: item[1][2], reverse=True)
+    return ['model_id', 'input_tokens', 'output_tokens', 'total_fee'], [[model, i, o, fee / FEE_SCALE] for model, (i, o, fee) in rows]
+
+
+def top_models_daily_fee(conn, window: Window, top_n=3):
     """统计total fee前N名的模型，每天每个模型的total fee"""
-    # 获取total fee前N名的模型和它们的总费用
-    top_models_series = df.groupby('model_id')['total_fee'].sum().nlargest(top_n)
-    top_models = top_models_series.index.tolist()
-    
-    # 筛选这些模型的数据
-    top_models_df = df[df['model_id'].isin(top_models)]
-    
-    # 创建透视表
-    pivot = pd.pivot_table(
-        data=top_models_df,
-        values='total_fee',
-        index='date',
-        columns='model_id',
-        aggfunc='sum',
-        fill_value=0
-    )
-    
-    # 按模型总费用排序列
-    pivot = pivot[top_models]
-    
-    # 添加日合计列
-    pivot['总计'] = pivot.sum(axis=1)
-    
-    # 添加模型合计行
-    pivot.loc['总计'] = pivot.sum()
-    
-    return pivot
+    cte, params = window.cte()
+    if not window.partitions:
+        cells = conn.execute(f"""
+            {cte},
+            top AS (
+                SELECT u.model_id FROM {window.join(window.table)}
+                GROUP BY 1 ORDER BY SUM(u.total_fee) DESC LIMIT ?
+            )
+            SELECT days.day, u.model_id, SUM(u.total_fee)
+            FROM {window.join(window.table)}
+            WHERE +u.model_id IN top  -- 一元加号避免改用 idx_model，保持按时间范围读取覆盖索引
+            GROUP BY 1, 2
+        """, [*params, top_n]).fetchall()
+        return _pivot(cells)
+
+    # 跨分区时前 N 名需要按全部来源的合计确定
+    _, models = model_token_fee_stats(conn, window)
+    top = [model for model, *_ in models[:top_n]]
+    cells = []
+    for table in window.sources(conn):
+        cells += conn.execute(f"""
+            {cte}
+            SELECT days.day, u.model_id, SUM(u.total_fee)
+            FROM {window.join(table)}
+            WHERE +u.model_id IN ({", ".join("?" * len(top))})
+            GROUP BY 1, 2
+        """, [*params, *top]).fetchall()
+    return _pivot(_merge(cells))
+
 
 def format_currency(value):
     """将数值格式化为货币形式"""
@@ -131,32 +180,20 @@ def format_number(value):
     """将数值格式化为带千分位的形式"""
     return f"{value:,}"
 
-def dataframe_to_prettytable(df, title=None, is_money_table=True):
-    """将DataFrame转换为PrettyTable格式"""
+def to_prettytable(table, title=None, is_money_table=True):
+    """将 (字段名, 行) 转换为PrettyTable格式"""
+    field_names, rows = table
     pt = PrettyTable()
-    
+
     # 如果有标题，设置标题
     if title:
         pt.title = title
-    
-    # 设置字段名
-    if isinstance(df.index, pd.MultiIndex):
-        # 处理多级索引
-        pt.field_names = [' | '.join(map(str, df.index.names))] + list(df.columns)
-    else:
-        pt.field_names = [df.index.name if df.index.name else '索引'] + list(df.columns)
-    
-    # 添加行
-    for row_idx, row in df.iterrows():
-        if isinstance(row_idx, tuple):
-            # 多级索引
-            row_values = [' | '.join(map(str, row_idx))]
-        else:
-            row_values = [row_idx]
-            
-        # 格式化值
-        for col in df.columns:
-            value = row[col]
+    pt.field_names = field_names
+
+    # 添加行，第一列为行名
+    for row in rows:
+        row_values = [row[0]]
+        for col, value in zip(field_names[1:], row[1:]):
             if col == 'total_fee' or (is_money_table and col != 'input_tokens' and col != 'output_tokens'):
                 # 金额格式
                 row_values.append(format_currency(value))
@@ -165,50 +202,51 @@ def dataframe_to_prettytable(df, title=None, is_money_table=True):
                 row_values.append(format_number(value))
             else:
                 row_values.append(value)
-                
         pt.add_row(row_values)
-    
+
     # 设置对齐方式
     for i, field in enumerate(pt.field_names):
-        if i == 0:  # 索引列左对齐
+        if i == 0:  # 行名列左对齐
             pt.align[field] = 'l'
-        elif field in ['input_tokens', 'output_tokens', 'total_fee'] or field == '总计' or is_money_table:
+        elif field in ['input_tokens', 'output_tokens', 'total_fee'] or field == TOTAL or is_money_table:
             # 数字列右对齐
             pt.align[field] = 'r'
         else:
             pt.align[field] = 'l'
-    
+
     return pt
 
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="按天统计用户与模型的消费")
+    parser.add_argument("--db", default="model_usage.db", help="数据库文件路径")
+    parser.add_argument("--days", type=int, default=14, help="统计最近几个自然日（含今天）")
+    parser.add_argument("--tz", default="Asia/Shanghai", help="按该时区划分日期，例如 UTC、America/New_York")
+    parser.add_argument("--top", type=int, default=3, help="每日统计中包含的消费最高的模型数")
+    args = parser.parse_args()
+    days = args.days
+
     # 连接数据库
-    conn = connect_to_db()
-    
-    days = 14
-    # 获取过去{days}天的数据
-    df = get_last_n_days_data(conn, days=days)
-    
+    conn = connect_to_db(args.db)
+    window = get_window(conn, days=days, tz=ZoneInfo(args.tz), db_path=args.db)
+
     # 1. 统计过去{days}天，每天每个user的total fee
-    user_fee_pivot = daily_user_fee_stats(df)
-    user_fee_table = dataframe_to_prettytable(user_fee_pivot, f"过去{days}天每天每个用户的消费统计(单位:CNY)")
+    user_fee_table = to_prettytable(daily_user_fee_stats(conn, window), f"过去{days}天每天每个用户的消费统计(单位:CNY)")
     print(user_fee_table)
     print("\n")
-    
+
     # 2. 统计过去{days}天，每个模型的总计input token, output token和total fee
-    model_stats = model_token_fee_stats(df)
-    model_stats_table = dataframe_to_prettytable(model_stats, f"过去{days}天各模型使用统计", is_money_table=False)
+    model_stats_table = to_prettytable(model_token_fee_stats(conn, window), f"过去{days}天各模型使用统计", is_money_table=False)
     print(model_stats_table)
     print("\n")
-    
-    # 3. total fee前三名的模型，统计每天每个模型的total fee
-    top_models_pivot = top_models_daily_fee(df)
-    top_models_table = dataframe_to_prettytable(top_models_pivot, f"过去{days}天Top3模型每日消费统计(单位:CNY)")
+
+    # 3. total fee前N名的模型，统计每天每个模型的total fee
+    top_models_table = to_prettytable(top_models_daily_fee(conn, window, args.top), f"过去{days}天Top{args.top}模型每日消费统计(单位:CNY)")
     print(top_models_table)
-    
+
     # 关闭数据库连接
     conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
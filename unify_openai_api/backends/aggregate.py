@@ -0,0 +1,154 @@
+import json
+from typing import Any, Dict, List, Optional, Union
+
+# 跳过 json.loads 对 bytes 的编码探测
+_decode = json.JSONDecoder().decode
+
+
+class _Choice:
+    """单个 choice 已收到的增量，文本按片段保存，结束时拼接一次。"""
+
+    __slots__ = ("content", "reasoning", "refusal", "tool_calls", "function_call", "finish_reason", "logprobs")
+
+    def __init__(self):
+        self.content: List[str] = []
+        self.reasoning: List[str] = []
+        self.refusal: List[str] = []
+        # index -> {"id", "type", "name", "arguments": [片段]}
+        self.tool_calls: Dict[int, Dict[str, Any]] = dict()
+        self.function_call: Optional[Dict[str, Any]] = None
+        self.finish_reason: Optional[str] = None
+        self.logprobs: Optional[Dict[str, List[Any]]] = None
+
+    def add(self, choice: Dict[str, Any]):
+        delta = choice.get("delta") or dict()
+        if delta.get("content"):
+            self.content.append(delta["content"])
+        if delta.get("reasoning_content"):
+            self.reasoning.append(delta["reasoning_content"])
+        if delta.get("refusal"):
+            self.refusal.append(delta["refusal"])
+        for call in delta.get("tool_calls") or ():
+            entry = self.tool_calls.setdefault(call.get("index", len(self.tool_calls)), {"id": None, "type": "function", "name": [], "arguments": []})
+            if call.get("id"):
+                entry["id"] = call["id"]
+            if call.get("type"):
+                entry["type"] = call["type"]
+            function = call.get("function") or dict()
+            if function.get("name"):
+                entry["name"].append(function["name"])
+            if function.get("arguments"):
+                entry["arguments"].append(function["arguments"])
+        if delta.get("function_call"):
+            if self.function_call is None:
+                self.function_call = {"name": [], "arguments": []}
+            for key in ("name", "arguments"):
+                if delta["function_call"].get(key):
+                    self.function_call[key].append(delta["function_call"][key])
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+        logprobs = choice.get("logprobs")
+        if logprobs:
+            if self.logprobs is None:
+                self.logprobs = {"content": [], "refusal": []}
+            for key in ("content", "refusal"):
+                self.logprobs[key].extend(logprobs.get(key) or ())
+
+    def message(self) -> Dict[str, Any]:
+        message: Dict[str, Any] = {
+            "role": "assistant",
+            "content": "".join(self.content) if self.content or not (self.tool_calls or self.function_call) else None,
+            "refusal": "".join(self.refusal) or None,
+            "tool_calls": [
+                {"id": call["id"], "type": call["type"], "function": {"name": "".join(call["name"]), "arguments": "".join(call["arguments"])}}
+                for _, call in sorted(self.tool_calls.items())
+            ] or None,
+            "function_call": {key: "".join(value) for key, value in self.function_call.items()} if self.function_call else None,
+        }
+        if self.reasoning:
+            message["reasoning_content"] = "".join(self.reasoning)
+        return message
+
+
+class ChatCompletionAggregator:
+    """
+    把上游流转换后的 OpenAI 格式 SSE 帧逐帧合并为非流式的 chat.completion body。
+    只保存增量文本，不保留帧本身；透传模式下帧可能在事件中间被切开，未完整的部分暂存到下一帧。
+    上游可能用 CRLF 分隔事件，切分前统一为 LF。
+    """
+
+    def __init__(self):
+        self._pending = b""
+        self._choices: Dict[int, _Choice] = dict()
+        self._fields: Dict[str, Any] = dict()
+        self.usage: Optional[Dict[str, Any]] = None
+
+    def add(self, frame: Union[bytes, str]):
+        if isinstance(frame, str):
+            frame = frame.encode()
+        data = self._pending + frame if self._pending else frame
+        if b"\r" in data:
+            # 末尾单独的 \r 留到与下一帧拼接后再替换
+            data = data.replace(b"\r\n", b"\n")
+        *events, self._pending = data.split(b"\n\n")
+        for event in events:
+            self._add_event(event)
+
+    def flush(self):
+        """流结束时解析最后一个没有以空行结尾的事件。"""
+        if self._pending:
+            event, self._pending = self._pending, b""
+            self._add_event(event)
+
+    @property
+    def empty(self) -> bool:
+        """没有解析到任何 choice。"""
+        return not self._choices
+
+    def _add_event(self, event: bytes):
+        for line in event.splitlines():
+            if line.startswith(b"data:"):
+                self._add_chunk(line[5:].strip())
+
+    def _add_chunk(self, payload: bytes):
+        if not payload or payload == b"[DONE]":
+            return
+        try:
+            chunk = _decode(payload.decode())
+        except ValueError:
+            return
+        # 错误帧没有 choices，错误本身记录在 ApiResponse.error 中
+        if not isinstance(chunk, dict) or "choices" not in chunk:
+            return
+        if not self._fields:
+            self._fields = {key: chunk.get(key) for key in ("id", "created", "model", "service_tier", "system_fingerprint")}
+        for choice in chunk["choices"] or ():
+            index = choice.get("index", 0)
+            state = self._choices.get(index)
+            if state is None:
+                state = self._choices[index] = _Choice()
+            state.add(choice)
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+
+    def output_text(self) -> str:
+        """已生成的全部文本，用于没有收到 usage 时估计输出 token。"""
+        texts: List[str] = []
+        for choice in self._choices.values():
+            texts += choice.reasoning
+            texts += choice.content
+            for call in choice.tool_calls.values():
+                texts += call["name"] + call["arguments"]
+        return "".join(texts)
+
+    def result(self) -> Dict[str, Any]:
+        """与 ChatCompletion.model_dump() 结构相同的 body。"""
+        return {
+            **self._fields,
+            "object": "chat.completion",
+            "choices": [
+                {"index": index, "message": choice.message(), "finish_reason": choice.finish_reason, "logprobs": choice.logprobs}
+                for index, choice in sorted(self._choices.items())
+            ],
+            "usage": self.usage,
+        }
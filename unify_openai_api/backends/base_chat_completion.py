@@ -1,25 +1,41 @@
 from abc import abstractmethod
+import asyncio
+import time
 
 from openai._exceptions import OpenAIError
 from anthropic._exceptions import AnthropicError
 
 from openai.types.chat import ChatCompletion
+from openai.types.completion_usage import CompletionUsage
 import json
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
 from dataclasses import dataclass, field
-from typing import Any, List
+from typing import Any, List, Optional, Set
 
 import logging
 
 from unify_openai_api.types.state import AppState
 
-from ..request_modifers.interface import RequestModifier, modify_request
-from ..response_handlers.interface import ResponseHandler, handle_response, handle_response_frames
-from ..types.response import ApiResponse
+from ..logger import is_sampled
+from ..metrics.gateway import GatewayMetrics
+from ..metrics.registry import Labels
+from ..request_modifers.compiled import RequestPipeline
+from .aggregate import ChatCompletionAggregator
+from .hedged import Hedge
+from ..request_modifers.interface import RequestModifier
+from ..response_cache.cache import CachedResponse, ResponseCache
+from ..response_handlers.interface import ResponseHandler, handle_estimated_usage, handle_response, handle_response_frames, handle_replay, handlers_for_stream
+from ..types.response import ApiResponse, SerializedChunk
 from ..types.llm_api import LLMApi
-
-import traceback
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.disconnect import DisconnectAwareStreamingResponse
+from ..utils.fair_scheduler import FairScheduler, Slot
+from ..utils.idle_timeout import UpstreamStalled, idle_timeout
+from ..utils.rate_limiter import Ticket, UpstreamLimiter
+from ..utils.request_key import request_key
+from ..utils.singleflight import Flight, SingleFlight
+from ..utils.token_estimator import FAMILIES, ContextWindowExceeded, StreamOutputCounter, TokenEstimator
 
 logger = logging.getLogger(__name__)
 
@@ -28,51 +44,348 @@ logger = logging.getLogger(__name__)
 class BaseChatCompletion(LLMApi):
     request_modifiers: List[RequestModifier]
     response_handlers: List[ResponseHandler]
-    
+    # 上游 provider 名称，用作指标标签
+    provider: str = field(default="", kw_only=True)
+    # 首帧过慢时向备用路由发出相同请求
+    hedge: Optional[Hedge] = field(default=None, kw_only=True)
+    # 同一 provider 的模型共享的熔断器
+    breaker: Optional[CircuitBreaker] = field(default=None, kw_only=True)
+    # 同一 provider 的模型共享的准入调度器，限制上游并发
+    scheduler: Optional[FairScheduler] = field(default=None, kw_only=True)
+    # 上游模型的 RPM / TPM 与自适应并发限制，target 相同的模型共享
+    limiter: Optional[UpstreamLimiter] = field(default=None, kw_only=True)
+    # 本地 token 估计，同一模型系列共享
+    estimator: TokenEstimator = field(default_factory=lambda: TokenEstimator(FAMILIES["default"]), kw_only=True)
+    # 输入估计超过该值的请求不调用上游，直接拒绝
+    context_window: Optional[int] = field(default=None, kw_only=True)
+    # 非流式请求也以流式调用上游，在网关内合并为完整响应
+    stream_upstream: bool = field(default=False, kw_only=True)
+    # 上游流相邻事件的最长间隔（秒），超过时中止调用，为空时只受连接池的读取超时限制
+    idle_timeout: Optional[float] = field(default=None, kw_only=True)
+
+    def __post_init__(self):
+        # 注册时把 modifier 链和字段拆分编译为一次遍历
+        self.pipeline = RequestPipeline(self.request_modifiers, self._field_set())
+
     @abstractmethod
-    def _make_request_inner(self, data: dict) -> Any: ...
+    def _field_set(self) -> Set[str]:
+        """SDK create() 直接支持的参数，其余字段放入 extra_body。"""
+
+    @abstractmethod
+    def _make_request_inner(self, data: dict) -> Any:
+        """data 已经过 pipeline 处理，可以直接作为 SDK 参数。"""
+
+    def _streaming_request(self, data: dict) -> dict:
+        """stream_upstream 时发往上游的参数。复制一份，obj.request 仍用于缓存 key 与合并请求。"""
+        return {**data, "stream": True}
 
     async def make_request(self, data: dict) -> ApiResponse:
-        data = modify_request(self.request_modifiers, data)
+        if self.hedge is None:
+            return self._prepare(data)
+        # 每条备用路由有自己的 pipeline，在原始请求被修改前准备好
+        hedges = []
+        for api in self.hedge.alternates:
+            try:
+                hedges.append((api, api._prepare(dict(data))))
+            except ContextWindowExceeded as e:
+                # 上下文窗口较小的备用路由不参与对冲
+                logger.info("Skipping hedge alternate: %s", e)
+        obj = self._prepare(data)
+        obj.hedges = hedges
+        return obj
 
+    def _prepare(self, data: dict) -> ApiResponse:
+        data, user_id = self.pipeline(data)
         stream = data.get("stream", False)
-        user_id = data.get("user_id", None)
+        # 按实际发往上游的参数估计，包含 modifier 注入的内容
+        prompt_tokens = self.estimator.count_request(data)
+        if self.context_window is not None and prompt_tokens > self.context_window:
+            raise ContextWindowExceeded(data.get("model", ""), prompt_tokens, self.context_window)
 
-        response = self._make_request_inner(data)
-        
-        return ApiResponse(response = response, stream = stream, user_id = user_id)
+        return ApiResponse(request = data, stream = stream, user_id = user_id, prompt_tokens = prompt_tokens)
     
+    def _labels(self, obj: ApiResponse) -> Labels:
+        return (obj.request.get("model", ""), self.provider)
+
     async def handle_response(self, obj: ApiResponse, state: AppState):
-        response: ChatCompletion = await obj.response
-        
+        state.metrics.requests.inc(self._labels(obj))
+        cache: Optional[ResponseCache] = state.response_cache
+        coalescer: Optional[SingleFlight] = state.coalescer
+
+        key = request_key(obj.request) if cache is not None or coalescer is not None else None
+        cache_key = key if cache is not None and cache.cacheable(obj.request) else None
+        if cache_key is not None:
+            cached = await cache.get(cache_key)
+            if cached is not None:
+                return self._replay_response(obj, state, cached)
+
+        if coalescer is None:
+            result = await self._fetch(obj, state, cache, cache_key)
+            return self._streaming_response(obj, state, result) if obj.stream else result
+
+        # 相同请求合并为一次上游调用
+        flight, is_leader = coalescer.join(key, obj.stream)
+        if is_leader:
+            flight.start(self._fetch(obj, state, cache, cache_key), leader=obj)
+        result = await flight.wait_opened()
+        if obj.stream:
+            return self._streaming_response(obj, state, self._follow_stream(obj, state, flight, is_leader))
+        if not is_leader:
+            state.metrics.served.inc((*self._labels(obj), "coalesced"))
+            handle_replay(self.response_handlers, state, obj.user_id, flight.usage, "coalesced")
+        return result
+
+    def _streaming_response(self, obj: ApiResponse, state: AppState, frames) -> StreamingResponse:
+        """客户端断开时关闭帧迭代器，上游调用随之取消。"""
+        labels = self._labels(obj)
+        return DisconnectAwareStreamingResponse(
+            frames,
+            on_disconnect=lambda: state.metrics.client_disconnects.inc((*labels, "stream")),
+            media_type="text/event-stream",
+        )
+
+    def _fetch(self, obj: ApiResponse, state: AppState, cache: Optional[ResponseCache], cache_key: Optional[str]):
+        if obj.hedges:
+            return self.hedge.fetch(self, obj, state, cache, cache_key)
+        return self._fetch_response(obj, state, cache, cache_key)
+
+    async def _fetch_response(self, obj: ApiResponse, state: AppState, cache: Optional[ResponseCache], cache_key: Optional[str]):
+        """调用上游。非流式返回响应 body，流式返回 SSE 帧的异步迭代器。"""
+        metrics: GatewayMetrics = state.metrics
+        labels = self._labels(obj)
+        breaker = self.breaker
+        try:
+            probe = breaker.before_call() if breaker is not None else False
+        except Exception as e:
+            metrics.errors.inc((*labels, type(e).__name__))
+            raise
+
+        ticket = Ticket()
+        slot = Slot()
+        try:
+            if self.limiter is not None:
+                # 先等待上游模型的预算，避免排队时占用 provider 的并发名额
+                waited = time.perf_counter()
+                ticket = await self.limiter.acquire(obj.request, obj.prompt_tokens)
+                metrics.rate_limit_wait.observe(labels, time.perf_counter() - waited)
+            if self.scheduler is not None:
+                slot = await self.scheduler.acquire(obj.user_id, self.scheduler.lane_for(obj.user_id, obj.lane), metrics)
+        except BaseException as e:
+            self._release_limiter(ticket, obj, metrics, labels, e)
+            if breaker is not None:
+                breaker.after_call(0.0, e, probe)
+            raise
+
+        obj.started_at = time.perf_counter()
+        metrics.upstream_started(labels)
+        aggregate = self.stream_upstream and not obj.stream
+        try:
+            obj.response = self._make_request_inner(self._streaming_request(obj.request) if aggregate else obj.request)
+            response: ChatCompletion = await obj.response
+        except BaseException as e:
+            duration = time.perf_counter() - obj.started_at
+            metrics.upstream_finished(labels, duration, e)
+            slot.release()
+            if isinstance(e, asyncio.CancelledError):
+                # 客户端断开或对冲落败：请求已发出，输入按估计计费，没有收到的输出无法估计
+                self._record_estimated_usage(obj, state, labels, 0)
+            self._release_limiter(ticket, obj, metrics, labels, e)
+            if breaker is not None:
+                breaker.after_call(duration, e, probe)
+            raise
+
+        if aggregate:
+            return await self._aggregate_response(obj, state, labels, response, cache, cache_key, probe, slot, ticket)
         if not obj.stream:
+            duration = time.perf_counter() - obj.started_at
+            metrics.upstream_finished(labels, duration)
+            slot.release()
+            if breaker is not None:
+                breaker.after_call(duration, None, probe)
+            if isinstance(response.usage, CompletionUsage):
+                obj.usage = response.usage
+            self._release_limiter(ticket, obj, metrics, labels, None)
             try:
-                logger.debug(f"response: {response}")
+                if is_sampled():
+                    logger.info("response: %s", response)
                 handle_response(self.response_handlers, state, obj.user_id, response)
-                return response.model_dump()
+                body = response.model_dump()
             except OpenAIError as e:
-                logger.warning(f"OpenAI API error: {e}")
+                logger.warning("OpenAI API error: %s", e)
                 raise HTTPException(status_code=500, detail=f"OpenAI API error: {e}")
+            if obj.usage is not None and cache_key is not None:
+                await cache.put(cache_key, CachedResponse(stream=False, body=body, usage=obj.usage))
+            self._log_summary(obj, labels, duration)
+            return body
         else:  
-            return StreamingResponse(self._response_stream(obj, state, response), media_type="text/event-stream")
+            frames = self._response_stream(obj, state, response)
+            if cache_key is not None:
+                frames = self._cache_stream(obj, frames, cache, cache_key)
+            return self._observe_stream(obj, state, labels, frames, probe, slot, ticket)
+
+    async def _aggregate_response(self, obj: ApiResponse, state: AppState, labels: Labels, response: Any,
+                                  cache: Optional[ResponseCache], cache_key: Optional[str], probe: bool, slot: Slot, ticket: Ticket):
+        """stream_upstream：按流式处理上游响应（计费、首帧时间与停滞检测与流式请求相同），逐帧合并为非流式 body。"""
+        aggregator = ChatCompletionAggregator()
+        frames = self._response_stream(obj, state, response)
+        async for _ in self._observe_stream(obj, state, labels, frames, probe, slot, ticket, aggregator):
+            pass
+        if obj.error is not None:
+            if isinstance(obj.error, UpstreamStalled):
+                raise HTTPException(status_code=504, detail=f"Upstream stalled: {obj.error}")
+            raise HTTPException(status_code=502, detail=f"Upstream stream error: {obj.error}")
+        if aggregator.empty:
+            raise HTTPException(status_code=502, detail="Upstream stream ended without any choice")
+        body = aggregator.result()
+        # 只缓存收到上游 usage 的完整响应，估计的 usage 不缓存
+        if aggregator.usage is not None and cache_key is not None:
+            await cache.put(cache_key, CachedResponse(stream=False, body=body, usage=obj.usage))
+        return body
+
+    async def _observe_stream(self, obj: ApiResponse, state: AppState, labels: Labels, frames, probe: bool = False, slot: Optional[Slot] = None, ticket: Optional[Ticket] = None,
+                              aggregator: Optional[ChatCompletionAggregator] = None):
+        """
+        记录首帧时间、帧间隔与流的总耗时；没有收到 usage 时按已发出的内容估计用量。
+        传入 aggregator 时帧交给它合并，不再另外保存。
+        """
+        metrics: GatewayMetrics = state.metrics
+        last = obj.started_at
+        ttft = None
+        count = 0
+        completed = False
+        # 已发出的帧，只在没有收到 usage 时用于估计输出 token
+        sent = StreamOutputCounter(self.estimator) if aggregator is None else None
+        try:
+            async for frame in frames:
+                if aggregator is None:
+                    sent.add(frame)
+                else:
+                    aggregator.add(frame)
+                now = time.perf_counter()
+                if ttft is None:
+                    ttft = now - last
+                    metrics.ttft.observe(labels, ttft)
+                else:
+                    metrics.inter_token.observe(labels, now - last)
+                last = now
+                count += 1
+                yield frame
+            if aggregator is not None:
+                aggregator.flush()
+            completed = True
+        finally:
+            # 被下游关闭时停在 yield 处的内层生成器不会自动关闭，先关闭以释放上游连接
+            await frames.aclose()
+            duration = time.perf_counter() - obj.started_at
+            metrics.upstream_finished(labels, duration, obj.error)
+            if slot is not None:
+                slot.release()
+            # 未读完且没有错误说明被下游关闭，不计入健康统计
+            error = obj.error if completed or obj.error is not None else asyncio.CancelledError()
+            # 首帧之前被取消（对冲落败或客户端断开）时请求已经发出，至少按估计的输入计费
+            if obj.usage is None and (count > 0 or isinstance(error, asyncio.CancelledError)):
+                completion_tokens = sent.tokens() if aggregator is None else self.estimator.count_text(aggregator.output_text())
+                self._record_estimated_usage(obj, state, labels, completion_tokens)
+            if ticket is not None:
+                self._release_limiter(ticket, obj, metrics, labels, error)
+            if self.breaker is not None:
+                self.breaker.after_call(ttft if ttft is not None else duration, error, probe)
+            self._log_summary(obj, labels, duration, frames=count, ttft=ttft)
+
+    def _record_estimated_usage(self, obj: ApiResponse, state: AppState, labels: Labels, completion_tokens: int):
+        """上游调用在收到 usage 之前结束（被取消、出错或上游未返回 usage），上游已经产生的费用按本地估计记账。"""
+        prompt_tokens = obj.prompt_tokens or 0
+        obj.usage = CompletionUsage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+        logger.warning("No usage received for %s (stream=%s), billing estimate input_tokens=%d output_tokens=%d",
+                       labels[0], obj.stream, prompt_tokens, completion_tokens)
+        state.metrics.estimated_usage.inc(labels)
+        handle_estimated_usage(self.response_handlers, state, obj.user_id, obj.usage)
+
+    def _release_limiter(self, ticket: Ticket, obj: ApiResponse, metrics: GatewayMetrics, labels: Labels, error: Optional[BaseException]):
+        """用本次调用计费的 usage 修正 TPM 预留，并按是否被限流调整并发上限。"""
+        limiter = self.limiter
+        if limiter is None:
+            return
+        limiter.release(ticket, obj.usage, error)
+        if limiter.concurrency is not None:
+            metrics.concurrency_limit.set(labels, limiter.concurrency.limit)
+
+    def _log_summary(self, obj: ApiResponse, labels: Labels, duration: float, frames: Optional[int] = None, ttft: Optional[float] = None):
+        """每个上游调用一行摘要，未采样的请求只有这一行。"""
+        usage = obj.usage
+        logger.info(
+            "completed model=%s provider=%s user=%s stream=%s duration=%.3fs ttft=%s frames=%s input_tokens=%s output_tokens=%s error=%r",
+            labels[0], labels[1], obj.user_id, obj.stream, duration,
+            f"{ttft:.3f}s" if ttft is not None else "-", frames if frames is not None else "-",
+            usage.prompt_tokens if usage else "-", usage.completion_tokens if usage else "-", obj.error,
+        )
+
+    async def _follow_stream(self, obj: ApiResponse, state: AppState, flight: Flight, is_leader: bool):
+        frames = flight.subscribe()
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            # 最后一个读者离开时 subscribe 取消上游调用
+            await frames.aclose()
+        # 领头请求已由 response_handlers 记账，跟随者按零费用记录
+        if not is_leader and flight.done:
+            state.metrics.served.inc((*self._labels(obj), "coalesced"))
+            handle_replay(self.response_handlers, state, obj.user_id, flight.usage, "coalesced")
+
+    def _replay_response(self, obj: ApiResponse, state: AppState, cached: CachedResponse):
+        """命中缓存：按零费用记录 usage 并回放缓存的响应。"""
+        state.metrics.served.inc((*self._labels(obj), "cache"))
+        handle_replay(self.response_handlers, state, obj.user_id, cached.usage, "cache")
+        if obj.stream:
+            return StreamingResponse(cached.iter_frames(), media_type="text/event-stream")
+        return cached.body
+
+    async def _cache_stream(self, obj: ApiResponse, frames, cache: ResponseCache, cache_key: str):
+        recorded = []
+        try:
+            async for frame in frames:
+                recorded.append(frame if isinstance(frame, bytes) else frame.encode())
+                yield frame
+        finally:
+            await frames.aclose()
+        # 只缓存收到最终 usage 的完整流
+        if obj.usage is not None:
+            await cache.put(cache_key, CachedResponse(stream=True, frames=recorded, usage=obj.usage))
 
     async def _response_stream(self, obj: ApiResponse, state: AppState, response: ChatCompletion):
+        handlers = handlers_for_stream(self.response_handlers)
+        sampled = is_sampled()
         try:
-            async for event in response:
-                logger.debug(f"event: {event}")
-                event = handle_response_frames(self.response_handlers, state, obj.user_id, event)
-                if event is not None:
+            async for event in idle_timeout(response, self.idle_timeout):
+                if sampled:
+                    logger.info("event: %s", event)
+                event = handle_response_frames(handlers, state, obj.user_id, event)
+                if getattr(event, "usage", None) is not None:
+                    obj.usage = event.usage
+                if isinstance(event, SerializedChunk):
+                    yield event.data
+                elif event is not None:
                     yield f"data: {json.dumps(event.model_dump())}\n\n"
             # 可选：发送结束标记
             # yield "data: [DONE]\n\n"
+        except UpstreamStalled as e:
+            obj.error = e
+            logger.warning("Stream stalled: %s", e)
+            yield f"data: {json.dumps({'error': f'stream error: {e}'})}\n\n"
         except OpenAIError as e:
-            logger.warning(f"Stream error: {e}")
+            obj.error = e
+            logger.warning("Stream error: %s", e)
             # 可选：发送错误信息到流中
             yield f"data: {json.dumps({'error': f'stream error: {e}'})}\n\n"
         except AnthropicError as e:
-            logger.warning(f"Stream error: {e}")
+            obj.error = e
+            logger.warning("Stream error: %s", e)
             yield f"data: {json.dumps({'error': f'stream error: {e}'})}\n\n"
         except Exception as e:
-            traceback.print_exc()
-            logger.warning(f"Unexpected error during streaming: {e}")
-            yield f"data: {json.dumps({'error': f'Internal server error: {e}'})}\n\n"    
\ No newline at end of file
+            obj.error = e
+            logger.exception("Unexpected error during streaming: %s", e)
+            yield f"data: {json.dumps({'error': f'Internal server error: {e}'})}\n\n"
+        finally:
+            # 客户端断开时立即关闭上游连接，上游随之停止生成
+            await response.close()    
\ No newline at end of file
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from ..registry.config import HedgeConfig
+from ..response_cache.cache import ResponseCache
+from ..types.response import ApiResponse
+from ..types.state import AppState
+
+if TYPE_CHECKING:
+    from .base_chat_completion import BaseChatCompletion
+
+logger = logging.getLogger(__name__)
+
+# 样本数少于该值时使用 initial_delay
+_MIN_SAMPLES = 20
+
+
+class Hedge:
+    """
+    对冲请求：主路由在等待时间内没有返回首帧时，向备用路由发出相同请求。
+    采用最先返回首帧的结果并取消其余调用；主路由在等待时间内失败时立即切换到下一条路由。
+    等待时间取主路由最近首帧时间的分位数。
+    """
+
+    def __init__(self, config: HedgeConfig, alternates: List["BaseChatCompletion"], samples: Optional[Deque[float]] = None):
+        self.config = config
+        self.alternates = alternates
+        # 重新加载时沿用配置未变的模型的首帧时间样本
+        self._samples: Deque[float] = samples if samples is not None else deque(maxlen=config.window)
+
+    def delay(self) -> float:
+        config = self.config
+        if len(self._samples) < _MIN_SAMPLES:
+            return config.initial_delay
+        samples = sorted(self._samples)
+        value = samples[min(len(samples) - 1, int(len(samples) * config.percentile))]
+        return min(config.max_delay, max(config.min_delay, value))
+
+    def observe(self, ttft: float):
+        self._samples.append(ttft)
+
+    async def fetch(self, primary: "BaseChatCompletion", obj: ApiResponse, state: AppState,
+                    cache: Optional[ResponseCache], cache_key: Optional[str]):
+        """与 BaseChatCompletion._fetch_response 返回值相同：非流式为 body，流式为帧迭代器。"""
+        attempts: List[Tuple["BaseChatCompletion", ApiResponse]] = [(primary, obj), *obj.hedges]
+        tasks: Dict[asyncio.Task, int] = dict()
+        errors: List[BaseException] = []
+        started = time.perf_counter()
+        delay = self.delay()
+        launched = 0
+        winner: Optional[int] = None
+        result: Any = None
+
+        def launch():
+            nonlocal launched
+            api, attempt = attempts[launched]
+            tasks[asyncio.create_task(_first_frame(api, attempt, state, cache, cache_key))] = launched
+            launched += 1
+
+        launch()
+        try:
+            while winner is None and (tasks or launched < len(attempts)):
+                if not tasks:
+                    # 当前路由都已失败，不再等待
+                    launch()
+                    continue
+                timeout = None
+                if launched < len(attempts):
+                    timeout = max(0.0, started + delay * launched - time.perf_counter())
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info("Hedging %s after %.3fs with %s",
+                                obj.request.get("model"), time.perf_counter() - started, attempts[launched][1].request.get("model"))
+                    launch()
+                    continue
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    first, frames = task.result()
+                    # 首帧就是错误帧的流视为失败，仍有其他路由时丢弃
+                    if attempts[index][1].error is not None and (tasks or launched < len(attempts)):
+                        errors.append(attempts[index][1].error)
+                        await _close(frames)
+                        continue
+                    if winner is None:
+                        winner, result = index, (_prepend(first, frames) if attempts[index][1].stream else frames)
+                    else:
+                        await _close(frames)
+        finally:
+            await _cancel(tasks)
+
+        if launched > 1:
+            outcome = "none" if winner is None else ("primary" if winner == 0 else "alternate")
+            state.metrics.hedges.inc((*primary._labels(obj), outcome))
+        # 主路由输掉时首帧时间至少为已等待的时间
+        if winner == 0:
+            self.observe(attempts[0][1].first_frame_at - started)
+        elif winner is not None:
+            self.observe(time.perf_counter() - started)
+
+        if winner is None:
+            raise errors[0]
+        if winner == 0:
+            return result
+        # 合并请求与日志读取的是主路由的 ApiResponse，同步实际返回结果的路由
+        winning = attempts[winner][1]
+        if not obj.stream:
+            obj.usage = winning.usage
+            return result
+        return _mirror(result, winning, obj)
+
+
+async def _first_frame(api: "BaseChatCompletion", attempt: ApiResponse, state: AppState,
+                       cache: Optional[ResponseCache], cache_key: Optional[str]) -> Tuple[Any, Any]:
+    """
+    返回 (首帧, 结果)。流式结果是已经开始迭代的帧迭代器，落败时直接关闭它，
+    其 finally 随之释放连接、并发名额与限流预留并记账；只有胜出的流才包上首帧。
+    """
+    result = await api._fetch_response(attempt, state, cache, cache_key)
+    if not attempt.stream:
+        attempt.first_frame_at = time.perf_counter()
+        return None, result
+    try:
+        first = await result.__anext__()
+    except StopAsyncIteration:
+        first = None
+    attempt.first_frame_at = time.perf_counter()
+    return first, result
+
+
+async def _prepend(first: Any, frames) -> AsyncIterator[Any]:
+    try:
+        if first is not None:
+            yield first
+        async for frame in frames:
+            yield frame
+    finally:
+        await frames.aclose()
+
+
+async def _mirror(frames, source: ApiResponse, target: ApiResponse) -> AsyncIterator[Any]:
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        await frames.aclose()
+        target.usage, target.error = source.usage, source.error
+
+
+async def _close(frames: Any):
+    """非流式结果是 body，没有需要关闭的资源。"""
+    if hasattr(frames, "aclose"):
+        await frames.aclose()
+
+
+async def _cancel(tasks: Dict[asyncio.Task, int]):
+    """取消落败的调用；已经拿到首帧的流需要显式关闭以释放连接。"""
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, tuple):
+            await _close(result[1])
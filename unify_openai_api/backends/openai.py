@@ -1,18 +1,119 @@
+import json
+import logging
+import re
 from dataclasses import dataclass
+from typing import Set
 
 from openai import AsyncOpenAI
+from openai._exceptions import OpenAIError
+from openai._response import AsyncAPIResponse
+from openai.types.chat import ChatCompletionChunk
 
-from ..utils.split_params import split_params
+from ..logger import is_sampled
+from ..response_handlers.interface import handle_response_frames
+from ..types.response import ApiResponse
+from ..types.state import AppState
+from ..utils.idle_timeout import UpstreamStalled, idle_timeout
 from .base_chat_completion import BaseChatCompletion
 
+logger = logging.getLogger(__name__)
+
+# 只有携带 usage 的最后一个 chunk 才需要解析，其余事件原样转发
+_USAGE_PATTERN = re.compile(rb'"usage"\s*:\s*\{')
+
+# 事件之间的空行，上游可能使用 CRLF
+_EVENT_SEPARATOR = re.compile(rb"\r?\n\r?\n")
+
+
+def _events_end(data: bytes) -> int:
+    """data 中最后一个完整事件（含结尾空行）结束的位置，没有完整事件时为 0。"""
+    index = data.rfind(b"\n\n")
+    end = index + 2 if index >= 0 else 0
+    if b"\r" in data:
+        index = data.rfind(b"\r\n\r\n")
+        if index >= 0:
+            end = max(end, index + 4)
+    return end
+
+
 @dataclass
 class OpenAIProxy(BaseChatCompletion):
     client: AsyncOpenAI
-    
+    # 流式请求直接转发上游 SSE 字节，不经过 pydantic 解析与重新序列化。
+    # 仅适用于 response_handlers 不改写 chunk 的模型（例如只做计费）。
+    passthrough: bool = False
+
+    def _field_set(self) -> Set[str]:
+        return OPENAI_FIELD_SET
+
+    def _streaming_request(self, data: dict) -> dict:
+        # 合并后的响应需要 usage，流式时只有最后一个 chunk 携带
+        return {**data, "stream": True, "stream_options": {**(data.get("stream_options") or dict()), "include_usage": True}}
+
     def _make_request_inner(self, data):
-        support_fields, extra_fields = split_params(OPENAI_FIELD_SET, data)
-        support_fields.setdefault("extra_body", dict()).update(extra_fields)
-        return self.client.chat.completions.create(**support_fields)
+        if self.passthrough and data.get("stream", False):
+            return self._open_raw_stream(data)
+        return self.client.chat.completions.create(**data)
+
+    async def _open_raw_stream(self, fields: dict) -> AsyncAPIResponse:
+        # 进入 context manager 时才真正发出请求，连接在 _passthrough_stream 结束时释放
+        return await self.client.chat.completions.with_streaming_response.create(**fields).__aenter__()
+
+    def _response_stream(self, obj: ApiResponse, state: AppState, response):
+        if isinstance(response, AsyncAPIResponse):
+            return self._passthrough_stream(obj, state, response)
+        return super()._response_stream(obj, state, response)
+
+    async def _passthrough_stream(self, obj: ApiResponse, state: AppState, response: AsyncAPIResponse):
+        """
+        按完整事件转发上游字节：每次只发出到最后一个空行为止的部分，其余留到下一块。
+        usage 在发出所在的事件之前解析，客户端此时断开也已记账；出错时错误帧接在完整事件之后。
+        """
+        pending = b""
+        sampled = is_sampled()
+        try:
+            async for chunk in idle_timeout(response.iter_bytes(), self.idle_timeout):
+                if sampled:
+                    logger.info("chunk: %r", chunk)
+                data = pending + chunk if pending else chunk
+                end = _events_end(data)
+                if not end:
+                    pending = data
+                    continue
+                events, pending = data[:end], data[end:]
+                if _USAGE_PATTERN.search(events):
+                    self._record_usage_events(obj, state, events)
+                yield events
+            if pending:
+                # 最后一个事件没有以空行结尾
+                events, pending = pending, b""
+                if _USAGE_PATTERN.search(events):
+                    self._record_usage_events(obj, state, events)
+                yield events
+        except UpstreamStalled as e:
+            obj.error = e
+            logger.warning("Stream stalled: %s", e)
+            yield f"data: {json.dumps({'error': f'stream error: {e}'})}\n\n"
+        except OpenAIError as e:
+            obj.error = e
+            logger.warning("Stream error: %s", e)
+            yield f"data: {json.dumps({'error': f'stream error: {e}'})}\n\n"
+        except Exception as e:
+            obj.error = e
+            logger.exception("Unexpected error during streaming: %s", e)
+            yield f"data: {json.dumps({'error': f'Internal server error: {e}'})}\n\n"
+        finally:
+            await response.close()
+
+    def _record_usage_events(self, obj: ApiResponse, state: AppState, events: bytes):
+        for event in _EVENT_SEPARATOR.split(events):
+            if not _USAGE_PATTERN.search(event):
+                continue
+            for line in event.splitlines():
+                if line.startswith(b"data:"):
+                    frame = ChatCompletionChunk.model_validate_json(line[5:].strip())
+                    obj.usage = frame.usage
+                    handle_response_frames(self.response_handlers, state, obj.user_id, frame)
 
 OPENAI_FIELD_SET = {
     "messages",
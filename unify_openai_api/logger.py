@@ -1,4 +1,100 @@
+"""
+热路径友好的日志配置。
+
+- 日志记录经 QueueHandler 入队，由后台线程格式化并输出，事件循环只负责入队
+- QueueHandler 不在调用线程格式化消息，%s 参数的 repr 延迟到后台线程
+- 每个请求有 correlation id，所有日志行都带上
+- 按比例采样：被采样的请求完整记录请求体和每个流事件，其余只记录一行摘要
+"""
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# (request_id, 是否完整记录)
+_request_context: ContextVar[Tuple[str, bool]] = ContextVar("request_context", default=("-", False))
+
+
+@dataclass
+class LogConfig:
+    level: str = "INFO"
+    # 完整记录的请求比例，0.01 表示 1%
+    sample_rate: float = 0.01
+    # 为空时输出到 stderr
+    file: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "LogConfig":
+        default = cls()
+        return cls(
+            level=os.getenv("UNIFY_LOG_LEVEL", default.level).upper(),
+            sample_rate=float(os.getenv("UNIFY_LOG_SAMPLE_RATE", default.sample_rate)),
+            file=os.getenv("UNIFY_LOG_FILE") or None,
+        )
+
+
+_config = LogConfig()
+
+
+class RequestIdFilter(logging.Filter):
+    """在调用线程中读取当前请求的 correlation id。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_context.get()[0]
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """标准 QueueHandler 会在调用线程中格式化消息，这里推迟到监听线程。"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(config: Optional[LogConfig] = None) -> logging.handlers.QueueListener:
+    global _config
+    _config = config or LogConfig.from_env()
+
+    if _config.file:
+        target: logging.Handler = logging.FileHandler(_config.file)
+    else:
+        target = logging.StreamHandler()
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(_config.level)
+
+    listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+    listener.start()
+
+    def _stop():
+        # 调用方可能已经手动 stop
+        if listener._thread is not None:
+            listener.stop()
+    atexit.register(_stop)
+    return listener
+
+
+def start_request(request_id: Optional[str] = None) -> str:
+    """为当前请求设置 correlation id 并决定是否完整记录。"""
+    request_id = request_id or uuid.uuid4().hex[:12]
+    _request_context.set((request_id, random.random() < _config.sample_rate))
+    return request_id
+
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
\ No newline at end of file
+def is_sampled() -> bool:
+    """当前请求是否完整记录请求体与流事件。"""
+    return _request_context.get()[1]
@@ -0,0 +1,72 @@
+import asyncio
+from typing import Optional
+
+from .registry import Counter, Gauge, Histogram, Labels, Registry
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 20, 60)
+INTER_TOKEN_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120)
+
+MODEL_LABELS = ("model", "provider")
+
+
+class GatewayMetrics:
+    """网关指标，标签为上游模型 id 与 provider。"""
+
+    def __init__(self):
+        self.registry = Registry()
+        r = self.registry.register
+        self.requests = r(Counter("unify_requests_total", "Chat completion requests received.", MODEL_LABELS))
+        self.served = r(Counter("unify_served_without_upstream_total", "Requests answered without their own upstream call.", (*MODEL_LABELS, "source")))
+        self.errors = r(Counter("unify_errors_total", "Upstream errors by exception type.", (*MODEL_LABELS, "type")))
+        self.inflight = r(Gauge("unify_inflight_requests", "Upstream calls currently in progress.", MODEL_LABELS))
+        self.latency = r(Histogram("unify_request_duration_seconds", "Upstream call duration until the last byte.", MODEL_LABELS, LATENCY_BUCKETS))
+        self.ttft = r(Histogram("unify_time_to_first_token_seconds", "Time from upstream call to first streamed frame.", MODEL_LABELS, TTFT_BUCKETS))
+        self.inter_token = r(Histogram("unify_inter_token_seconds", "Gap between consecutive streamed frames.", MODEL_LABELS, INTER_TOKEN_BUCKETS))
+        self.input_tokens = r(Counter("unify_input_tokens_total", "Prompt tokens billed by upstream.", MODEL_LABELS))
+        self.output_tokens = r(Counter("unify_output_tokens_total", "Completion tokens billed by upstream.", MODEL_LABELS))
+        self.cache_read_tokens = r(Counter("unify_cache_read_tokens_total", "Prompt tokens read from the upstream prompt cache (included in input tokens).", MODEL_LABELS))
+        self.cache_write_tokens = r(Counter("unify_cache_write_tokens_total", "Prompt tokens written to the upstream prompt cache (included in input tokens).", MODEL_LABELS))
+        self.estimated_usage = r(Counter("unify_estimated_usage_total", "Upstream calls billed from the local token estimate because no usage was received.", MODEL_LABELS))
+        self.context_rejections = r(Counter("unify_context_window_rejections_total", "Requests rejected before the upstream call because the prompt exceeds the context window.", MODEL_LABELS))
+        self.client_disconnects = r(Counter("unify_client_disconnects_total", "Requests whose client disconnected before the response finished; the upstream call is cancelled.", (*MODEL_LABELS, "mode")))
+        self.hedges = r(Counter("unify_hedged_requests_total", "Requests that fired an alternate upstream, by which route won.", (*MODEL_LABELS, "winner")))
+        self.queue_depth = r(Gauge("unify_queue_depth", "Requests waiting for an upstream slot.", ("provider", "user", "lane")))
+        self.queue_wait = r(Histogram("unify_queue_wait_seconds", "Time spent waiting for an upstream slot.", ("provider", "user", "lane"), QUEUE_WAIT_BUCKETS))
+        self.rate_limit_wait = r(Histogram("unify_rate_limit_wait_seconds", "Time spent waiting for the upstream model's RPM/TPM budget and concurrency limit.", MODEL_LABELS, QUEUE_WAIT_BUCKETS))
+        self.concurrency_limit = r(Gauge("unify_adaptive_concurrency_limit", "Current adaptive concurrency limit of the upstream model.", MODEL_LABELS))
+        self.usage_queue_depth = r(Gauge("unify_usage_queue_depth", "Usage rows waiting to be written to the database.", ()))
+        self.usage_rows = r(Counter("unify_usage_rows_total", "Usage rows handled by the database writer, by outcome.", ("outcome",)))
+        self.usage_batches = r(Counter("unify_usage_batches_total", "Transactions committed by the usage writer.", ()))
+        self.cost = r(Counter("unify_cost_total", "Upstream cost in the provider's price currency.", MODEL_LABELS))
+
+    def upstream_started(self, labels: Labels):
+        self.inflight.inc(labels)
+
+    def upstream_finished(self, labels: Labels, duration: float, error: Optional[BaseException] = None):
+        self.inflight.dec(labels)
+        self.latency.observe(labels, duration)
+        # 对冲落败被取消的调用不算错误
+        if error is not None and not isinstance(error, asyncio.CancelledError):
+            self.errors.inc((*labels, type(error).__name__))
+
+    def record_usage(self, labels: Labels, input_tokens: int, output_tokens: int, cost: float, cache_read_tokens: int = 0, cache_write_tokens: int = 0):
+        self.input_tokens.inc(labels, input_tokens)
+        self.output_tokens.inc(labels, output_tokens)
+        self.cost.inc(labels, cost)
+        if cache_read_tokens:
+            self.cache_read_tokens.inc(labels, cache_read_tokens)
+        if cache_write_tokens:
+            self.cache_write_tokens.inc(labels, cache_write_tokens)
+
+    def observe_writer(self, writer):
+        """写入线程只维护自己的计数，导出指标前同步一次。"""
+        self.usage_queue_depth.set((), writer.queue.qsize())
+        self.usage_rows.set(("written",), writer.rows_written)
+        self.usage_rows.set(("failed",), writer.rows_failed)
+        self.usage_rows.set(("dropped",), writer.rows_dropped)
+        self.usage_batches.set((), writer.batches)
+
+    def render(self) -> str:
+        return self.registry.render()
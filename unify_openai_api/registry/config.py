@@ -0,0 +1,240 @@
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from ..utils.balancer import STRATEGIES
+from ..utils.token_estimator import FAMILIES
+
+DEFAULT_CONFIG_PATH = "models.toml"
+
+
+class ConfigError(Exception):
+    """模型配置文件无效。"""
+
+
+@dataclass
+class BreakerConfig:
+    # 连续失败次数达到该值时断开
+    failure_threshold: int = 5
+    # 最近 window 次调用中失败比例达到该值时断开
+    failure_rate: float = 0.5
+    window: int = 20
+    # 断开后经过该时间（秒）进入半开状态，放行探测请求
+    open_seconds: float = 30.0
+    # 半开状态下同时放行的探测请求数
+    half_open_probes: int = 1
+    # 调用耗时（流式为首帧时间）超过该值时按失败计，为空时不检查
+    slow_call_seconds: Optional[float] = None
+
+
+@dataclass
+class ProviderConfig:
+    name: str
+    # 后端类型：openai 或 anthropic
+    backend: str
+    base_url: str
+    api_key_env: str
+    # OpenAI 兼容上游是否直接转发 SSE 字节
+    passthrough: bool = False
+    # 配置中的价格除以该值后记账，例如人民币价格换算为美元
+    price_divisor: float = 1.0
+    # 额外的 endpoint，每项为 {base_url?, api_key_env}，base_url 默认与 provider 相同
+    endpoints: List[Dict[str, str]] = field(default_factory=list)
+    # 多个 endpoint 之间的选择策略：least_outstanding 或 ewma
+    balancer: str = "least_outstanding"
+    # 熔断参数，见 BreakerConfig
+    breaker: BreakerConfig = field(default_factory=BreakerConfig)
+    # 同时发往该 provider 的最大请求数，超出的请求按用户公平排队；为空时不限制
+    max_concurrency: Optional[int] = None
+    # 非流式请求也以流式调用上游并在网关内合并，长响应不会因中转的空闲连接超时而中断
+    stream_upstream: bool = False
+    # 上游流相邻事件的最长间隔（秒），超过时按失败中止；为空时只受连接池的读取超时限制
+    idle_timeout: Optional[float] = None
+
+
+@dataclass
+class ModelLimits:
+    # 上下文窗口（token）
+    context_window: Optional[int] = None
+    # 单次请求允许的最大输出 token，超过时截断请求中的 max_tokens
+    max_output_tokens: Optional[int] = None
+    # 上游对该模型的每分钟请求数 / token 数限制，超出时排队等待
+    rpm: Optional[int] = None
+    tpm: Optional[int] = None
+    # 并发上限，遇到 429 时减半、成功后缓慢恢复
+    max_concurrency: Optional[int] = None
+
+
+@dataclass
+class HedgeConfig:
+    # 备用路由，值为其他模型的名称，按顺序依次发出
+    alternates: List[str]
+    # 主路由首帧时间的该分位数作为发出备用请求前的等待时间
+    percentile: float = 0.95
+    # 样本不足时使用的等待时间（秒）
+    initial_delay: float = 2.0
+    min_delay: float = 0.25
+    max_delay: float = 10.0
+    # 参与分位数计算的最近样本数
+    window: int = 200
+
+
+@dataclass
+class ModelConfig:
+    name: str
+    provider: str
+    target: str
+    input_price: float
+    output_price: float
+    # 额外的请求修改器，例如 {"type": "qwen", "think": true}
+    modifiers: List[Dict[str, Any]] = field(default_factory=list)
+    limits: ModelLimits = field(default_factory=ModelLimits)
+    # 首帧过慢时向备用路由发出相同请求
+    hedge: Optional[HedgeConfig] = None
+    # 本地 token 估计使用的模型系列，为空时按 target 的前缀推断
+    tokenizer: Optional[str] = None
+    # prompt cache 读取 / 写入的价格（每百万 token），为空时 anthropic 后端按输入价格的 0.1 / 1.25 倍，其余按输入价格
+    cache_read_price: Optional[float] = None
+    cache_write_price: Optional[float] = None
+    # anthropic 后端自动在 tools、system 与最近的 user 消息上设置 prompt cache 断点
+    prompt_cache: bool = True
+
+
+# 优先级从高到低，排队时高优先级通道总是先被调度
+LANES = ("interactive", "batch")
+
+
+@dataclass
+class Budget:
+    # 当天（UTC）/ 当月的花费上限，单位与记账价格相同，为空时不限制
+    daily: Optional[float] = None
+    monthly: Optional[float] = None
+
+
+@dataclass
+class UserConfig:
+    name: str
+    # 默认优先级通道，可以被请求头 x-priority 覆盖
+    lane: str = "interactive"
+    # 同一通道内按权重分配上游并发
+    weight: float = 1.0
+    # 该用户在所有模型上的总花费上限
+    budget: Budget = field(default_factory=Budget)
+    # 模型名称 -> 该用户在这个模型上的花费上限
+    model_budgets: Dict[str, Budget] = field(default_factory=dict)
+
+
+@dataclass
+class RegistryConfig:
+    providers: Dict[str, ProviderConfig]
+    models: Dict[str, ModelConfig]
+    users: Dict[str, UserConfig] = field(default_factory=dict)
+
+
+def _read(path: str) -> Dict[str, Any]:
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError("PyYAML is required to load YAML model configs")
+        with open(path) as f:
+            return yaml.safe_load(f) or dict()
+
+    import tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def _check_hedge_cycles(models: Dict[str, ModelConfig]):
+    """备用路由本身也会构造各自的对冲，互为备用（a -> b -> a）时构造模型会无限递归。"""
+    # 0: 未访问，1: 在当前路径上，2: 已确认无环
+    states: Dict[str, int] = dict()
+
+    def visit(name: str, path: List[str]):
+        state = states.get(name, 0)
+        if state == 1:
+            cycle = path[path.index(name):] + [name]
+            raise ConfigError(f"Model {cycle[0]}: hedge alternates form a cycle: {' -> '.join(cycle)}")
+        if state == 2:
+            return
+        states[name] = 1
+        hedge = models[name].hedge
+        for alternate in hedge.alternates if hedge is not None else ():
+            visit(alternate, path + [name])
+        states[name] = 2
+
+    for name in models:
+        visit(name, [])
+
+
+def load_config(path: Optional[str] = None) -> RegistryConfig:
+    """读取并校验模型配置，路径默认取 UNIFY_MODELS_CONFIG。"""
+    path = path or os.getenv("UNIFY_MODELS_CONFIG", DEFAULT_CONFIG_PATH)
+    raw = _read(path)
+
+    try:
+        providers = dict()
+        for name, spec in raw.get("providers", dict()).items():
+            spec = dict(spec)
+            breaker = BreakerConfig(**spec.pop("breaker", dict()))
+            providers[name] = ProviderConfig(name=name, breaker=breaker, **spec)
+        models = dict()
+        for name, spec in raw.get("models", dict()).items():
+            spec = dict(spec)
+            limits = ModelLimits(**spec.pop("limits", dict()))
+            hedge = HedgeConfig(**spec.pop("hedge")) if "hedge" in spec else None
+            models[name] = ModelConfig(name=name, limits=limits, hedge=hedge, **spec)
+        users = dict()
+        for name, spec in raw.get("users", dict()).items():
+            spec = dict(spec)
+            budget = Budget(**spec.pop("budget", dict()))
+            model_budgets = {model: Budget(**value) for model, value in spec.pop("model_budgets", dict()).items()}
+            users[name] = UserConfig(name=name, budget=budget, model_budgets=model_budgets, **spec)
+    except TypeError as e:
+        raise ConfigError(f"Invalid model config {path}: {e}")
+
+    for provider in providers.values():
+        if provider.backend not in ("openai", "anthropic"):
+            raise ConfigError(f"Provider {provider.name}: unknown backend {provider.backend!r}")
+        if provider.balancer not in STRATEGIES:
+            raise ConfigError(f"Provider {provider.name}: unknown balancer {provider.balancer!r}")
+        for endpoint in provider.endpoints:
+            if "api_key_env" not in endpoint or set(endpoint) - {"base_url", "api_key_env"}:
+                raise ConfigError(f"Provider {provider.name}: invalid endpoint {endpoint!r}")
+        if provider.idle_timeout is not None and provider.idle_timeout <= 0:
+            raise ConfigError(f"Provider {provider.name}: idle_timeout must be positive")
+    for model in models.values():
+        if model.provider not in providers:
+            raise ConfigError(f"Model {model.name}: unknown provider {model.provider!r}")
+        for key in ("cache_read_price", "cache_write_price"):
+            value = getattr(model, key)
+            if value is not None and value < 0:
+                raise ConfigError(f"Model {model.name}: {key} must not be negative")
+        if model.tokenizer is not None and model.tokenizer not in FAMILIES:
+            raise ConfigError(f"Model {model.name}: unknown tokenizer {model.tokenizer!r}")
+        if model.hedge is not None:
+            for alternate in model.hedge.alternates:
+                if alternate not in models or alternate == model.name:
+                    raise ConfigError(f"Model {model.name}: invalid hedge alternate {alternate!r}")
+            if not 0 < model.hedge.percentile < 1:
+                raise ConfigError(f"Model {model.name}: hedge percentile must be in (0, 1)")
+        for key in ("context_window", "rpm", "tpm", "max_concurrency"):
+            value = getattr(model.limits, key)
+            if value is not None and value <= 0:
+                raise ConfigError(f"Model {model.name}: limits.{key} must be positive")
+
+    _check_hedge_cycles(models)
+
+    for user in users.values():
+        if user.lane not in LANES:
+            raise ConfigError(f"User {user.name}: unknown lane {user.lane!r}")
+        if user.weight <= 0:
+            raise ConfigError(f"User {user.name}: weight must be positive")
+        for model, budget in user.model_budgets.items():
+            if model not in models:
+                raise ConfigError(f"User {user.name}: budget for unknown model {model!r}")
+        for budget in (user.budget, *user.model_budgets.values()):
+            if any(value is not None and value < 0 for value in (budget.daily, budget.monthly)):
+                raise ConfigError(f"User {user.name}: budgets must not be negative")
+
+    return RegistryConfig(providers=providers, models=models, users=users)
@@ -0,0 +1,330 @@
+import logging
+import os
+from typing import Any, Callable, Deque, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import anthropic
+import openai
+from openai import AsyncOpenAI
+from anthropic import AsyncAnthropic
+
+from ..backends.anthropic import AnthropicProxy
+from ..backends.hedged import Hedge
+from ..backends.openai import OpenAIProxy
+from ..providers.aliyun import QwenModifier
+from ..providers.volcengine import DoubaoModifier
+from ..request_modifers.anthropic import OpenAIToAnthropicMiddleware
+from ..request_modifers.interface import RequestModifier, SetModel
+from ..request_modifers.limits import MaxTokensLimit
+from ..request_modifers.open_webui import OpenWebUIRequest
+from ..response_handlers.anthropic import AnthropicToOpenAI
+from ..response_handlers.cost_record import ChatCompletionCostRecord
+from ..types.llm_api import LLMApi
+from ..utils.balancer import Balancer, BalancingTransport, Endpoint
+from ..utils.circuit_breaker import CircuitBreaker
+from ..utils.fair_scheduler import FairScheduler
+from ..utils.http_pool import HttpPool, sdk_httpx
+from ..utils.rate_limiter import UpstreamLimiter
+from ..utils.token_estimator import TokenEstimator, family_for
+from .config import ConfigError, ModelConfig, ProviderConfig, RegistryConfig
+
+logger = logging.getLogger(__name__)
+
+# anthropic 后端未配置缓存价格时，读取 / 写入相对输入价格的倍数
+ANTHROPIC_CACHE_READ_MULTIPLIER = 0.1
+ANTHROPIC_CACHE_WRITE_MULTIPLIER = 1.25
+
+# 配置文件中 modifiers 的 type -> 构造函数，其余字段作为参数传入
+MODIFIERS: Dict[str, Callable[..., RequestModifier]] = {
+    "qwen": QwenModifier,
+    "doubao": DoubaoModifier,
+}
+
+
+def _sdk_httpx(provider: ProviderConfig):
+    return sdk_httpx(anthropic if provider.backend == "anthropic" else openai)
+
+
+def _client_settings(provider: ProviderConfig) -> Tuple[Any, ...]:
+    """决定 provider 客户端与负载均衡的配置项，相同时重新加载可以沿用旧客户端。"""
+    return provider.backend, provider.base_url, provider.api_key_env, provider.endpoints, provider.balancer
+
+
+def _limiter_settings(model: ModelConfig) -> Tuple[Optional[int], ...]:
+    limits = model.limits
+    return limits.rpm, limits.tpm, limits.max_concurrency
+
+
+class ModelUnavailable(Exception):
+    """模型已配置但无法使用，例如缺少 API key。"""
+
+
+class ModelRegistry(Mapping[str, LLMApi]):
+    """
+    从配置构建的模型表。
+    客户端和模型对象在第一次被请求时才构造，之后缓存复用。
+    重新加载时构造新的 ModelRegistry 整体替换，进行中的请求继续持有旧的模型对象；
+    配置未变的 provider 与上游模型沿用 previous 中有状态的对象，见 _carry_over。
+    """
+
+    def __init__(self, config: RegistryConfig, pool: HttpPool, previous: Optional["ModelRegistry"] = None):
+        self.config = config
+        self.pool = pool
+        self._models: Dict[str, LLMApi] = dict()
+        self._clients: Dict[str, Any] = dict()
+        # 多 endpoint provider 的 httpx 客户端由模型表持有，其余客户端使用 HttpPool 的共享连接池
+        self._http_clients: Dict[str, Any] = dict()
+        # 配置了多个 endpoint 的 provider -> Balancer
+        self.balancers: Dict[str, Balancer] = dict()
+        # provider -> CircuitBreaker，同一 provider 的模型共享
+        self.breakers: Dict[str, CircuitBreaker] = dict()
+        # 配置了 max_concurrency 的 provider -> FairScheduler
+        self.schedulers: Dict[str, FairScheduler] = dict()
+        # (provider, target) -> UpstreamLimiter，指向同一上游模型的配置共享预算
+        self.limiters: Dict[Tuple[str, str], UpstreamLimiter] = dict()
+        self._limiter_settings: Dict[Tuple[str, str], Tuple[Optional[int], ...]] = dict()
+        # 模型系列 -> TokenEstimator
+        self.estimators: Dict[str, TokenEstimator] = dict()
+        # 模型名 -> 沿用的对冲首帧时间样本
+        self._hedge_samples: Dict[str, Deque[float]] = dict()
+        # 被本模型表替换、不再使用的 httpx 客户端，由调用方在进行中的请求结束后关闭
+        self.retired: List[Any] = []
+
+        # 提前校验 modifier 类型，避免在第一次请求时才发现配置错误
+        for model in config.models.values():
+            for spec in model.modifiers:
+                if spec.get("type") not in MODIFIERS:
+                    raise ConfigError(f"Model {model.name}: unknown modifier {spec.get('type')!r}")
+
+        if previous is not None:
+            self._carry_over(previous)
+
+    def _carry_over(self, previous: "ModelRegistry"):
+        """
+        沿用旧模型表中配置未变的有状态对象，重新加载不会重置熔断状态、AIMD 并发上限、TPM 令牌桶、
+        endpoint 的延迟统计与对冲的首帧时间样本。调度器总是原地更新，新旧模型表共用同一个并发上限。
+        """
+        users = self.config.users
+        for name, provider in self.config.providers.items():
+            old = previous.config.providers.get(name)
+            if old is None:
+                continue
+            if name in previous._clients and _client_settings(old) == _client_settings(provider):
+                self._clients[name] = previous._clients[name]
+                if name in previous.balancers:
+                    self.balancers[name] = previous.balancers[name]
+                if name in previous._http_clients:
+                    self._http_clients[name] = previous._http_clients[name]
+            if name in previous.breakers and old.breaker == provider.breaker:
+                self.breakers[name] = previous.breakers[name]
+            scheduler = previous.schedulers.get(name)
+            if scheduler is not None and provider.max_concurrency is not None:
+                scheduler.reconfigure(provider.max_concurrency, users)
+                self.schedulers[name] = scheduler
+        self.retired = [client for name, client in previous._http_clients.items() if self._http_clients.get(name) is not client]
+
+        for model in self.config.models.values():
+            key = (model.provider, model.target)
+            if key in previous.limiters and key not in self.limiters and previous._limiter_settings[key] == _limiter_settings(model):
+                self.limiters[key] = previous.limiters[key]
+                self._limiter_settings[key] = previous._limiter_settings[key]
+            old_model = previous.config.models.get(model.name)
+            hedge = getattr(previous._models.get(model.name), "hedge", None)
+            if hedge is not None and old_model is not None and old_model.hedge == model.hedge:
+                self._hedge_samples[model.name] = hedge._samples
+
+    async def aclose(self):
+        """退出时关闭模型表持有的 httpx 客户端。"""
+        for client in self._http_clients.values():
+            await client.aclose()
+
+    def __getitem__(self, name: str) -> LLMApi:
+        model = self._models.get(name)
+        if model is None:
+            model = self._models[name] = self._build_model(self.config.models[name])
+        return model
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.config.models
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.config.models)
+
+    def __len__(self) -> int:
+        return len(self.config.models)
+
+    def prepare_pool(self):
+        """为已配置 API key 的 provider 创建共享连接池，以便启动时预热。"""
+        for provider in self.config.providers.values():
+            lib = _sdk_httpx(provider)
+            if os.getenv(provider.api_key_env):
+                self.pool.client_for(provider.base_url, lib)
+            for endpoint in provider.endpoints:
+                if os.getenv(endpoint["api_key_env"]):
+                    self.pool.client_for(endpoint.get("base_url", provider.base_url), lib)
+
+    def prices(self, name: str) -> Tuple[float, float]:
+        """模型的 (输入, 输出) 记账价格，每百万 token，已按 provider 的 price_divisor 换算。"""
+        model = self.config.models[name]
+        divisor = self.config.providers[model.provider].price_divisor
+        return model.input_price / divisor, model.output_price / divisor
+
+    def cache_prices(self, name: str) -> Tuple[float, float]:
+        """模型的 prompt cache (读取, 写入) 记账价格，换算方式与 prices 相同。"""
+        model = self.config.models[name]
+        provider = self.config.providers[model.provider]
+        read, write = model.input_price, model.input_price
+        if provider.backend == "anthropic":
+            read, write = model.input_price * ANTHROPIC_CACHE_READ_MULTIPLIER, model.input_price * ANTHROPIC_CACHE_WRITE_MULTIPLIER
+        if model.cache_read_price is not None:
+            read = model.cache_read_price
+        if model.cache_write_price is not None:
+            write = model.cache_write_price
+        return read / provider.price_divisor, write / provider.price_divisor
+
+    def estimate_fee(self, name: str, input_tokens: int, output_tokens: int = 0) -> float:
+        """按记账价格估算的费用，单位与用户花费上限相同。"""
+        input_price, output_price = self.prices(name)
+        return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def breaker_stats(self) -> Dict[str, Dict[str, Any]]:
+        """已使用过的 provider 的熔断状态。"""
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
+
+    def endpoint_stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """已创建客户端的多 endpoint provider 的负载统计。"""
+        return {name: balancer.stats() for name, balancer in self.balancers.items()}
+
+    def _client(self, provider: ProviderConfig):
+        client = self._clients.get(provider.name)
+        if client is not None:
+            return client
+
+        client_class = AsyncAnthropic if provider.backend == "anthropic" else AsyncOpenAI
+        lib = _sdk_httpx(provider)
+        if provider.endpoints:
+            balancer = self._balancer(provider)
+            first = balancer.endpoints[0]
+            # SDK 的 base_url 和 key 只是占位，BalancingTransport 按请求改写为选中的 endpoint
+            auth = ("x-api-key", "") if provider.backend == "anthropic" else ("authorization", "Bearer ")
+            http_client = lib.AsyncClient(transport=BalancingTransport(balancer, self.pool, *auth))
+            client = client_class(api_key=first.api_key, base_url=first.base_url, http_client=http_client)
+            self.balancers[provider.name] = balancer
+            self._http_clients[provider.name] = http_client
+        else:
+            api_key = os.getenv(provider.api_key_env)
+            if not api_key:
+                raise ModelUnavailable(f"Provider {provider.name}: {provider.api_key_env} is not set")
+            client = client_class(api_key=api_key, base_url=provider.base_url, http_client=self.pool.client_for(provider.base_url, lib))
+        self._clients[provider.name] = client
+        logger.info("Created %s client for provider %s", provider.backend, provider.name)
+        return client
+
+    def _balancer(self, provider: ProviderConfig) -> Balancer:
+        endpoints = []
+        specs = [{"base_url": provider.base_url, "api_key_env": provider.api_key_env}, *provider.endpoints]
+        for spec in specs:
+            api_key = os.getenv(spec["api_key_env"])
+            # 未设置 key 的 endpoint 跳过，其余 endpoint 仍可使用
+            if api_key:
+                base_url = spec.get("base_url", provider.base_url)
+                endpoints.append(Endpoint(base_url=base_url, api_key=api_key, name=f"{base_url} ({spec['api_key_env']})"))
+        if not endpoints:
+            raise ModelUnavailable(f"Provider {provider.name}: none of its API keys are set")
+        return Balancer(endpoints, provider.balancer)
+
+    def _build_hedge(self, model: ModelConfig) -> Optional[Hedge]:
+        if model.hedge is None:
+            return None
+        alternates = []
+        for name in model.hedge.alternates:
+            # 备用路由不可用时只跳过该路由，不影响主路由
+            try:
+                alternates.append(self[name])
+            except ModelUnavailable as e:
+                logger.warning("Model %s: hedge alternate %s unavailable: %s", model.name, name, e)
+        return Hedge(model.hedge, alternates, self._hedge_samples.get(model.name)) if alternates else None
+
+    def _limiter(self, model: ModelConfig) -> Optional[UpstreamLimiter]:
+        key = (model.provider, model.target)
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limits = model.limits
+            if limits.rpm is None and limits.tpm is None and limits.max_concurrency is None:
+                return None
+            # 同一上游模型以先构造的配置为准
+            limiter = self.limiters[key] = UpstreamLimiter(limits.rpm, limits.tpm, limits.max_concurrency)
+            self._limiter_settings[key] = _limiter_settings(model)
+        return limiter
+
+    def _estimator(self, model: ModelConfig) -> TokenEstimator:
+        family = family_for(model.target, model.tokenizer)
+        estimator = self.estimators.get(family.name)
+        if estimator is None:
+            estimator = self.estimators[family.name] = TokenEstimator(family)
+        return estimator
+
+    def _build_model(self, model: ModelConfig) -> LLMApi:
+        provider = self.config.providers[model.provider]
+        client = self._client(provider)
+        hedge = self._build_hedge(model)
+        breaker = self.breakers.get(provider.name)
+        if breaker is None:
+            breaker = self.breakers[provider.name] = CircuitBreaker(provider.name, provider.breaker)
+        scheduler = self.schedulers.get(provider.name)
+        if scheduler is None and provider.max_concurrency is not None:
+            scheduler = self.schedulers[provider.name] = FairScheduler(provider.name, provider.max_concurrency, self.config.users)
+        limiter = self._limiter(model)
+
+        request_modifiers: List[RequestModifier] = [SetModel(model_name=model.target)]
+        for spec in model.modifiers:
+            params = {k: v for k, v in spec.items() if k != "type"}
+            request_modifiers.append(MODIFIERS[spec["type"]](**params))
+        # 放在最后，在 OpenAIToAnthropicMiddleware 填入默认 max_tokens 之后再截断
+        limits = [MaxTokensLimit(max_output_tokens=model.limits.max_output_tokens)] if model.limits.max_output_tokens is not None else []
+
+        input_price, output_price = self.prices(model.name)
+        cache_read_price, cache_write_price = self.cache_prices(model.name)
+        cost_record = ChatCompletionCostRecord(
+            model_id=model.target,
+            input_price=input_price,
+            output_price=output_price,
+            provider=provider.name,
+            cache_read_price=cache_read_price,
+            cache_write_price=cache_write_price,
+            model_name=model.name,
+        )
+        estimator = self._estimator(model)
+
+        if provider.backend == "anthropic":
+            request_modifiers += [OpenWebUIRequest(chat_completion_request=False), OpenAIToAnthropicMiddleware(prompt_cache=model.prompt_cache), *limits]
+            return AnthropicProxy(
+                client=client,
+                request_modifiers=request_modifiers,
+                response_handlers=[AnthropicToOpenAI(), cost_record],
+                provider=provider.name,
+                hedge=hedge,
+                breaker=breaker,
+                scheduler=scheduler,
+                limiter=limiter,
+                estimator=estimator,
+                context_window=model.limits.context_window,
+                stream_upstream=provider.stream_upstream,
+                idle_timeout=provider.idle_timeout,
+            )
+
+        request_modifiers += [OpenWebUIRequest(), *limits]
+        return OpenAIProxy(
+            client=client,
+            request_modifiers=request_modifiers,
+            response_handlers=[cost_record],
+            passthrough=provider.passthrough,
+            provider=provider.name,
+            hedge=hedge,
+            breaker=breaker,
+            scheduler=scheduler,
+            limiter=limiter,
+            estimator=estimator,
+            context_window=model.limits.context_window,
+            stream_upstream=provider.stream_upstream,
+            idle_timeout=provider.idle_timeout,
+        )
@@ -1,9 +1,101 @@
+from typing import Any, List, Optional
+
 from .interface import RequestModifier
 
 from anthropic.types import MessageParam, ThinkingConfigEnabledParam, ThinkingConfigDisabledParam
 
+# 缓存 5 分钟，命中时刷新
+_EPHEMERAL = {"type": "ephemeral"}
+
+# 不能设置 cache_control 的内容块
+_UNCACHEABLE_BLOCKS = ("thinking", "redacted_thinking")
+
+
+def _has_cache_control(value: Any) -> bool:
+    """value 本身（消息、块或 tool）或它的 content 列表中已有断点。只看一层，不遍历整段历史。"""
+    if not isinstance(value, dict):
+        return isinstance(value, list) and any(isinstance(item, dict) and "cache_control" in item for item in value)
+    if "cache_control" in value:
+        return True
+    content = value.get("content")
+    return isinstance(content, list) and any(isinstance(item, dict) and "cache_control" in item for item in content)
+
+
+def _with_breakpoint(content: Any) -> Optional[List[Any]]:
+    """在 content 的最后一块上设置断点，返回新的 content；无法设置时返回 None。不修改传入的对象。"""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": _EPHEMERAL}] if content else None
+    if not isinstance(content, list) or not content:
+        return None
+    last = content[-1]
+    if not isinstance(last, dict) or last.get("type") in _UNCACHEABLE_BLOCKS or last.get("text") == "":
+        return None
+    return [*content[:-1], {**last, "cache_control": _EPHEMERAL}]
+
+
+def _breakpoint_targets(messages: List[Any], system: bool) -> List[int]:
+    """
+    要设置断点的消息下标：开头 system 消息中的最后一条（顶层 system 上无法设置断点时），以及最后两条 user 消息。
+    user 消息从末尾往前找，system 消息只看开头，长对话中不遍历整段历史。
+    """
+    targets: List[int] = []
+    if not system:
+        leading = 0
+        while leading < len(messages) and messages[leading].get("role") == "system":
+            leading += 1
+        if leading:
+            targets.append(leading - 1)
+    users: List[int] = []
+    for i in range(len(messages) - 1, targets[0] if targets else -1, -1):
+        if messages[i].get("role") == "user":
+            users.append(i)
+            if len(users) == 2:
+                break
+    return targets + users[::-1]
+
+
+def add_cache_breakpoints(data: dict):
+    """
+    在多轮对话中保持不变的前缀上设置 prompt cache 断点（Anthropic 每个请求最多 4 个）：
+    tools 的最后一项、system 的最后一块，以及最后两条 user 消息——上一轮写入的前缀在本轮读取，
+    本轮的断点写入新的前缀供下一轮读取。
+    要设置断点的位置或最后一条消息上已有客户端的 cache_control 时保持请求不变；只检查这些位置，
+    不扫描整段历史。被修改的列表与消息都是新对象，对冲的备用路由可能共享原请求中的对象。
+    """
+    tools = data.get("tools")
+    system = data.get("system")
+    system_content = _with_breakpoint(system) if system else None
+    messages = data.get("messages") or []
+    targets = _breakpoint_targets(messages, system_content is not None)
+    if (
+        (tools and _has_cache_control(tools[-1]))
+        or _has_cache_control(system)
+        or (messages and _has_cache_control(messages[-1]))
+        or any(_has_cache_control(messages[i]) for i in targets)
+    ):
+        return
+
+    if tools and isinstance(tools[-1], dict):
+        data["tools"] = [*tools[:-1], {**tools[-1], "cache_control": _EPHEMERAL}]
+
+    if system_content is not None:
+        data["system"] = system_content
+    if not targets:
+        return
+    messages = list(messages)
+    for i in targets:
+        content = _with_breakpoint(messages[i].get("content"))
+        if content is not None:
+            messages[i] = {**messages[i], "content": content}
+    data["messages"] = messages
+
+
 class OpenAIToAnthropicMiddleware(RequestModifier):
     """将 OpenAI LLMApi 请求转换为 Anthropic 格式的中间件。"""
+
+    def __init__(self, prompt_cache: bool = True):
+        # 自动设置 prompt cache 断点
+        self.prompt_cache = prompt_cache
     
     def modify_data(self, data: dict) -> dict:
         # 将 messages 转换为 Anthropic 的 MessageParam，如果需要
@@ -27,6 +119,16 @@ class OpenAIToAnthropicMiddleware(RequestModifier):
         if "reasoning_effort" in data:
             # TODO
             pass
+
+        if self.prompt_cache:
+            add_cache_breakpoints(data)
         
         return data
+
+    def compile(self, plan) -> bool:
+        # MessageParam 是 TypedDict，逐条构造只是复制，编译后的流水线直接透传 messages
+        plan.anthropic = True
+        plan.anthropic_prompt_cache = self.prompt_cache
+        return True
+
     
\ No newline at end of file
@@ -0,0 +1,110 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..utils.split_params import split_params
+from .anthropic import add_cache_breakpoints
+from .interface import RequestModifier, modify_request
+
+
+@dataclass
+class CompiledPlan:
+    """modifier 链在注册时解析出的静态信息，由各 modifier 的 compile() 填写。"""
+    # 直接覆盖到请求顶层的字段，例如 model、reasoning_effort
+    set_fields: Dict[str, Any] = field(default_factory=dict)
+    # 合并到 extra_body 的默认值，例如 enable_thinking
+    extra_body: Dict[str, Any] = field(default_factory=dict)
+    # 从 openwebui_middleware 中提取 user_id
+    openwebui: bool = False
+    # 流式请求注入 stream_options.include_usage
+    include_usage: bool = False
+    # 转换为 Anthropic 参数：max_tokens 默认值、budget_tokens -> thinking
+    anthropic: bool = False
+    anthropic_default_max_tokens: int = 32768
+    # 自动设置 Anthropic prompt cache 断点
+    anthropic_prompt_cache: bool = False
+    # 截断 max_tokens / max_completion_tokens
+    max_output_tokens: Optional[int] = None
+
+
+class RequestPipeline:
+    """
+    Anthropic 链把 modify_request 与 split_params 合并为一次遍历，省去逐条构造 MessageParam 的复制；
+    其余链仍逐个调用 modify_data——OpenAI 兼容链只改几个顶层字段，编译后测不出收益。
+    输出为可以直接传给 SDK create() 的参数，不支持的字段已并入 extra_body。
+    """
+
+    def __init__(self, modifiers: List[RequestModifier], field_set: Set[str]):
+        self.modifiers = modifiers
+        self.field_set = field_set
+
+        plan = CompiledPlan()
+        # 任一 modifier 无法静态描述，或不是 Anthropic 链时，逐个调用 modify_data
+        compiled = all(m.compile(plan) for m in modifiers) and plan.anthropic
+        self.plan: Optional[CompiledPlan] = plan if compiled else None
+
+        if self.plan is not None:
+            # 覆盖字段在注册时就分好类
+            self._set_supported = {k: v for k, v in plan.set_fields.items() if k in field_set}
+            self._set_extra = {k: v for k, v in plan.set_fields.items() if k not in field_set}
+
+    def __call__(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+        """返回 (SDK 参数, user_id)。"""
+        if self.plan is None:
+            return self._run_chain(data)
+
+        plan = self.plan
+        field_set = self.field_set
+        supported: Dict[str, Any] = dict()
+        extra: Dict[str, Any] = dict()
+        for key, value in data.items():
+            if key in field_set:
+                supported[key] = value
+            else:
+                extra[key] = value
+        supported.update(self._set_supported)
+        if self._set_extra:
+            extra.update(self._set_extra)
+
+        user_id = None
+        if plan.openwebui:
+            meta = extra.pop("openwebui_middleware", None)
+            if meta is not None:
+                user_id = meta.get("user_id", None)
+            extra["user_id"] = user_id
+
+        if plan.include_usage and supported.get("stream", False):
+            supported["stream_options"] = {**(supported.get("stream_options") or dict()), "include_usage": True}
+
+        if plan.anthropic:
+            if "max_completion_tokens" in extra:
+                supported["max_tokens"] = extra.pop("max_completion_tokens")
+            supported.setdefault("max_tokens", plan.anthropic_default_max_tokens)
+            if "budget_tokens" in extra:
+                budget_tokens = extra.pop("budget_tokens")
+                if budget_tokens > 0:
+                    supported["thinking"] = {"budget_tokens": budget_tokens, "type": "enabled"}
+                else:
+                    supported["thinking"] = {"type": "disabled"}
+            if plan.anthropic_prompt_cache:
+                add_cache_breakpoints(supported)
+
+        limit = plan.max_output_tokens
+        if limit is not None:
+            for key in ("max_tokens", "max_completion_tokens"):
+                value = supported.get(key)
+                if value is not None and value > limit:
+                    supported[key] = limit
+
+        extra_body = supported.get("extra_body")
+        if extra_body or plan.extra_body:
+            extra.update(plan.extra_body)
+            extra = {**(extra_body or dict()), **extra}
+        supported["extra_body"] = extra
+        return supported, user_id
+
+    def _run_chain(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+        data = modify_request(self.modifiers, data)
+        user_id = data.get("user_id", None)
+        supported, extra = split_params(self.field_set, data)
+        supported["extra_body"] = {**supported.get("extra_body", dict()), **extra}
+        return supported, user_id
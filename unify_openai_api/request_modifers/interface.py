@@ -1,5 +1,8 @@
 from dataclasses import dataclass
-from typing import Callable, Dict, List, Any, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, Any, Optional
+
+if TYPE_CHECKING:
+    from .compiled import CompiledPlan
 
 ModifierCallable = Callable[[Dict[str, Any]], Dict[str, Any]]
 
@@ -9,6 +12,13 @@ class RequestModifier:
         """子类重写此方法来修改 data。默认不修改。"""
         return data
 
+    def compile(self, plan: "CompiledPlan") -> bool:
+        """
+        在注册时把修改写入 plan，返回 False 表示无法静态描述，需要逐个请求调用 modify_data。
+        默认不修改 data 的 modifier 可以直接跳过。
+        """
+        return type(self).modify_data is RequestModifier.modify_data
+
 @dataclass
 class SetModel(RequestModifier):
     model_name: str
@@ -17,6 +27,10 @@ class SetModel(RequestModifier):
         data["model"] = self.model_name
         return data
 
+    def compile(self, plan: "CompiledPlan") -> bool:
+        plan.set_fields["model"] = self.model_name
+        return True
+
 def modify_request(modifiers: List[RequestModifier], data: Dict[str, Any]) -> Dict[str, Any]:
     """依次应用 modifiers 来修改 data。"""
     for modifier in modifiers:
@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+
+from .interface import RequestModifier
+
+
+@dataclass
+class MaxTokensLimit(RequestModifier):
+    """把请求中的输出 token 上限截断到模型允许的最大值。"""
+    max_output_tokens: int
+
+    def modify_data(self, data: dict) -> dict:
+        for key in ("max_tokens", "max_completion_tokens"):
+            if key in data and data[key] is not None and data[key] > self.max_output_tokens:
+                data[key] = self.max_output_tokens
+        return data
+
+    def compile(self, plan) -> bool:
+        if plan.max_output_tokens is None or self.max_output_tokens < plan.max_output_tokens:
+            plan.max_output_tokens = self.max_output_tokens
+        return True
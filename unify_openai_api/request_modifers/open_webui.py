@@ -20,4 +20,9 @@ class OpenWebUIRequest(RequestModifier):
         if self.chat_completion_request and data.get("stream", False):
             data.setdefault("stream_options", dict())["include_usage"] = True
         
-        return data
\ No newline at end of file
+        return data
+
+    def compile(self, plan) -> bool:
+        plan.openwebui = True
+        plan.include_usage = plan.include_usage or self.chat_completion_request
+        return True
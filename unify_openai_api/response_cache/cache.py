@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from openai.types.completion_usage import CompletionUsage
+
+from ..utils.request_key import is_deterministic
+from .memory import MemoryLRU
+from .sqlite import SqliteResponseStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ResponseCacheConfig:
+    enabled: bool = False
+    ttl: float = 24 * 3600
+    max_entries: int = 10000
+    max_bytes: int = 256 * 1024 * 1024
+    # 为空时只使用内存层
+    db_path: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "ResponseCacheConfig":
+        default = cls()
+        return cls(
+            enabled=os.getenv("UNIFY_RESPONSE_CACHE", "0") == "1",
+            ttl=float(os.getenv("UNIFY_RESPONSE_CACHE_TTL", default.ttl)),
+            max_entries=int(os.getenv("UNIFY_RESPONSE_CACHE_MAX_ENTRIES", default.max_entries)),
+            max_bytes=int(os.getenv("UNIFY_RESPONSE_CACHE_MAX_BYTES", default.max_bytes)),
+            db_path=os.getenv("UNIFY_RESPONSE_CACHE_DB") or None,
+        )
+
+
+@dataclass
+class CachedResponse:
+    """一次完整的响应：非流式为 body，流式为按顺序写出的 SSE 帧。"""
+    stream: bool
+    body: Optional[Dict[str, Any]] = None
+    frames: List[bytes] = field(default_factory=list)
+    usage: Optional[CompletionUsage] = None
+
+    def size(self) -> int:
+        if self.stream:
+            return sum(len(frame) for frame in self.frames)
+        return len(self.to_bytes())
+
+    async def iter_frames(self):
+        for frame in self.frames:
+            yield frame
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({
+            "stream": self.stream,
+            "body": self.body,
+            # 透传模式的帧可能截断多字节字符，latin-1 可无损往返
+            "frames": [frame.decode("latin-1") for frame in self.frames],
+            "usage": self.usage.model_dump() if self.usage else None,
+        }, ensure_ascii=False).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CachedResponse":
+        obj = json.loads(data)
+        return cls(
+            stream=obj["stream"],
+            body=obj["body"],
+            frames=[frame.encode("latin-1") for frame in obj["frames"]],
+            usage=CompletionUsage.model_validate(obj["usage"]) if obj["usage"] else None,
+        )
+
+
+class ResponseCache:
+    """确定性请求的精确匹配缓存：内存 LRU + 可选 SQLite 磁盘层。"""
+
+    def __init__(self, config: ResponseCacheConfig):
+        self.config = config
+        self.memory: MemoryLRU[CachedResponse] = MemoryLRU(config.max_entries, config.max_bytes, config.ttl)
+        self.disk = SqliteResponseStore(config.db_path, config.ttl) if config.db_path else None
+        if self.disk is not None:
+            self.disk.purge_expired()
+
+    def cacheable(self, data: Dict[str, Any]) -> bool:
+        """只有确定性请求才可缓存，key 由 request_key 计算。"""
+        return is_deterministic(data)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        cached = self.memory.get(key)
+        if cached is not None or self.disk is None:
+            return cached
+
+        data = await asyncio.to_thread(self.disk.get, key)
+        if data is None:
+            return None
+        cached = CachedResponse.from_bytes(data)
+        self.memory.put(key, cached, cached.size())
+        return cached
+
+    async def put(self, key: str, cached: CachedResponse):
+        self.memory.put(key, cached, cached.size())
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, cached.to_bytes())
+            except Exception as e:
+                logger.warning(f"Failed to write response cache entry: {e}")
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
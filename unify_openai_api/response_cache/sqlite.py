@@ -0,0 +1,47 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class SqliteResponseStore:
+    """响应缓存的磁盘层，条目以序列化后的字节保存。"""
+
+    def __init__(self, db_path: str, ttl: float):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                value BLOB NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, created_at, value) VALUES (?, ?, ?)",
+                (key, time.time(), value),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -3,12 +3,14 @@ from anthropic.types import Message
 from dataclasses import dataclass
 from typing import Optional, Dict
 
+import json
 import time
 from openai.types.chat import ChatCompletionChunk
 from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
-from openai.types.completion_usage import CompletionUsage
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
 
 from ..response_handlers.interface import ResponseHandler
+from ..types.response import SerializedChunk
 
 @dataclass
 class AnthropicToOpenAI(ResponseHandler):
@@ -18,6 +20,92 @@ class AnthropicToOpenAI(ResponseHandler):
     def handle_response_frame(self, state, user_id: str, frame: ParsedBetaMessageStreamEvent) -> Optional[ChatCompletionChunk]:
         return to_openai_chunk_format(frame)
 
+    def for_stream(self) -> "AnthropicStreamConverter":
+        return AnthropicStreamConverter()
+
+
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class AnthropicStreamConverter(ResponseHandler):
+    """
+    单个流的 Anthropic -> OpenAI 转换器。
+    在 message_start 时记录 id、model 和 created，并生成字节模板；
+    之后每个 token delta 只需把编码后的文本拼进模板，不构造 pydantic 对象。
+    """
+
+    def __init__(self):
+        self._set_prefix("", "", int(time.time()))
+        self._input_tokens = 0
+        self._cache_read_input_tokens = 0
+        self._cache_creation_input_tokens = 0
+
+    def _set_prefix(self, message_id: str, model: str, created: int):
+        self._prefix = (
+            b'data: {"id":' + _encode(message_id).encode()
+            + b',"object":"chat.completion.chunk","created":' + str(created).encode()
+            + b',"model":' + _encode(model).encode()
+            + b',"choices":[{"index":0,"delta":{'
+        )
+
+    def handle_response_frame(self, state, user_id: str, frame: ParsedBetaMessageStreamEvent) -> Optional[SerializedChunk]:
+        event_type = frame.type
+        if event_type == "content_block_delta":
+            delta = frame.delta
+            if delta.type == "text_delta":
+                return SerializedChunk(self._prefix + b'"content":' + _encode(delta.text).encode() + _DELTA_SUFFIX)
+            elif delta.type == "thinking_delta":
+                return SerializedChunk(self._prefix + b'"reasoning_content":' + _encode(delta.thinking).encode() + _DELTA_SUFFIX)
+            return None
+
+        elif event_type == "message_start":
+            message = frame.message
+            self._set_prefix(message.id, message.model, int(time.time()))
+            if message.usage:
+                self._input_tokens = message.usage.input_tokens or 0
+                self._cache_read_input_tokens = message.usage.cache_read_input_tokens or 0
+                self._cache_creation_input_tokens = message.usage.cache_creation_input_tokens or 0
+            return SerializedChunk(self._prefix + b'"role":"assistant"' + _DELTA_SUFFIX)
+
+        elif event_type == "message_delta":
+            finish_reason = CLAUDE_TO_OPENAI_FINISH.get(frame.delta.stop_reason, None)
+
+            usage = None
+            if frame.usage:
+                # message_delta 中的计数是累计值，缺失时沿用 message_start 的值
+                usage = to_openai_usage(
+                    frame.usage.input_tokens or self._input_tokens,
+                    frame.usage.output_tokens,
+                    frame.usage.cache_read_input_tokens or self._cache_read_input_tokens,
+                    frame.usage.cache_creation_input_tokens or self._cache_creation_input_tokens,
+                )
+
+            data = (
+                self._prefix + b'},"finish_reason":' + _encode(finish_reason).encode()
+                + b'}],"usage":' + (_encode(usage.model_dump()).encode() if usage else b"null")
+                + b'}\n\n'
+            )
+            return SerializedChunk(data, usage=usage)
+
+        return None
+
+
+_DELTA_SUFFIX = b'},"finish_reason":null}]}\n\n'
+
+
+def to_openai_usage(input_tokens: int, output_tokens: int, cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> CompletionUsage:
+    """
+    Anthropic 的 input_tokens 不含缓存部分；OpenAI 的 prompt_tokens 包含缓存部分，
+    读取与写入的 token 数放在 prompt_tokens_details 中分别计费。
+    """
+    prompt_tokens = input_tokens + cache_read_tokens + cache_write_tokens
+    return CompletionUsage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=output_tokens,
+        total_tokens=prompt_tokens + output_tokens,
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=cache_read_tokens, cache_write_tokens=cache_write_tokens),
+    )
+
 
 def to_openai_format(anthropic_response: Message) -> Dict:
     # 将 Anthropic Message 转换为 OpenAI LLMApi 格式
@@ -38,11 +126,12 @@ def to_openai_format(anthropic_response: Message) -> Dict:
         "created": int(anthropic_response.created_at.timestamp()) if hasattr(anthropic_response, 'created_at') else None,
         "model": anthropic_response.model,
         "object": "chat.completion",
-        "usage": {
-            "prompt_tokens": anthropic_response.usage.input_tokens,
-            "completion_tokens": anthropic_response.usage.output_tokens,
-            "total_tokens": anthropic_response.usage.input_tokens + anthropic_response.usage.output_tokens
-        } if anthropic_response.usage else None
+        "usage": to_openai_usage(
+            anthropic_response.usage.input_tokens,
+            anthropic_response.usage.output_tokens,
+            anthropic_response.usage.cache_read_input_tokens or 0,
+            anthropic_response.usage.cache_creation_input_tokens or 0,
+        ).model_dump() if anthropic_response.usage else None
     }
 
 
@@ -134,17 +223,11 @@ def to_openai_chunk_format(event: ParsedBetaMessageStreamEvent, message_id="", m
         # 提取 token usage（仅在最终 delta 中存在）
         usage = None
         if hasattr(event, 'usage') and event.usage:
-            prompt_tokens = (
-                event.usage.input_tokens 
-                + (event.usage.cache_read_input_tokens or 0) 
-                + (event.usage.cache_creation_input_tokens or 0)
-            )
-            completion_tokens = event.usage.output_tokens
-            total_tokens = prompt_tokens + completion_tokens
-            usage = CompletionUsage(
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens,
-                total_tokens=total_tokens
+            usage = to_openai_usage(
+                event.usage.input_tokens or 0,
+                event.usage.output_tokens,
+                event.usage.cache_read_input_tokens or 0,
+                event.usage.cache_creation_input_tokens or 0,
             )
         return ChatCompletionChunk(
             id=message_id,
@@ -1,9 +1,9 @@
 from dataclasses import dataclass
+from typing import Optional
 
 from .interface import ResponseHandler
 
 from ..types.state import AppState
-from ..usage_db.writer import AsyncDBWriter
 
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from openai.types.completion import CompletionUsage
@@ -14,24 +14,63 @@ class ChatCompletionCostRecord(ResponseHandler):
     model_id: str
     input_price: float
     output_price: float
+    # 上游 provider 名称，用作指标标签
+    provider: str = ""
+    # prompt cache 读取 / 写入的价格，为空时按输入价格计费
+    cache_read_price: Optional[float] = None
+    cache_write_price: Optional[float] = None
+    # 注册表中的模型名称，多个模型可以共用同一个上游模型，按模型的花费上限以它区分
+    model_name: Optional[str] = None
 
     def handle_response(self, state: AppState, user_id: str, data: ChatCompletion) -> ChatCompletion:
         if data.usage:
-            self._add_usage(state.writer, user_id, data.usage)
+            self._add_usage(state, user_id, data.usage)
 
         return data
     
     def handle_response_frame(self, state: AppState, user_id: str, frame: ChatCompletionChunk) -> ChatCompletionChunk:        
         if frame.usage:
-            self._add_usage(state.writer, user_id, frame.usage)
+            self._add_usage(state, user_id, frame.usage)
         
         return frame
     
-    def _add_usage(self, writer: AsyncDBWriter, user_id: str, usage: CompletionUsage):
-        writer.add_usage(model_id = self.model_id, 
+    def handle_replay(self, state: AppState, user_id: str, usage: Optional[CompletionUsage], served_from: str):
+        # 未访问上游的响应按零费用记录，并标记来源
+        if usage:
+            self._add_usage(state, user_id, usage, served_from=served_from)
+
+    def handle_estimated_usage(self, state: AppState, user_id: str, usage: CompletionUsage):
+        # 上游已经产生费用，按估计的用量正常计费
+        self._add_usage(state, user_id, usage)
+
+    def _add_usage(self, state: AppState, user_id: str, usage: CompletionUsage, served_from: Optional[str] = None):
+        # prompt_tokens 包含缓存读取与写入的部分，明细在 prompt_tokens_details 中
+        details = usage.prompt_tokens_details
+        cache_read = (details.cached_tokens or 0) if details else 0
+        cache_write = (details.cache_write_tokens or 0) if details else 0
+        cache_read_price = self.input_price if self.cache_read_price is None else self.cache_read_price
+        cache_write_price = self.input_price if self.cache_write_price is None else self.cache_write_price
+        if not served_from:
+            fee = (
+                (usage.prompt_tokens - cache_read - cache_write) * self.input_price
+                + cache_read * cache_read_price
+                + cache_write * cache_write_price
+                + usage.completion_tokens * self.output_price
+            )
+            # 价格以每百万 token 计
+            state.metrics.record_usage((self.model_id, self.provider), usage.prompt_tokens, usage.completion_tokens, fee / 1_000_000,
+                                       cache_read, cache_write)
+
+        state.writer.add_usage(model_id = self.model_id, 
             input_tokens = usage.prompt_tokens,
             output_tokens = usage.completion_tokens,
             input_price = self.input_price,
             output_price = self.output_price,
             user_id = user_id,
+            served_from = served_from,
+            cache_read_tokens = cache_read,
+            cache_read_price = cache_read_price,
+            cache_write_tokens = cache_write,
+            cache_write_price = cache_write_price,
+            model_name = self.model_name,
         )
\ No newline at end of file
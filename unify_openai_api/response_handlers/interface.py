@@ -11,6 +11,18 @@ class ResponseHandler:
     def handle_response_frame(self, state: AppState, user_id: str, frame: Any) -> Any:
         """子类重写此方法来修改 data。默认不修改。"""
         return frame
+
+    def handle_replay(self, state: AppState, user_id: str, usage: Any, served_from: str):
+        """响应未经上游直接提供（例如缓存命中）时调用。默认不处理。"""
+        pass
+
+    def handle_estimated_usage(self, state: AppState, user_id: str, usage: Any):
+        """流在收到上游的 usage 之前结束时，以本地估计的 usage 调用。默认不处理。"""
+        pass
+
+    def for_stream(self) -> "ResponseHandler":
+        """每个流开始时调用，需要保存流内状态的 handler 返回一个新实例。默认共享自身。"""
+        return self
     
 def handle_response(handlers: List[ResponseHandler], state: AppState, user_id: str, data: Any) -> Any:
     """依次应用 handlers 来修改 data。"""
@@ -18,10 +30,24 @@ def handle_response(handlers: List[ResponseHandler], state: AppState, user_id: s
         data = handler.handle_response(state, user_id, data)
     return data
 
+def handlers_for_stream(handlers: List[ResponseHandler]) -> List[ResponseHandler]:
+    """为单个流构建 handler 列表。"""
+    return [handler.for_stream() for handler in handlers]
+
 def handle_response_frames(handlers: List[ResponseHandler], state: AppState, user_id: str, frame: Any) -> Optional[Any]:
     """依次应用 handlers 来修改 frames。"""
     for handler in handlers:
         frame = handler.handle_response_frame(state, user_id, frame)
         if frame is None:
             return None
-    return frame
\ No newline at end of file
+    return frame
+
+def handle_replay(handlers: List[ResponseHandler], state: AppState, user_id: str, usage: Any, served_from: str):
+    """通知 handlers 本次响应来自 served_from 而非上游。"""
+    for handler in handlers:
+        handler.handle_replay(state, user_id, usage, served_from)
+
+def handle_estimated_usage(handlers: List[ResponseHandler], state: AppState, user_id: str, usage: Any):
+    """通知 handlers 本次上游调用只有本地估计的 usage。"""
+    for handler in handlers:
+        handler.handle_estimated_usage(state, user_id, usage)
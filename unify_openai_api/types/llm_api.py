@@ -2,10 +2,15 @@ from typing import abstractmethod
 from abc import ABC
 
 from unify_openai_api.types.response import ApiResponse
-from typing import Dict, TypedDict, cast
+from typing import Dict, Mapping, Optional, TypedDict, cast
 from fastapi import Request
 
+from ..usage_db.spend import SpendTracker
 from ..usage_db.writer import AsyncDBWriter
+from ..utils.http_pool import HttpPool
+from ..response_cache.cache import ResponseCache
+from ..utils.singleflight import SingleFlight
+from ..metrics.gateway import GatewayMetrics
 
 
 class LLMApi(ABC):
@@ -17,8 +22,13 @@ class LLMApi(ABC):
 
 
 class AppState(TypedDict, total=False):
-    models: Dict[str, LLMApi]
+    models: Mapping[str, LLMApi]
     writer: AsyncDBWriter
+    pool: HttpPool
+    response_cache: Optional[ResponseCache]
+    coalescer: Optional[SingleFlight]
+    metrics: GatewayMetrics
+    spend: SpendTracker
 
 
 def get_typed_state(request: Request) -> AppState:
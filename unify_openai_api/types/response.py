@@ -1,9 +1,32 @@
-from dataclasses import dataclass
-from typing import Optional, Any
+from dataclasses import dataclass, field
+from typing import Optional, Any, Dict, List, Tuple
 
 
 @dataclass
 class ApiResponse:
-    response: Any
+    # 经 RequestPipeline 处理后的 SDK 参数，上游调用在 handle_response 中才发出
+    request: Dict[str, Any]
     user_id: Optional[str]
-    stream: bool
\ No newline at end of file
+    stream: bool
+    response: Any = None
+    # 从响应中观察到的 usage（CompletionUsage）
+    usage: Optional[Any] = None
+    # 发出请求前本地估计的输入 token 数
+    prompt_tokens: Optional[int] = None
+    # 上游调用开始时间（time.perf_counter）
+    started_at: float = 0.0
+    # 流式过程中被捕获并以错误帧返回的异常
+    error: Optional[BaseException] = None
+    # 对冲请求的备用路由：(LLMApi, 该路由的 ApiResponse)
+    hedges: List[Tuple[Any, "ApiResponse"]] = field(default_factory=list)
+    # 收到首帧（非流式为完整响应）的时间
+    first_frame_at: float = 0.0
+    # 请求头 x-priority 指定的优先级通道
+    lane: Optional[str] = None
+
+
+@dataclass
+class SerializedChunk:
+    """已经编码好的 SSE 帧，_response_stream 直接写出，不再 model_dump。"""
+    data: bytes
+    usage: Optional[Any] = None
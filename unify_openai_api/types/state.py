@@ -1,12 +1,22 @@
-from typing import Any, Dict, TypedDict, cast
+from typing import Any, Dict, Mapping, Optional, TypedDict, cast
 from fastapi import Request, Depends
 
 from .llm_api import LLMApi
+from ..usage_db.spend import SpendTracker
 from ..usage_db.writer import AsyncDBWriter
+from ..utils.http_pool import HttpPool
+from ..response_cache.cache import ResponseCache
+from ..utils.singleflight import SingleFlight
+from ..metrics.gateway import GatewayMetrics
 
 class AppState(TypedDict, total=False):
-    models: Dict[str, LLMApi]
+    models: Mapping[str, LLMApi]
     writer: AsyncDBWriter
+    pool: HttpPool
+    response_cache: Optional[ResponseCache]
+    coalescer: Optional[SingleFlight]
+    metrics: GatewayMetrics
+    spend: SpendTracker
 
 
 def get_typed_state(request: Request) -> AppState:
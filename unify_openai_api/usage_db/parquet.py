@@ -0,0 +1,164 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .sink import UsageSink
+
+logger = logging.getLogger(__name__)
+
+# 写入中的文件使用该后缀，关闭后才改名为 .parquet，读取方不会看到不完整的文件
+_PARTIAL_SUFFIX = ".parquet.partial"
+
+INT_COLUMNS = ("input_tokens", "input_price", "output_tokens", "output_multiplier", "total_fee")
+# 较早的文件没有这些列，读取时为空
+CACHE_COLUMNS = ("cache_read_tokens", "cache_read_price", "cache_write_tokens", "cache_write_price")
+STRING_COLUMNS = ("model_id", "user_id", "served_from")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required for the parquet usage sink")
+    return pyarrow
+
+
+def usage_schema():
+    pa = _pyarrow()
+    return pa.schema(
+        [pa.field("timestamp", pa.timestamp("us", tz="UTC"), nullable=False)]
+        + [pa.field(name, pa.int64(), nullable=False) for name in INT_COLUMNS]
+        + [pa.field(name, pa.string()) for name in STRING_COLUMNS]
+        + [pa.field(name, pa.int64()) for name in CACHE_COLUMNS]
+    )
+
+
+@dataclass
+class ParquetSinkConfig:
+    directory: str = "usage_parquet"
+    # 缓冲达到该行数时写出一个 row group
+    row_group_rows: int = 10_000
+    # 当前文件超过该大小或打开超过该时间后开始新文件
+    rotate_bytes: int = 64 * 1024 * 1024
+    rotate_seconds: float = 3600.0
+    compression: str = "zstd"
+
+    @classmethod
+    def from_env(cls) -> "ParquetSinkConfig":
+        """从环境变量读取配置，未设置的字段使用默认值。"""
+        default = cls()
+        return cls(
+            directory=os.getenv("UNIFY_USAGE_PARQUET_DIR", default.directory),
+            row_group_rows=int(os.getenv("UNIFY_USAGE_PARQUET_ROW_GROUP", default.row_group_rows)),
+            rotate_bytes=int(float(os.getenv("UNIFY_USAGE_PARQUET_ROTATE_MB", default.rotate_bytes / 1024 / 1024)) * 1024 * 1024),
+            rotate_seconds=float(os.getenv("UNIFY_USAGE_PARQUET_ROTATE_SECONDS", default.rotate_seconds)),
+            compression=os.getenv("UNIFY_USAGE_PARQUET_COMPRESSION", default.compression),
+        )
+
+
+class ParquetSink(UsageSink):
+    """
+    把使用记录按列缓冲，攒够 row_group_rows 行后写出一个压缩的 row group。
+    文件按大小或时间滚动，命名为 usage-<UTC 开始时间>-<pid>-<序号>.parquet。
+    到达滚动时间时缓冲中的记录随当前文件一起写出，进程崩溃最多丢失 rotate_seconds 内未写出的记录。
+    """
+    name = "parquet"
+
+    def __init__(self, config: ParquetSinkConfig):
+        self.config = config
+        self._columns: Dict[str, List[Any]] = {name: [] for name in ("timestamp", *INT_COLUMNS, *STRING_COLUMNS, *CACHE_COLUMNS)}
+        self._writer = None
+        self._path: Optional[str] = None
+        # 当前文件（尚未打开时为缓冲中的第一行）的开始时间
+        self._started_at = 0.0
+        self._sequence = 0
+
+    def open(self):
+        self._pa = _pyarrow()
+        self._schema = usage_schema()
+        os.makedirs(self.config.directory, exist_ok=True)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        columns = self._columns
+        now = datetime.now(timezone.utc)
+        if self._writer is None and not columns["timestamp"]:
+            self._started_at = time.monotonic()
+        for row in rows:
+            timestamp = row.get("timestamp") or now
+            if timestamp.tzinfo is None:
+                # 与 SQLite 中的时间一致，未带时区的时间按 UTC 处理
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            columns["timestamp"].append(timestamp)
+            for name in INT_COLUMNS:
+                columns[name].append(row[name])
+            for name in STRING_COLUMNS:
+                columns[name].append(row.get(name))
+            for name in CACHE_COLUMNS:
+                columns[name].append(row.get(name, 0))
+        if len(columns["timestamp"]) >= self.config.row_group_rows:
+            self._write_row_group()
+        self.tick()
+
+    def tick(self):
+        if self._writer is None and not self._columns["timestamp"]:
+            return
+        if time.monotonic() - self._started_at >= self.config.rotate_seconds:
+            self._write_row_group()
+            self._roll()
+        elif self._writer is not None and os.path.getsize(self._path) >= self.config.rotate_bytes:
+            self._roll()
+
+    def close(self):
+        self._write_row_group()
+        self._roll()
+
+    def _write_row_group(self):
+        columns = self._columns
+        if not columns["timestamp"]:
+            return
+        table = self._pa.Table.from_pydict(columns, schema=self._schema)
+        if self._writer is None:
+            self._open_file()
+        self._writer.write_table(table, row_group_size=len(table))
+        for values in columns.values():
+            values.clear()
+
+    def _open_file(self):
+        self._sequence += 1
+        started = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self._path = os.path.join(self.config.directory, f"usage-{started}-{os.getpid()}-{self._sequence}{_PARTIAL_SUFFIX}")
+        self._writer = self._pa.parquet.ParquetWriter(
+            self._path, self._schema, compression=self.config.compression, use_dictionary=list(STRING_COLUMNS),
+        )
+
+    def _roll(self):
+        """关闭当前文件并改为最终文件名。缓冲中未满一个 row group 的记录在下次写出时进入新文件。"""
+        if self._writer is None:
+            return
+        self._writer.close()
+        path = self._path[:-len(_PARTIAL_SUFFIX)] + ".parquet"
+        os.replace(self._path, path)
+        logger.info("Closed usage parquet file %s", path)
+        self._writer = None
+        self._path = None
+        self._started_at = time.monotonic()
+
+
+def open_usage_dataset(directory: str):
+    """
+    以 pyarrow.dataset 打开已完成的使用记录文件。
+    读取时传入 columns 与 filter 即可只读需要的列，并按 row group 统计跳过不相关的数据，例如：
+
+        open_usage_dataset(path).to_table(columns=["user_id", "total_fee"], filter=ds.field("timestamp") >= since)
+    """
+    _pyarrow()
+    import pyarrow.dataset as ds
+    files = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.endswith(".parquet")
+    )
+    return ds.dataset(files, schema=usage_schema(), format="parquet")
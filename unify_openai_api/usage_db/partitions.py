@@ -0,0 +1,135 @@
+"""
+按月分区的原始使用记录：每个 UTC 月份一个数据库文件，例如 model_usage.2026-10.db，
+与主库 model_usage.db 放在同一目录。主库保存汇总表、分区压缩记录以及分区之前写入的原始记录。
+
+超过保留期的月份压缩为汇总表中的数据后删除原始记录：
+
+    python -m unify_openai_api.usage_db.partitions --db model_usage.db --keep-months 3
+"""
+import argparse
+import glob
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any, Dict, Tuple
+
+MONTH_FORMAT = "%Y-%m"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_MONTH_PATTERN = re.compile(r"\.(\d{4}-\d{2})\.db$")
+
+
+def partition_path(db_path: str, month: str) -> str:
+    stem, _ = os.path.splitext(db_path)
+    return f"{stem}.{month}.db"
+
+
+def list_partitions(db_path: str) -> Dict[str, str]:
+    """月份 -> 分区文件路径，按月份升序。"""
+    stem, _ = os.path.splitext(db_path)
+    partitions = dict()
+    for path in glob.glob(glob.escape(stem) + ".*.db"):
+        match = _MONTH_PATTERN.search(path)
+        if match and path == partition_path(db_path, match.group(1)):
+            partitions[match.group(1)] = path
+    return dict(sorted(partitions.items()))
+
+
+def month_of(timestamp: Any) -> str:
+    """记录所属的 UTC 月份，timestamp 为 datetime 或数据库中的时间字符串。"""
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc)
+        return timestamp.strftime(MONTH_FORMAT)
+    return str(timestamp)[:7]
+
+
+def month_bounds(month: str) -> Tuple[str, str]:
+    """月份的 [开始, 结束) 时间字符串，与数据库中 timestamp 的格式可直接比较。"""
+    year, number = map(int, month.split("-"))
+    start = datetime(year, number, 1)
+    end = datetime(year + number // 12, number % 12 + 1, 1)
+    return start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT)
+
+
+def shift_month(month: str, months: int) -> str:
+    year, number = map(int, month.split("-"))
+    index = year * 12 + number - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def alias_for(month: str) -> str:
+    return "p_" + month.replace("-", "_")
+
+
+# model_usage 建表之后新增的列：(列名, 类型定义)，打开旧的主库或分区时自动补齐
+ADDED_COLUMNS = [
+    ("served_from", "TEXT"),
+    # prompt cache 读取 / 写入的 token 数（已包含在 input_tokens 中）及其价格，价格与 input_price 同样乘以 1000 保存
+    ("cache_read_tokens", "INTEGER NOT NULL DEFAULT 0"),
+    ("cache_read_price", "INTEGER NOT NULL DEFAULT 0"),
+    ("cache_write_tokens", "INTEGER NOT NULL DEFAULT 0"),
+    ("cache_write_price", "INTEGER NOT NULL DEFAULT 0"),
+    # 注册表中的模型名称，多个名称可以对应同一个 model_id（上游模型）；早于该列的记录为 NULL
+    ("model_name", "TEXT"),
+]
+
+
+def add_missing_columns(conn: sqlite3.Connection, schema: str = "main"):
+    """为 schema 中旧的 model_usage 表补齐 ADDED_COLUMNS，调用方负责提交。"""
+    existing = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(model_usage)")}
+    for name, ddl in ADDED_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {schema}.model_usage ADD COLUMN {name} {ddl}")
+
+
+def attach_partition(conn: sqlite3.Connection, path: str, alias: str):
+    """附加分区文件并确保表结构存在。不能在事务中调用。"""
+    conn.execute("ATTACH DATABASE ? AS " + alias, (path,))
+    # 分区只在写入月份内增长，只保留报表用的覆盖索引以降低写入开销
+    conn.execute(f"PRAGMA {alias}.journal_mode=WAL")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {alias}.model_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            model_id TEXT NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            input_price INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            output_multiplier INTEGER NOT NULL,
+            total_fee INTEGER NOT NULL,
+            user_id TEXT
+        )
+    """)
+    add_missing_columns(conn, alias)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {alias}.idx_time_user_model
+        ON model_usage (timestamp, user_id, model_id, input_tokens, output_tokens, total_fee)
+    """)
+
+
+def detach_partition(conn: sqlite3.Connection, alias: str):
+    conn.execute("DETACH DATABASE " + alias)
+
+
+def remove_partition(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把超过保留期的原始使用记录压缩到汇总表并删除")
+    parser.add_argument("--db", default="model_usage.db", help="主数据库文件路径")
+    parser.add_argument("--keep-months", type=int, required=True, help="保留原始记录的月数（含当月）")
+    args = parser.parse_args()
+
+    from .sql import ModelUsageDB
+    with ModelUsageDB(args.db, partitioned=True, raw_retention_months=args.keep_months) as db:
+        for month, rows in db.apply_retention():
+            print(f"compacted {month}: {rows} raw rows")
+
+
+if __name__ == "__main__":
+    main()
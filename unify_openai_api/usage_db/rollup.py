@@ -0,0 +1,149 @@
+"""
+按小时 / 天汇总的使用统计表，与 model_usage 的原始记录在同一事务中增量更新。
+时间桶按 UTC 划分；按小时的表可以换算到任意整点时区的日期。
+原始记录已被压缩的月份只保留在汇总表中，重建时不会改动。
+
+按现有原始记录（主库与各月分区）重建汇总表：
+
+    python -m unify_openai_api.usage_db.rollup --db model_usage.db
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from typing import Optional
+
+from .partitions import attach_partition, detach_partition, list_partitions, month_bounds
+
+logger = logging.getLogger(__name__)
+
+# 表名 -> (时间桶列名, strftime 格式)
+ROLLUPS = {
+    "usage_hourly": ("hour", "%Y-%m-%d %H:00:00"),
+    "usage_daily": ("day", "%Y-%m-%d"),
+}
+
+# 主键列不允许为空，没有用户的记录以空字符串汇总
+NO_USER = ""
+
+# 汇总的计数列，与 model_usage 中的列同名
+SUMMED_COLUMNS = ("input_tokens", "output_tokens", "total_fee", "cache_read_tokens", "cache_write_tokens")
+
+# 汇总表建表之后新增的列，打开旧数据库时自动补齐
+ADDED_COLUMNS = ("cache_read_tokens", "cache_write_tokens")
+
+
+def create_rollup_tables(cursor: sqlite3.Cursor) -> bool:
+    """创建汇总表，返回是否有新建的表（需要回填）。"""
+    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({', '.join('?' * len(ROLLUPS))})", tuple(ROLLUPS))
+    existing = {row[0] for row in cursor.fetchall()}
+    for table, (bucket, _) in ROLLUPS.items():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {bucket} TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                total_fee INTEGER NOT NULL,
+                requests INTEGER NOT NULL,
+                cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+                cache_write_tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY ({bucket}, user_id, model_id)
+            ) WITHOUT ROWID
+        """)
+        columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+        for column in ADDED_COLUMNS:
+            if column not in columns:
+                # 旧记录的缓存 token 已计入 input_tokens，补齐的列为 0
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+    return len(existing) < len(ROLLUPS)
+
+
+def _aggregate_sql(table: str, where: str, source: str = "main.model_usage") -> str:
+    bucket, fmt = ROLLUPS[table]
+    # INSERT ... SELECT 与 ON CONFLICT 一起使用时 SELECT 必须带 WHERE
+    return f"""
+        INSERT INTO {table} ({bucket}, user_id, model_id, {", ".join(SUMMED_COLUMNS)}, requests)
+        SELECT strftime('{fmt}', timestamp), COALESCE(user_id, '{NO_USER}'), model_id,
+               {", ".join(f"SUM({column})" for column in SUMMED_COLUMNS)}, COUNT(*)
+        FROM {source}
+        WHERE {where}
+        GROUP BY 1, 2, 3
+        ON CONFLICT ({bucket}, user_id, model_id) DO UPDATE SET
+            {", ".join(f"{column} = {column} + excluded.{column}" for column in SUMMED_COLUMNS)},
+            requests = requests + excluded.requests
+    """
+
+
+def update_rollups(cursor: sqlite3.Cursor, after_id: int, source: str = "main.model_usage"):
+    """把 source 中 id 大于 after_id 的原始记录累加到汇总表，调用方负责提交事务。"""
+    for table in ROLLUPS:
+        cursor.execute(_aggregate_sql(table, "id > ?", source), (after_id,))
+
+
+def rebuild_month(conn: sqlite3.Connection, month: str, partition: Optional[str] = None, delete_raw: bool = False) -> int:
+    """
+    按主库与分区文件中该月的原始记录重新计算汇总表中该月的部分，在一个事务中完成，期间阻塞其他写入。
+    delete_raw 为真时同时删除主库中该月的原始记录（压缩）。返回该月原始记录数。
+    partition 不能已附加在 conn 上（同一文件附加两次时事务会互相锁住）。
+    """
+    start, end = month_bounds(month)
+    sources = ["main.model_usage"]
+    if partition is not None:
+        attach_partition(conn, partition, "rebuild")
+        sources.append("rebuild.model_usage")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for table, (bucket, fmt) in ROLLUPS.items():
+            cursor.execute(f"DELETE FROM main.{table} WHERE {bucket} >= strftime('{fmt}', ?) AND {bucket} < strftime('{fmt}', ?)", (start, end))
+        rows = 0
+        for source in sources:
+            for table in ROLLUPS:
+                cursor.execute(_aggregate_sql(table, "timestamp >= ? AND timestamp < ?", source), (start, end))
+            rows += cursor.execute(f"SELECT COUNT(*) FROM {source} WHERE timestamp >= ? AND timestamp < ?", (start, end)).fetchone()[0]
+        if delete_raw:
+            cursor.execute("DELETE FROM main.model_usage WHERE timestamp >= ? AND timestamp < ?", (start, end))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if partition is not None:
+            detach_partition(conn, "rebuild")
+    return rows
+
+
+def raw_months(conn: sqlite3.Connection, db_path: str):
+    """有原始记录的月份 -> 分区文件路径（只有主库记录时为 None）。"""
+    months = {row[0]: None for row in conn.execute("SELECT DISTINCT substr(timestamp, 1, 7) FROM main.model_usage") if row[0]}
+    months.update(list_partitions(db_path))
+    return dict(sorted(months.items()))
+
+
+def rebuild_rollups(conn: sqlite3.Connection, db_path: str):
+    """按全部原始记录逐月重新计算汇总表。每个月一个事务，不会与并发写入重复计数。"""
+    started = time.perf_counter()
+    months = raw_months(conn, db_path)
+    for month, partition in months.items():
+        rebuild_month(conn, month, partition)
+    logger.info("Rebuilt usage rollups for %d months in %.2fs", len(months), time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按原始使用记录重建 usage_hourly / usage_daily 汇总表")
+    parser.add_argument("--db", default="model_usage.db", help="数据库文件路径")
+    args = parser.parse_args()
+
+    from .sql import ModelUsageDB
+    with ModelUsageDB(args.db) as db:
+        rebuild_rollups(db.conn, args.db)
+        for table in ROLLUPS:
+            count = db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            print(f"{table}: {count} rows")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,64 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+
+from .sql import ModelUsageDB
+
+logger = logging.getLogger(__name__)
+
+# 按保留期压缩原始记录的检查间隔（秒）
+RETENTION_INTERVAL = 3600.0
+
+
+class UsageSink(ABC):
+    """
+    使用记录的存储后端，由 AsyncDBWriter 的消费线程按批调用，所有方法都在该线程中执行。
+    每行的字段与 ModelUsageDB.add_usage 的参数相同，timestamp 为空表示写入时的当前时间。
+    """
+    name: str = ""
+
+    def open(self):
+        pass
+
+    @abstractmethod
+    def write(self, rows: List[Dict[str, Any]]):
+        """写入一批记录。抛出异常时这批记录视为写入失败。"""
+
+    def tick(self):
+        """队列空闲时定期调用，用于按时间刷新或滚动文件。"""
+
+    def close(self):
+        pass
+
+
+class SqliteSink(UsageSink):
+    """写入 model_usage 表（或按月分区），每批一个事务，并定期压缩超过保留期的原始记录。"""
+    name = "sqlite"
+
+    def __init__(self, db_path: str, partitioned: bool = False, raw_retention_months: int = 0):
+        self.db = ModelUsageDB(db_path, partitioned=partitioned, raw_retention_months=raw_retention_months)
+        self._retention_at = 0.0
+
+    def open(self):
+        self.db.open()
+        self._apply_retention()
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.db.add_usages(rows)
+
+    def tick(self):
+        if time.monotonic() - self._retention_at >= RETENTION_INTERVAL:
+            self._apply_retention()
+
+    def _apply_retention(self):
+        self._retention_at = time.monotonic()
+        try:
+            for month, rows in self.db.apply_retention():
+                logger.info("Compacted %d raw usage rows of %s into rollups", rows, month)
+        except Exception:
+            # 下次检查时重试，不影响写入
+            logger.exception("Failed to compact raw usage rows")
+
+    def close(self):
+        self.db.close()
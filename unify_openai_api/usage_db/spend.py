@@ -0,0 +1,109 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from ..registry.config import UserConfig
+from .sql import ModelUsageDB
+
+logger = logging.getLogger(__name__)
+
+# 数据库中的 total_fee 以价格（每百万 token）乘以 token 数记录
+FEE_SCALE = 1_000_000
+
+
+class BudgetExceeded(Exception):
+    """用户当前周期的花费已达到上限。"""
+
+    def __init__(self, user_id: str, scope: str, period: str, spent: float, budget: float, retry_after: float):
+        self.user_id = user_id
+        self.scope = scope
+        self.period = period
+        self.spent = spent
+        self.budget = budget
+        # 距离下一个周期开始的秒数
+        self.retry_after = retry_after
+        super().__init__(f"User {user_id} has spent {spent:.4f} of the {period} budget {budget:g} for {scope}")
+
+
+def _period_starts(now: datetime) -> Tuple[datetime, datetime]:
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day, day.replace(day=1)
+
+
+class SpendTracker:
+    """
+    内存中的每用户花费，按当天和当月（UTC）分别累计，总额与按模型的明细都是 O(1) 查询。
+    启动时从使用记录数据库初始化，之后由 AsyncDBWriter.add_usage 累加。
+    只在事件循环线程中访问。
+    """
+
+    def __init__(self):
+        self._day, self._month = _period_starts(datetime.now(timezone.utc))
+        # 周期 -> (user_id, model_name) -> 花费；model_name 为注册表中的名称，为 None 时是该用户的总额
+        self._spend: Dict[str, Dict[Tuple[str, Optional[str]], float]] = {"daily": defaultdict(float), "monthly": defaultdict(float)}
+
+    def seed(self, db_path: str):
+        """
+        从数据库读取当天和当月已有的花费。在后台线程调用，此时还未开始处理请求。
+        总额来自汇总表；按模型的明细来自原始记录中的 model_name，没有记录 model_name 的旧记录只计入总额。
+        """
+        with ModelUsageDB(db_path) as db:
+            for period, since in (("daily", self._day), ("monthly", self._month)):
+                spend = self._spend[period]
+                for row in db.get_fee_by_user_model(since):
+                    spend[(row["user_id"], None)] += row["total_fee"] / FEE_SCALE
+                for row in db.get_fee_by_user_model_name(since):
+                    spend[(row["user_id"], row["model_name"])] += row["total_fee"] / FEE_SCALE
+        logger.info("Seeded spend for %d users this month", sum(1 for _, model in self._spend["monthly"] if model is None))
+
+    def add(self, user_id: Optional[str], model_name: Optional[str], fee: float):
+        """fee 为本次调用的费用（已除以 FEE_SCALE），model_name 为注册表中的名称，为空时只计入总额。"""
+        if not user_id or not fee:
+            return
+        self._roll()
+        for spend in self._spend.values():
+            spend[(user_id, None)] += fee
+            if model_name:
+                spend[(user_id, model_name)] += fee
+
+    def spent(self, period: str, user_id: str, model_name: Optional[str] = None) -> float:
+        self._roll()
+        return self._spend[period].get((user_id, model_name), 0.0)
+
+    def check(self, user: UserConfig, model_name: str, estimated: float = 0.0):
+        """
+        已花费加上本次请求的估计费用超出用户总额或该模型上限时抛出 BudgetExceeded。
+        model_name 为注册表中的名称；共用同一个上游模型的注册表模型分别计算。
+        """
+        self._roll()
+        scopes = [("all models", None, user.budget)]
+        model_budget = user.model_budgets.get(model_name)
+        if model_budget is not None:
+            scopes.append((model_name, model_name, model_budget))
+        for scope, key, budget in scopes:
+            for period in self._spend:
+                limit = getattr(budget, period)
+                if limit is None:
+                    continue
+                spent = self._spend[period].get((user.name, key), 0.0)
+                if spent >= limit or spent + estimated > limit:
+                    raise BudgetExceeded(user.name, scope, period, spent, limit, self._retry_after(period))
+
+    def _retry_after(self, period: str) -> float:
+        now = datetime.now(timezone.utc)
+        if period == "daily":
+            reset = self._day + timedelta(days=1)
+        else:
+            reset = (self._month + timedelta(days=32)).replace(day=1)
+        return (reset - now).total_seconds()
+
+    def _roll(self):
+        """跨天或跨月时清空对应周期的计数。"""
+        day, month = _period_starts(datetime.now(timezone.utc))
+        if day != self._day:
+            self._day = day
+            self._spend["daily"].clear()
+        if month != self._month:
+            self._month = month
+            self._spend["monthly"].clear()
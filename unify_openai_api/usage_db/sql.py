@@ -1,22 +1,80 @@
 import sqlite3
 import os
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple
+
+from .partitions import (TIMESTAMP_FORMAT, add_missing_columns, alias_for, attach_partition, detach_partition,
+                         list_partitions, month_of, partition_path, remove_partition, shift_month)
+from .rollup import NO_USER, create_rollup_tables, raw_months, rebuild_month, rebuild_rollups, update_rollups
+
+# WAL 模式下读取（print_usage.py 等）不阻塞写入；synchronous=NORMAL 只在 checkpoint 时 fsync
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    # 汇总表重建与压缩按月在一个事务中进行，写入方需要能等待
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+]
+
+# 报表查询用到的全部列
+REPORT_INDEX_COLUMNS = ("timestamp", "user_id", "model_id", "input_tokens", "output_tokens", "total_fee")
+
+USAGE_COLUMNS = (
+    "model_id", "input_tokens", "input_price", "output_tokens", "output_multiplier", "total_fee", "user_id", "served_from",
+    "cache_read_tokens", "cache_read_price", "cache_write_tokens", "cache_write_price", "model_name", "timestamp",
+)
+
+# 行中缺省的字段写入的值，其余缺省为 NULL
+USAGE_DEFAULTS = {"cache_read_tokens": 0, "cache_read_price": 0, "cache_write_tokens": 0, "cache_write_price": 0}
+
+# 写入连接同时附加的分区数上限（SQLite 默认最多附加 10 个数据库）
+MAX_ATTACHED_PARTITIONS = 3
+
+
+def _insert_sql(table: str) -> str:
+    # 未提供时间戳的行使用当前时间，使不同行可以在同一个 executemany 中写入
+    return f"""
+        INSERT INTO {table} ({", ".join(USAGE_COLUMNS)})
+        VALUES ({", ".join("?" * (len(USAGE_COLUMNS) - 1))}, COALESCE(?, CURRENT_TIMESTAMP))
+    """
+
+
+INSERT_USAGE = _insert_sql("main.model_usage")
+
+
+def _row_values(row: Dict[str, Any]) -> tuple:
+    return tuple(row.get(column, USAGE_DEFAULTS.get(column)) for column in USAGE_COLUMNS)
+
+
+def _utc_timestamp(timestamp: Any) -> str:
+    """分区写入时统一为 UTC 的 "YYYY-MM-DD HH:MM:SS"，使文本比较与所在分区一致。"""
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc)
+        return timestamp.strftime(TIMESTAMP_FORMAT)
+    return timestamp
 
 
 class ModelUsageDB:
     """管理模型使用情况的SQLite数据库"""
     
-    def __init__(self, db_path: str = "model_usage.db"):
+    def __init__(self, db_path: str = "model_usage.db", partitioned: bool = False, raw_retention_months: int = 0):
         """
         初始化数据库连接
         
         Args:
             db_path: 数据库文件路径
+            partitioned: 是否把原始记录按月写入分区文件，主库只保存汇总表（可选）
+            raw_retention_months: 保留原始记录的月数（含当月），更早的月份由 apply_retention 压缩；0 表示一直保留
         """
         self.db_path = db_path
+        self.partitioned = partitioned
+        self.raw_retention_months = raw_retention_months
         self.conn = None
         self.cursor = None
+        # 写入连接上已附加的分区：月份 -> 别名，按最近使用排序
+        self._attached: "OrderedDict[str, str]" = OrderedDict()
         
     def open(self):
         """打开数据库连接并初始化表结构"""
@@ -27,6 +85,8 @@ class ModelUsageDB:
         # 建立连接
         self.conn = sqlite3.connect(self.db_path)
         self.cursor = self.conn.cursor()
+        for pragma in PRAGMAS:
+            self.cursor.execute(pragma)
         
         # 创建表（如果不存在）
         self._create_tables()
@@ -37,6 +97,7 @@ class ModelUsageDB:
             self.conn.close()
             self.conn = None
             self.cursor = None
+            self._attached.clear()
     
     def _create_tables(self):
         """创建必要的表结构（如果不存在）"""
@@ -57,16 +118,45 @@ class ModelUsageDB:
                     output_tokens INTEGER NOT NULL,
                     output_multiplier INTEGER NOT NULL,
                     total_fee INTEGER NOT NULL,
-                    user_id TEXT
+                    user_id TEXT,
+                    served_from TEXT
                 )
             """)
             
             # 创建索引
             self.cursor.execute("CREATE INDEX idx_user ON model_usage (user_id)")
             self.cursor.execute("CREATE INDEX idx_model ON model_usage (model_id)")
-            self.cursor.execute("CREATE INDEX idx_timestamp ON model_usage (timestamp)")
             
             self.conn.commit()
+
+        self._migrate_columns()
+        self._migrate_indexes()
+
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_compactions (
+                month TEXT PRIMARY KEY,
+                raw_rows INTEGER NOT NULL,
+                compacted_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        if create_rollup_tables(self.cursor):
+            # 新建的汇总表按已有记录回填一次
+            self.conn.commit()
+            rebuild_rollups(self.conn, self.db_path)
+
+    def _migrate_columns(self):
+        """为旧数据库补齐后续新增的列"""
+        add_missing_columns(self.conn)
+        self.conn.commit()
+    
+    def _migrate_indexes(self):
+        """
+        按时间范围汇总的覆盖索引：报表只读索引、不回表。
+        它以 timestamp 开头，取代原来的单列 timestamp 索引。
+        """
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_time_user_model ON model_usage ({', '.join(REPORT_INDEX_COLUMNS)})")
+        self.cursor.execute("DROP INDEX IF EXISTS idx_timestamp")
+        self.conn.commit()
     
     def add_usage(self, 
                   model_id: str, 
@@ -76,7 +166,13 @@ class ModelUsageDB:
                   output_multiplier: int, 
                   total_fee: int,
                   user_id: Optional[str] = None,
-                  timestamp: Optional[datetime] = None):
+                  timestamp: Optional[datetime] = None,
+                  served_from: Optional[str] = None,
+                  cache_read_tokens: int = 0,
+                  cache_read_price: int = 0,
+                  cache_write_tokens: int = 0,
+                  cache_write_price: int = 0,
+                  model_name: Optional[str] = None):
         """
         添加模型使用记录
         
@@ -88,25 +184,144 @@ class ModelUsageDB:
             output_price: 输出价格
             user_id: 用户ID（可选）
             timestamp: 时间戳（可选，默认为当前时间）
+            served_from: 未访问上游时的响应来源，例如 "cache"（可选）
+            cache_read_tokens: 从 prompt cache 读取的输入 token 数，包含在 input_tokens 中（可选）
+            cache_read_price: 缓存读取价格（可选）
+            cache_write_tokens: 写入 prompt cache 的输入 token 数，包含在 input_tokens 中（可选）
+            cache_write_price: 缓存写入价格（可选）
+            model_name: 注册表中的模型名称（可选）
+        """
+        self.add_usages([dict(
+            model_id=model_id,
+            input_tokens=input_tokens,
+            input_price=input_price,
+            output_tokens=output_tokens,
+            output_multiplier=output_multiplier,
+            total_fee=total_fee,
+            user_id=user_id,
+            timestamp=timestamp,
+            served_from=served_from,
+            cache_read_tokens=cache_read_tokens,
+            cache_read_price=cache_read_price,
+            cache_write_tokens=cache_write_tokens,
+            cache_write_price=cache_write_price,
+            model_name=model_name,
+        )])
+
+    def add_usages(self, rows: List[Dict[str, Any]]):
+        """
+        在一个事务中批量添加使用记录并更新汇总表，只提交一次
+        
+        Args:
+            rows: 每项的字段与 add_usage 的参数相同，timestamp 与 served_from 可以缺省
         """
         if not self.conn:
             self.open()
             
-        if timestamp is None:
-            self.cursor.execute("""
-                INSERT INTO model_usage 
-                (model_id, input_tokens, input_price, output_tokens, output_multiplier, total_fee, user_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (model_id, input_tokens, input_price, output_tokens, output_multiplier, total_fee, user_id))
-        else:
-            # 如果提供了时间戳，则使用它
-            self.cursor.execute("""
-                INSERT INTO model_usage 
-                (model_id, input_tokens, input_price, output_tokens, output_multiplier, total_fee, user_id, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (model_id, input_tokens, input_price, output_tokens, output_multiplier, total_fee, user_id, timestamp))
+        if self.partitioned:
+            self._add_partitioned(rows)
+            return
             
-        self.conn.commit()
+        try:
+            self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM model_usage")
+            last_id = self.cursor.fetchone()[0]
+            self.cursor.executemany(INSERT_USAGE, [_row_values(row) for row in rows])
+            update_rollups(self.cursor, last_id)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _add_partitioned(self, rows: List[Dict[str, Any]]):
+        """按记录所属月份写入分区，并在同一次提交中更新主库的汇总表。"""
+        now = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+        by_month: Dict[str, List[tuple]] = dict()
+        for row in rows:
+            timestamp = _utc_timestamp(row.get("timestamp")) or now
+            values = _row_values(row)[:-1] + (timestamp,)
+            by_month.setdefault(month_of(timestamp), []).append(values)
+        # ATTACH 不能在事务中执行，先附加涉及的分区；跨越多个月份的批次（例如补录）按附加上限分组提交
+        months = sorted(by_month)
+        for i in range(0, len(months), MAX_ATTACHED_PARTITIONS):
+            group = months[i:i + MAX_ATTACHED_PARTITIONS]
+            aliases = {month: self._partition_alias(month) for month in group}
+            try:
+                for month in group:
+                    table = f"{aliases[month]}.model_usage"
+                    self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                    last_id = self.cursor.fetchone()[0]
+                    self.cursor.executemany(_insert_sql(table), by_month[month])
+                    update_rollups(self.cursor, last_id, table)
+                # WAL 模式下跨文件的提交对每个文件分别是原子的
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _partition_alias(self, month: str) -> str:
+        alias = self._attached.get(month)
+        if alias is not None:
+            self._attached.move_to_end(month)
+            return alias
+        while len(self._attached) >= MAX_ATTACHED_PARTITIONS:
+            _, oldest = self._attached.popitem(last=False)
+            detach_partition(self.conn, oldest)
+        alias = alias_for(month)
+        attach_partition(self.conn, partition_path(self.db_path, month), alias)
+        self._attached[month] = alias
+        return alias
+
+    def _query_raw(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        """在主库和每个分区上依次执行 sql（其中 {table} 替换为对应的 model_usage 表）并合并结果。"""
+        if not self.conn:
+            self.open()
+            
+        results = []
+        sources: List[Tuple[str, Optional[str]]] = [("main", None)]
+        sources += [(self._attached.get(month, "scan"), path) for month, path in list_partitions(self.db_path).items()]
+        for alias, path in sources:
+            attach = alias == "scan"
+            if attach:
+                attach_partition(self.conn, path, alias)
+            try:
+                self.cursor.execute(sql.format(table=f"{alias}.model_usage"), params)
+                columns = [description[0] for description in self.cursor.description]
+                results += [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            finally:
+                if attach:
+                    detach_partition(self.conn, alias)
+        return results
+
+    def apply_retention(self) -> List[Tuple[str, int]]:
+        """
+        把早于保留期的月份压缩到汇总表：按该月全部原始记录重新计算汇总，之后删除主库中该月的记录和分区文件。
+        
+        Returns:
+            (月份, 压缩掉的原始记录数) 列表
+        """
+        if not self.conn:
+            self.open()
+        if self.raw_retention_months <= 0:
+            return []
+            
+        cutoff = shift_month(month_of(datetime.now(timezone.utc)), 1 - self.raw_retention_months)
+        compacted = []
+        for month, path in raw_months(self.conn, self.db_path).items():
+            if month >= cutoff:
+                continue
+            alias = self._attached.pop(month, None)
+            if alias is not None:
+                detach_partition(self.conn, alias)
+            rows = rebuild_month(self.conn, month, path, delete_raw=True)
+            self.cursor.execute("""
+                INSERT INTO usage_compactions (month, raw_rows) VALUES (?, ?)
+                ON CONFLICT (month) DO UPDATE SET raw_rows = raw_rows + excluded.raw_rows, compacted_at = CURRENT_TIMESTAMP
+            """, (month, rows))
+            self.conn.commit()
+            if path is not None:
+                remove_partition(path)
+            compacted.append((month, rows))
+        return compacted
         
     def get_usage_by_user(self, user_id: str) -> List[Dict[str, Any]]:
         """
@@ -118,15 +333,10 @@ class ModelUsageDB:
         Returns:
             包含用户使用记录的字典列表
         """
-        if not self.conn:
-            self.open()
-            
-        self.cursor.execute("""
-            SELECT * FROM model_usage WHERE user_id = ? ORDER BY timestamp DESC
+        rows = self._query_raw("""
+            SELECT * FROM {table} WHERE user_id = ?
         """, (user_id,))
-        
-        columns = [description[0] for description in self.cursor.description]
-        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        return sorted(rows, key=lambda row: row["timestamp"], reverse=True)
     
     def get_usage_by_model(self, model_id: str) -> List[Dict[str, Any]]:
         """
@@ -138,15 +348,10 @@ class ModelUsageDB:
         Returns:
             包含模型使用记录的字典列表
         """
-        if not self.conn:
-            self.open()
-            
-        self.cursor.execute("""
-            SELECT * FROM model_usage WHERE model_id = ? ORDER BY timestamp DESC
+        rows = self._query_raw("""
+            SELECT * FROM {table} WHERE model_id = ?
         """, (model_id,))
-        
-        columns = [description[0] for description in self.cursor.description]
-        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        return sorted(rows, key=lambda row: row["timestamp"], reverse=True)
     
     def get_usage_by_date_range(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
         """
@@ -159,17 +364,55 @@ class ModelUsageDB:
         Returns:
             包含指定日期范围内使用记录的字典列表
         """
+        rows = self._query_raw("""
+            SELECT * FROM {table} 
+            WHERE timestamp BETWEEN ? AND ?
+        """, (start_date, end_date))
+        return sorted(rows, key=lambda row: row["timestamp"], reverse=True)
+        
+    def get_fee_by_user_model(self, since: datetime) -> List[Dict[str, Any]]:
+        """
+        按用户和模型汇总某天之后的费用，读取按天汇总表
+        
+        Args:
+            since: 起始时间（UTC），按所在日期计算
+        
+        Returns:
+            包含 user_id、model_id、total_fee 的字典列表
+        """
         if not self.conn:
             self.open()
             
         self.cursor.execute("""
-            SELECT * FROM model_usage 
-            WHERE timestamp BETWEEN ? AND ?
-            ORDER BY timestamp DESC
-        """, (start_date, end_date))
+            SELECT user_id, model_id, SUM(total_fee) AS total_fee FROM usage_daily
+            WHERE day >= ? AND user_id != ?
+            GROUP BY user_id, model_id
+        """, (since.strftime("%Y-%m-%d"), NO_USER))
         
         columns = [description[0] for description in self.cursor.description]
         return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def get_fee_by_user_model_name(self, since: datetime) -> List[Dict[str, Any]]:
+        """
+        按用户和注册表中的模型名称汇总某个时间之后的费用，读取原始记录（汇总表只按 model_id 汇总）
+        
+        Args:
+            since: 起始时间（UTC）
+        
+        Returns:
+            包含 user_id、model_name、total_fee 的字典列表，没有 model_name 的旧记录不包含在内
+        """
+        rows = self._query_raw("""
+            SELECT user_id, model_name, SUM(total_fee) AS total_fee FROM {table}
+            WHERE timestamp >= ? AND user_id IS NOT NULL AND model_name IS NOT NULL
+            GROUP BY user_id, model_name
+        """, (_utc_timestamp(since),))
+        # 同一个用户和模型可能分布在主库与多个分区中
+        fees: Dict[Tuple[str, str], int] = dict()
+        for row in rows:
+            key = (row["user_id"], row["model_name"])
+            fees[key] = fees.get(key, 0) + row["total_fee"]
+        return [dict(user_id=user_id, model_name=model_name, total_fee=fee) for (user_id, model_name), fee in fees.items()]
         
     def __enter__(self):
         """上下文管理器入口"""
@@ -1,54 +1,155 @@
+import os
 import threading
 import queue
-from typing import Optional
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 from datetime import datetime
-from .sql import ModelUsageDB  # 假设之前的类保存在这个模块中
+from .parquet import ParquetSink, ParquetSinkConfig
+from .sink import SqliteSink, UsageSink
+from .spend import FEE_SCALE, SpendTracker
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 队列满时的处理方式
+OVERFLOW_POLICIES = ("drop", "block")
+
+# 可用的存储后端
+SINKS = ("sqlite", "parquet")
+
+# SQLite 原始记录的存放方式：month 每月一个分区文件；none 全部写入主库
+PARTITIONS = ("month", "none")
+
+# stop() 放入队列的结束标记
+_STOP = object()
+
+# 队列空闲时调用 UsageSink.tick 的间隔（秒）
+_TICK_INTERVAL = 1.0
+
+
+@dataclass
+class WriterConfig:
+    """使用记录写入参数：攒够 batch_size 行或距第一行超过 flush_interval 秒时提交一次。"""
+    batch_size: int = 500
+    flush_interval: float = 0.2
+    # 队列上限，0 表示不限制
+    max_queue: int = 100_000
+    # 队列满时：drop 丢弃新记录并计数；block 阻塞调用方（会阻塞事件循环）直到有空位
+    overflow: str = "drop"
+    # 同时写入的存储后端，sqlite 之外的后端不参与启动时的花费统计
+    sinks: Tuple[str, ...] = ("sqlite",)
+    partition: str = "month"
+    # 保留原始记录的月数（含当月），更早的只保留在汇总表中；0 表示一直保留
+    raw_retention_months: int = 0
+
+    @classmethod
+    def from_env(cls) -> "WriterConfig":
+        """从环境变量读取配置，未设置的字段使用默认值。"""
+        default = cls()
+        config = cls(
+            batch_size=int(os.getenv("UNIFY_USAGE_BATCH_SIZE", default.batch_size)),
+            flush_interval=float(os.getenv("UNIFY_USAGE_FLUSH_INTERVAL", default.flush_interval)),
+            max_queue=int(os.getenv("UNIFY_USAGE_MAX_QUEUE", default.max_queue)),
+            overflow=os.getenv("UNIFY_USAGE_OVERFLOW", default.overflow),
+            sinks=tuple(s.strip() for s in os.getenv("UNIFY_USAGE_SINKS", ",".join(default.sinks)).split(",") if s.strip()),
+            partition=os.getenv("UNIFY_USAGE_PARTITION", default.partition),
+            raw_retention_months=int(os.getenv("UNIFY_USAGE_RAW_RETENTION_MONTHS", default.raw_retention_months)),
+        )
+        if config.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"UNIFY_USAGE_OVERFLOW must be one of {OVERFLOW_POLICIES}, got {config.overflow!r}")
+        if not config.sinks or set(config.sinks) - set(SINKS):
+            raise ValueError(f"UNIFY_USAGE_SINKS must be a comma separated subset of {SINKS}, got {config.sinks!r}")
+        if config.partition not in PARTITIONS:
+            raise ValueError(f"UNIFY_USAGE_PARTITION must be one of {PARTITIONS}, got {config.partition!r}")
+        if config.raw_retention_months < 0:
+            raise ValueError(f"UNIFY_USAGE_RAW_RETENTION_MONTHS must be >= 0, got {config.raw_retention_months}")
+        return config
+
+
 class AsyncDBWriter:
-    """异步数据库写入器，使用线程和队列实现MPSC模式"""
-    
-    def __init__(self, db_path: str = "model_usage.db"):
+    """异步数据库写入器，使用线程和队列实现MPSC模式，消费线程按批提交"""
+
+    def __init__(self, db_path: str = "model_usage.db", spend: Optional[SpendTracker] = None, config: Optional[WriterConfig] = None):
         """
         初始化异步写入器
-        
+
         Args:
             db_path: 数据库文件路径
+            spend: 内存中的用户花费统计，写入时同步累加（可选）
+            config: 批量提交与队列参数（可选，默认为 WriterConfig()）
         """
         self.db_path = db_path
-        self.queue = queue.Queue()
-        self._stop_event = threading.Event()
+        self.spend = spend
+        self.config = config or WriterConfig()
+        self.sinks: List[UsageSink] = [self._make_sink(name) for name in self.config.sinks]
+        self.queue = queue.Queue(maxsize=self.config.max_queue)
         self.worker_thread = None
-        
+        # 以下计数只由单个线程写入，读取时允许略有滞后
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rows_dropped = 0
+        self.batches = 0
+
+    def _make_sink(self, name: str) -> UsageSink:
+        if name == "parquet":
+            return ParquetSink(ParquetSinkConfig.from_env())
+        return SqliteSink(self.db_path, partitioned=self.config.partition == "month",
+                          raw_retention_months=self.config.raw_retention_months)
+
     def start(self):
         """启动消费者线程"""
         if self.worker_thread is not None and self.worker_thread.is_alive():
             return
-            
+
         self.worker_thread = threading.Thread(
             target=self._db_writer_worker,
             daemon=True
         )
         self.worker_thread.start()
-        
-    def stop(self):
-        """停止消费者线程"""
-        self._stop_event.set()
-        self.queue.join()  # 等待队列中所有任务完成
-            
-    def add_usage(self, 
-                 model_id: str, 
-                 input_tokens: int, 
-                 input_price: float, 
-                 output_tokens: int, 
-                 output_price: float, 
+
+    def stop(self, timeout: Optional[float] = None):
+        """写入队列中剩余的记录后停止消费者线程"""
+        if self.worker_thread is None:
+            return
+        # 结束标记排在已有记录之后，队列满时等待消费线程腾出空位
+        self.queue.put(_STOP)
+        self.worker_thread.join(timeout)
+        if self.worker_thread.is_alive():
+            logger.error("Usage writer did not finish within %ss, %d rows still queued", timeout, self.queue.qsize())
+        self.worker_thread = None
+
+    def add_usage(self,
+                 model_id: str,
+                 input_tokens: int,
+                 input_price: float,
+                 output_tokens: int,
+                 output_price: float,
                  user_id: Optional[str] = None,
-                 timestamp: Optional[datetime] = None):
-        total_fee = input_tokens * input_price + output_tokens * output_price
-        
-        self.queue.put(dict(
+                 timestamp: Optional[datetime] = None,
+                 served_from: Optional[str] = None,
+                 cache_read_tokens: int = 0,
+                 cache_read_price: Optional[float] = None,
+                 cache_write_tokens: int = 0,
+                 cache_write_price: Optional[float] = None,
+                 model_name: Optional[str] = None):
+        """
+        input_tokens 包含 prompt cache 读取与写入的 token，这两部分按各自的价格（缺省为输入价格）计费。
+        model_id 为上游模型，model_name 为注册表中的模型名称。
+        """
+        cache_read_price = input_price if cache_read_price is None else cache_read_price
+        cache_write_price = input_price if cache_write_price is None else cache_write_price
+        # served_from 非空表示未访问上游（例如缓存命中），不计费
+        total_fee = 0 if served_from else (
+            (input_tokens - cache_read_tokens - cache_write_tokens) * input_price
+            + cache_read_tokens * cache_read_price
+            + cache_write_tokens * cache_write_price
+            + output_tokens * output_price
+        )
+        if self.spend is not None:
+            self.spend.add(user_id, model_name, total_fee / FEE_SCALE)
+
+        row = dict(
             model_id = model_id,
             input_tokens = input_tokens,
             input_price = round(input_price * 1000),
@@ -56,22 +157,101 @@ class AsyncDBWriter:
             output_multiplier = round(output_price / input_price * 10),
             total_fee = round(total_fee),
             user_id = user_id,
-            timestamp = timestamp
-        ))
-        
+            timestamp = timestamp,
+            served_from = served_from,
+            cache_read_tokens = cache_read_tokens,
+            cache_read_price = round(cache_read_price * 1000),
+            cache_write_tokens = cache_write_tokens,
+            cache_write_price = round(cache_write_price * 1000),
+            model_name = model_name,
+        )
+        if self.config.overflow == "block":
+            self.queue.put(row)
+            return
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.rows_dropped += 1
+            # 写入持续跟不上时避免刷屏
+            if self.rows_dropped % 1000 == 1:
+                logger.error("Usage queue is full, %d usage rows dropped so far, latest: %s", self.rows_dropped, row)
+
+    def _next_batch(self) -> List[dict]:
+        """
+        等待第一行，之后在 flush_interval 内继续收集直到 batch_size 行。遇到结束标记时将其留在末尾。
+        空闲超过 _TICK_INTERVAL 时返回空列表。
+        """
+        try:
+            batch = [self.queue.get(timeout=_TICK_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.config.flush_interval
+        while len(batch) < self.config.batch_size and batch[-1] is not _STOP:
+            try:
+                # 队列中已有的记录直接取出，不足时才等待
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
     def _db_writer_worker(self):
         """消费者线程工作函数"""
-        with ModelUsageDB(self.db_path) as db:
-            while not self._stop_event.is_set() or not self.queue.empty():
-                try:
-                    # 设置超时以避免无限等待
-                    data = self.queue.get()
-                    
-                    # 使用已实现的数据库方法写入
-                    db.add_usage(**data)
-                    self.queue.task_done()
-                    
-                except queue.Empty:
+        sinks = []
+        for sink in self.sinks:
+            try:
+                sink.open()
+                sinks.append(sink)
+            except Exception as e:
+                logger.error(f"Failed to open usage sink {sink.name}: {e}")
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    self._tick(sinks)
                     continue
+                stopping = batch[-1] is _STOP
+                rows = batch[:-1] if stopping else batch
+                try:
+                    if rows:
+                        self._write(sinks, rows)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+                if stopping:
+                    break
+        finally:
+            for sink in sinks:
+                try:
+                    sink.close()
                 except Exception as e:
-                    logger.error(f"Error writing to database: {e}")
\ No newline at end of file
+                    logger.error(f"Error closing usage sink {sink.name}: {e}")
+
+    def _write(self, sinks: List[UsageSink], rows: List[dict]):
+        """每个后端独立写入，一个后端失败不影响其他后端。任一后端失败的行计入 rows_failed。"""
+        failed = not sinks
+        for sink in sinks:
+            try:
+                sink.write(rows)
+            except Exception as e:
+                failed = True
+                logger.error(f"Error writing {len(rows)} usage rows to {sink.name}: {e}")
+        if failed:
+            self.rows_failed += len(rows)
+        else:
+            self.rows_written += len(rows)
+            self.batches += 1
+
+    def _tick(self, sinks: List[UsageSink]):
+        for sink in sinks:
+            try:
+                sink.tick()
+            except Exception as e:
+                logger.error(f"Error in usage sink {sink.name}: {e}")
@@ -0,0 +1,193 @@
+import functools
+import math
+import random
+import sys
+import time
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .http_pool import HttpPool
+
+# EWMA 的衰减时间常数（秒），越小越偏向最近的样本
+EWMA_DECAY = 10.0
+# 收到 429 且没有 Retry-After 时的冷却时间（秒）
+DEFAULT_COOLDOWN = 1.0
+
+
+@dataclass
+class Endpoint:
+    """同一 provider 的一组 (base_url, api_key) 之一，以及它的运行统计。"""
+    base_url: str
+    api_key: str
+    # 用于展示，不暴露 key 本身
+    name: str
+    outstanding: int = 0
+    requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    # 响应头到达耗时的 EWMA（秒），None 表示还没有样本
+    ewma: Optional[float] = None
+    _ewma_at: float = 0.0
+    cooldown_until: float = 0.0
+
+    def observe(self, latency: float):
+        now = time.monotonic()
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            # 按时间衰减，长时间没有样本时旧值的权重更低
+            weight = math.exp(-(now - self._ewma_at) / EWMA_DECAY)
+            self.ewma = self.ewma * weight + latency * (1 - weight)
+        self._ewma_at = now
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.name,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "ewma_latency": self.ewma,
+            "cooling_down": self.cooldown_until > time.monotonic(),
+        }
+
+
+def _least_outstanding(endpoint: Endpoint) -> float:
+    return endpoint.outstanding
+
+
+def _ewma(endpoint: Endpoint) -> float:
+    # 没有样本的 endpoint 优先尝试；并发越高代价越大
+    return (endpoint.ewma or 0.0) * (endpoint.outstanding + 1)
+
+
+STRATEGIES: Dict[str, Callable[[Endpoint], float]] = {
+    "least_outstanding": _least_outstanding,
+    "ewma": _ewma,
+}
+
+
+class Balancer:
+    """在一组 endpoint 中选择代价最低的一个，代价相同时随机选择，跳过被限流冷却中的 endpoint。"""
+
+    def __init__(self, endpoints: List[Endpoint], strategy: str = "least_outstanding"):
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self._cost = STRATEGIES[strategy]
+
+    def _ready(self, exclude: Set[int]) -> List[Endpoint]:
+        now = time.monotonic()
+        return [e for e in self.endpoints if e.cooldown_until <= now and id(e) not in exclude]
+
+    def available(self, exclude: Set[int] = frozenset()) -> bool:
+        return bool(self._ready(exclude))
+
+    def pick(self, exclude: Set[int] = frozenset()) -> Endpoint:
+        """exclude 为本次请求已经尝试过的 endpoint 的 id。"""
+        candidates = self._ready(exclude) or self.endpoints
+        best = min(self._cost(e) for e in candidates)
+        return random.choice([e for e in candidates if self._cost(e) == best])
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [e.stats() for e in self.endpoints]
+
+
+class BalancingTransport:
+    """
+    SDK 客户端使用的 transport：每个请求改写到选中的 endpoint，并替换鉴权头。
+    请求实际通过 HttpPool 中对应 origin 的共享连接池发出，OpenAIProxy / AnthropicProxy 无需感知。
+    SDK 可能基于 httpx 或 httpx2，这里按收到的请求类型使用同一个包。
+    """
+
+    def __init__(self, balancer: Balancer, pool: HttpPool, auth_header: str, auth_prefix: str = ""):
+        self.balancer = balancer
+        self.pool = pool
+        self.auth_header = auth_header
+        self.auth_prefix = auth_prefix
+        # SDK 客户端以第一个 endpoint 的 base_url 构造
+        self._base = balancer.endpoints[0].base_url.rstrip("/")
+
+    async def handle_async_request(self, request):
+        lib = sys.modules[type(request).__module__.partition(".")[0]]
+        tried = set()
+        while True:
+            endpoint = self.balancer.pick(exclude=tried)
+            tried.add(id(endpoint))
+            response = await self._send(lib, request, endpoint)
+            # 被限流时换一个未冷却的 endpoint 重发，都不可用时把 429 交给 SDK 处理
+            if response.status_code != 429 or not self.balancer.available(exclude=tried):
+                break
+            await response.aclose()
+            endpoint.outstanding -= 1
+
+        return lib.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_tracked_stream_class(lib)(response, endpoint),
+            extensions=response.extensions,
+        )
+
+    async def _send(self, lib: ModuleType, request, endpoint: Endpoint):
+        url = str(request.url)
+        if url.startswith(self._base):
+            url = endpoint.base_url.rstrip("/") + url[len(self._base):]
+        headers = request.headers.copy()
+        headers[self.auth_header] = self.auth_prefix + endpoint.api_key
+        upstream = lib.Request(request.method, url, headers=headers, stream=request.stream, extensions=request.extensions)
+
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        started = time.perf_counter()
+        try:
+            response = await self.pool.client_for(endpoint.base_url, lib).send(upstream, stream=True)
+        except BaseException:
+            endpoint.outstanding -= 1
+            endpoint.errors += 1
+            raise
+
+        endpoint.observe(time.perf_counter() - started)
+        if response.status_code == 429:
+            endpoint.rate_limited += 1
+            endpoint.cooldown_until = time.monotonic() + _retry_after(response)
+        elif response.status_code >= 500:
+            endpoint.errors += 1
+        return response
+
+    async def aclose(self):
+        # 连接池由 HttpPool 统一关闭
+        pass
+
+
+def _retry_after(response) -> float:
+    try:
+        return float(response.headers.get("retry-after", DEFAULT_COOLDOWN))
+    except ValueError:
+        return DEFAULT_COOLDOWN
+
+
+@functools.lru_cache(maxsize=None)
+def _tracked_stream_class(lib: ModuleType) -> type:
+    """Response 要求 stream 是同一个包的 AsyncByteStream。"""
+
+    class TrackedStream(lib.AsyncByteStream):
+        """响应体读完或被关闭时才结束 endpoint 上的一个 outstanding 请求，流式响应也按完整时长计算。"""
+
+        def __init__(self, response, endpoint: Endpoint):
+            self._response = response
+            self._endpoint = endpoint
+            self._closed = False
+
+        async def __aiter__(self):
+            # 直接读取底层字节流，解压由外层 Response 按响应头处理
+            async for chunk in self._response.stream:
+                yield chunk
+
+        async def aclose(self):
+            if self._closed:
+                return
+            self._closed = True
+            self._endpoint.outstanding -= 1
+            await self._response.aclose()
+
+    return TrackedStream
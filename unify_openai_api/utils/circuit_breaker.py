@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple, Type
+
+import anthropic
+import httpx
+import openai
+
+from ..registry.config import BreakerConfig
+from .http_pool import sdk_httpx
+from .idle_timeout import UpstreamStalled
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """上游熔断中，请求未发出。"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Upstream {name} is unavailable (circuit open), retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# 连接错误与超时：SDK 包装后的异常，以及透传模式直接读取响应时的 httpx 传输错误
+_TRANSPORT_ERRORS: Tuple[Type[BaseException], ...] = tuple({
+    openai.APIConnectionError, anthropic.APIConnectionError,
+    httpx.TransportError, sdk_httpx(openai).TransportError, sdk_httpx(anthropic).TransportError,
+    UpstreamStalled,
+})
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    5xx、连接错误、超时与流停滞算作上游故障。4xx 是请求本身的问题，取消不计入；
+    SDK 在发出请求前抛出的 ValueError、TypeError 等本地错误与上游无关，同样不计入。
+    """
+    if isinstance(error, _TRANSPORT_ERRORS):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class CircuitBreaker:
+    """
+    单个上游的被动健康检查与熔断。
+    连续失败或窗口内失败率过高时断开，断开期间直接拒绝；open_seconds 后半开并放行少量探测请求，
+    探测成功则恢复，失败则重新断开。
+    """
+
+    def __init__(self, name: str, config: BreakerConfig):
+        self.name = name
+        self.config = config
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        # 最近 window 次调用是否失败
+        self._results: Deque[bool] = deque(maxlen=config.window)
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        # 调用耗时的指数平均（秒）
+        self.latency: Optional[float] = None
+
+    def before_call(self) -> bool:
+        """发出上游请求前调用，熔断中抛出 CircuitOpen。返回该调用是否为半开状态的探测请求。"""
+        if self.state == OPEN:
+            remaining = self.opened_at + self.config.open_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpen(self.name, remaining)
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= self.config.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpen(self.name, 1.0)
+            self.probes += 1
+            return True
+        return False
+
+    def after_call(self, latency: float, error: Optional[BaseException] = None, probe: bool = False):
+        """上游调用结束后调用；被取消的调用只释放探测名额。"""
+        if probe and self.state == HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+        if isinstance(error, asyncio.CancelledError):
+            return
+
+        slow = self.config.slow_call_seconds
+        failed = (error is not None and is_upstream_failure(error)) or (slow is not None and latency > slow)
+        self.calls += 1
+        self.latency = latency if self.latency is None else self.latency * 0.9 + latency * 0.1
+        self._results.append(failed)
+
+        if not failed:
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+            return
+
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._transition(OPEN)
+        elif self.state == CLOSED and self._should_open():
+            self._transition(OPEN)
+
+    def _should_open(self) -> bool:
+        config = self.config
+        if self.consecutive_failures >= config.failure_threshold:
+            return True
+        # 样本填满窗口后才按失败率判断
+        return len(self._results) == config.window and sum(self._results) / config.window >= config.failure_rate
+
+    def _transition(self, state: str):
+        logger.warning("Circuit %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.probes = 0
+        elif state == CLOSED:
+            self.consecutive_failures = 0
+            self._results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "recent_failure_rate": sum(self._results) / len(self._results) if self._results else 0.0,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "latency": self.latency,
+        }
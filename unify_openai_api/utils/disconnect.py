@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应完成之前断开了连接。"""
+
+
+async def wait_for_disconnect(receive: Receive):
+    # 请求 body 已经读完，之后 receive 只会返回 http.disconnect
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(awaitable: Awaitable[T], receive: Receive) -> T:
+    """运行 awaitable；客户端先断开时取消它（取消会传到上游调用）并抛出 ClientDisconnected。"""
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        disconnected = not task.done()
+        if disconnected:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if disconnected:
+        raise ClientDisconnected()
+    return task.result()
+
+
+async def _aclose(iterator: Any):
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class DisconnectAwareStreamingResponse(StreamingResponse):
+    """
+    客户端断开时立即停止写出并关闭 body_iterator，生成器的 finally 随之关闭上游连接并记账。
+    Starlette 在 ASGI 2.4 下只有写入失败时才发现断开，且不会关闭 body_iterator，长时间没有新帧时上游会一直生成。
+    """
+
+    def __init__(self, content: Any, on_disconnect: Optional[Callable[[], None]] = None, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.on_disconnect = on_disconnect
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await cancel_on_disconnect(self.stream_response(send), receive)
+        except (ClientDisconnected, OSError):
+            # ASGI 2.4 的服务器向已断开的连接写入时抛出 OSError
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+        finally:
+            # 在写出时被取消的生成器停在 yield 处，需要显式关闭；外层请求被取消时清理仍然完成
+            await asyncio.shield(_aclose(self.body_iterator))
+
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,136 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from ..metrics.gateway import GatewayMetrics
+from ..registry.config import LANES, UserConfig
+
+_DEFAULT_USER = UserConfig(name="")
+
+# 未配置的用户在指标中合并为一个标签值，避免任意 user_id 成为 Prometheus 标签
+_OTHER_USERS = "other"
+
+
+@dataclass(order=True)
+class _Waiter:
+    # 按完成标签排序，相同时先到先得
+    finish: float
+    seq: int
+    start: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class Slot:
+    """一个上游并发名额，release 可以重复调用。"""
+
+    def __init__(self, scheduler: Optional["FairScheduler"] = None):
+        self._scheduler = scheduler
+
+    def release(self):
+        scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler._release()
+
+
+class FairScheduler:
+    """
+    单个上游的准入调度：限制并发数，超出的请求排队。
+    不同优先级通道之间严格按优先级调度；同一通道内按用户做加权公平排队（start-time fair queuing），
+    每个请求的标签为 max(通道虚拟时间, 该用户上一个请求的标签) + 1 / weight，按标签从小到大放行。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, users: Mapping[str, UserConfig]):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.users = users
+        self.active = 0
+        self._queues: Dict[str, List[_Waiter]] = {lane: [] for lane in LANES}
+        self._virtual_time: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._user_tags: Dict[Tuple[str, str], float] = dict()
+        self._seq = itertools.count()
+
+    def reconfigure(self, max_concurrency: int, users: Mapping[str, UserConfig]):
+        """重新加载配置时原地更新，排队与进行中的请求保留，新旧模型表共用同一个并发上限。"""
+        self.max_concurrency = max_concurrency
+        self.users = users
+        self._dispatch()
+
+    def lane_for(self, user_id: Optional[str], requested: Optional[str] = None) -> str:
+        """请求头指定的通道优先，其次是用户配置。"""
+        if requested in self._queues:
+            return requested
+        return self.users.get(user_id or "", _DEFAULT_USER).lane
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, user_id: Optional[str], lane: str, metrics: GatewayMetrics) -> Slot:
+        labels = (self.name, user_id if user_id and user_id in self.users else _OTHER_USERS, lane)
+        if self.active < self.max_concurrency and not self.queued():
+            self.active += 1
+            metrics.queue_wait.observe(labels, 0.0)
+            return Slot(self)
+
+        user = self.users.get(user_id or "", _DEFAULT_USER)
+        key = (lane, user_id or "")
+        start = max(self._virtual_time[lane], self._user_tags.get(key, 0.0))
+        finish = self._user_tags[key] = start + 1.0 / user.weight
+        waiter = _Waiter(finish, next(self._seq), start, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[lane], waiter)
+        # 队列里可能只剩已取消的请求，此时可以立即放行
+        self._dispatch()
+
+        started = time.perf_counter()
+        metrics.queue_depth.inc(labels)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # 已经分到名额但随即被取消，归还名额
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            raise
+        finally:
+            metrics.queue_depth.dec(labels)
+            metrics.queue_wait.observe(labels, time.perf_counter() - started)
+        return Slot(self)
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.active += 1
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue:
+                waiter = heapq.heappop(queue)
+                # 排队时被取消的请求直接丢弃
+                if waiter.future.cancelled():
+                    continue
+                self._virtual_time[lane] = waiter.start
+                if not queue:
+                    self._prune_tags(lane)
+                return waiter
+        return None
+
+    def _prune_tags(self, lane: str):
+        """
+        通道排空时按 SFQ 空闲时的规则把虚拟时间推进到最大的完成标签，所有标签随之落后于虚拟时间、
+        不再影响排序，可以丢弃；否则每个排过队的用户都会在 _user_tags 中留下一项。
+        """
+        keys = [key for key in self._user_tags if key[0] == lane]
+        if not keys:
+            return
+        self._virtual_time[lane] = max(self._virtual_time[lane], *(self._user_tags[key] for key in keys))
+        for key in keys:
+            del self._user_tags[key]
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Dict, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HttpPoolConfig:
+    """上游连接池参数，所有指向同一 origin 的客户端共享一个连接池。"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    # 启动时为每个 origin 预先建立的连接数
+    warm_connections: int = 2
+    connect_timeout: float = 5.0
+    read_timeout: float = 600.0
+
+    @classmethod
+    def from_env(cls) -> "HttpPoolConfig":
+        """从环境变量读取配置，未设置的字段使用默认值。"""
+        default = cls()
+        return cls(
+            max_connections=int(os.getenv("UNIFY_HTTP_MAX_CONNECTIONS", default.max_connections)),
+            max_keepalive_connections=int(os.getenv("UNIFY_HTTP_MAX_KEEPALIVE", default.max_keepalive_connections)),
+            keepalive_expiry=float(os.getenv("UNIFY_HTTP_KEEPALIVE_EXPIRY", default.keepalive_expiry)),
+            http2=os.getenv("UNIFY_HTTP2", "0") == "1",
+            warm_connections=int(os.getenv("UNIFY_HTTP_WARM_CONNECTIONS", default.warm_connections)),
+            connect_timeout=float(os.getenv("UNIFY_HTTP_CONNECT_TIMEOUT", default.connect_timeout)),
+            read_timeout=float(os.getenv("UNIFY_HTTP_READ_TIMEOUT", default.read_timeout)),
+        )
+
+
+def sdk_httpx(sdk: ModuleType) -> ModuleType:
+    """SDK 使用的 httpx 包。新版 openai / anthropic SDK 基于 httpx2，传入的 http_client 必须来自同一个包。"""
+    for cls in sdk.DefaultAsyncHttpxClient.__mro__:
+        if cls.__name__ == "AsyncClient" and not cls.__module__.startswith(sdk.__name__):
+            return sys.modules[cls.__module__.partition(".")[0]]
+    return httpx
+
+
+def _origin(base_url: str) -> str:
+    url = httpx.URL(base_url)
+    port = f":{url.port}" if url.port else ""
+    return f"{url.scheme}://{url.host}{port}"
+
+
+class HttpPool:
+    """按 origin 共享的 httpx 连接池，由 main.py 的 lifespan 持有。"""
+
+    def __init__(self, config: HttpPoolConfig):
+        self.config = config
+        # (httpx 包名, origin) -> 客户端
+        self._clients: Dict[Tuple[str, str], httpx.AsyncClient] = dict()
+
+        if config.http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP/2 requested but the 'h2' package is not installed, falling back to HTTP/1.1")
+                self.config.http2 = False
+
+    def client_for(self, base_url: str, lib: ModuleType = httpx) -> httpx.AsyncClient:
+        """返回 base_url 所在 origin 的共享客户端，不存在时创建。lib 为 SDK 使用的 httpx 包，见 sdk_httpx。"""
+        key = (lib.__name__, _origin(base_url))
+        client = self._clients.get(key)
+        if client is None:
+            config = self.config
+            client = lib.AsyncClient(
+                limits=lib.Limits(
+                    max_connections=config.max_connections,
+                    max_keepalive_connections=config.max_keepalive_connections,
+                    keepalive_expiry=config.keepalive_expiry,
+                ),
+                timeout=lib.Timeout(config.read_timeout, connect=config.connect_timeout),
+                http2=config.http2,
+                follow_redirects=True,
+            )
+            self._clients[key] = client
+        return client
+
+    async def warmup(self):
+        """为每个 origin 预先建立连接，避免部署后首批请求承担 DNS/TCP/TLS 开销。"""
+        if self.config.warm_connections <= 0:
+            return
+        await asyncio.gather(*(self._warm_origin(origin, client) for (_, origin), client in self._clients.items()))
+
+    async def _warm_origin(self, origin: str, client: httpx.AsyncClient):
+        # HTTP/2 在一条连接上多路复用，只需要一条
+        count = 1 if self.config.http2 else self.config.warm_connections
+        # 并发请求会迫使连接池各自建立新连接，返回后连接保持 keep-alive
+        results = await asyncio.gather(
+            *(client.head(origin, timeout=self.config.connect_timeout) for _ in range(count)),
+            return_exceptions=True,
+        )
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logger.warning(f"Failed to warm {len(failed)}/{count} connections to {origin}: {failed[0]!r}")
+        else:
+            logger.info(f"Warmed {count} connections to {origin}")
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
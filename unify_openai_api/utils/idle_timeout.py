@@ -0,0 +1,36 @@
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class UpstreamStalled(Exception):
+    """上游流超过 idle_timeout 秒没有新的事件。"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        super().__init__(f"No upstream event for {seconds:g}s")
+
+
+async def _guard(events: AsyncIterable[T], seconds: float) -> AsyncIterator[T]:
+    iterator = events.__aiter__()
+    while True:
+        # 每次只为等待上游的这一步计时，下游消费得慢不算停滞
+        timeout = asyncio.timeout(seconds)
+        try:
+            async with timeout:
+                event = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        except TimeoutError:
+            if not timeout.expired():
+                raise
+            raise UpstreamStalled(seconds) from None
+        yield event
+
+
+def idle_timeout(events: AsyncIterable[T], seconds: Optional[float]) -> AsyncIterable[T]:
+    """相邻两个事件（以及第一个事件之前）的间隔超过 seconds 时抛出 UpstreamStalled，为空时原样返回。"""
+    if seconds is None:
+        return events
+    return _guard(events, seconds)
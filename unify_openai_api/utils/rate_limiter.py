@@ -0,0 +1,154 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+# 还没有观测到实际输出时按该值预留
+DEFAULT_OUTPUT_RESERVATION = 1024
+# 实际输出 token 数的指数平均中新样本的权重
+OUTPUT_EWMA_WEIGHT = 0.1
+
+
+def reserved_output_tokens(request: Dict[str, Any], typical: Optional[float] = None) -> int:
+    """
+    输出部分的预留：该上游模型最近的典型输出量，不超过请求的输出上限。
+    不按 max_tokens 预留——Anthropic 请求默认 max_tokens 为 32768，按上限预留会让 TPM 桶每分钟只放行几个请求；
+    实际用量在调用结束后通过 adjust 修正。
+    """
+    expected = DEFAULT_OUTPUT_RESERVATION if typical is None else math.ceil(typical)
+    limit = request.get("max_tokens") or request.get("max_completion_tokens")
+    return min(limit, expected) if limit else expected
+
+
+class TokenBucket:
+    """
+    每分钟补充 per_minute 的令牌桶。等待者通过 asyncio.Lock 按 FIFO 排队。
+    令牌可以为负（实际用量超过预留时），之后的请求等待更久。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float) -> float:
+        """返回实际扣除的令牌数，调用结束后按它修正。"""
+        # 超过容量的请求永远无法满足，按整桶计
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+        return amount
+
+    def adjust(self, amount: float):
+        """按实际用量修正：正数归还多预留的令牌，负数扣除超出的部分。"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 并发上限：成功一次增加 1/limit（约每轮增加 1），遇到 429 减半。
+    超过上限的请求按 FIFO 排队。
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(None)
+            raise
+
+    def release(self, rate_limited: Optional[bool]):
+        """rate_limited 为 None 表示结果不计入调整（例如被取消或其他错误）。"""
+        self.inflight -= 1
+        if rate_limited is True:
+            self.limit = max(self.min_limit, self.limit / 2)
+        elif rate_limited is False:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        while self._waiters and self.inflight < int(self.limit):
+            future = self._waiters.popleft()
+            if future.cancelled():
+                continue
+            self.inflight += 1
+            future.set_result(None)
+
+
+@dataclass
+class Ticket:
+    # 在 TPM 桶中实际扣除的令牌数（已按桶容量截断）
+    reserved: float = 0
+    admitted: bool = False
+
+
+class UpstreamLimiter:
+    """单个上游模型的 RPM / TPM 令牌桶与自适应并发，预算不足时排队等待而不是发出后收到 429。"""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None, max_concurrency: Optional[int] = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency) if max_concurrency else None
+        # 实际输出 token 数的指数平均，用于预留
+        self.typical_output: Optional[float] = None
+
+    async def acquire(self, request: Dict[str, Any], prompt_tokens: int) -> Ticket:
+        """prompt_tokens 为本地估计的输入 token 数，与输出上限一起在 TPM 桶中预留。"""
+        ticket = Ticket()
+        if self.concurrency is not None:
+            await self.concurrency.acquire()
+        try:
+            if self.requests is not None:
+                await self.requests.acquire(1)
+            if self.tokens is not None:
+                amount = prompt_tokens + reserved_output_tokens(request, self.typical_output)
+                ticket.reserved = await self.tokens.acquire(amount)
+        except BaseException:
+            if self.concurrency is not None:
+                self.concurrency.release(None)
+            raise
+        ticket.admitted = True
+        return ticket
+
+    def release(self, ticket: Ticket, usage: Optional[Any], error: Optional[BaseException]):
+        """usage 为上游报告并被计费的用量（CompletionUsage），用于修正 TPM 预留。"""
+        if not ticket.admitted:
+            return
+        ticket.admitted = False
+        if self.tokens is not None and usage is not None:
+            self.tokens.adjust(ticket.reserved - (usage.prompt_tokens + usage.completion_tokens))
+            if self.typical_output is None:
+                self.typical_output = float(usage.completion_tokens)
+            else:
+                self.typical_output += OUTPUT_EWMA_WEIGHT * (usage.completion_tokens - self.typical_output)
+        if self.concurrency is not None:
+            if error is None:
+                self.concurrency.release(False)
+            elif getattr(error, "status_code", None) == 429:
+                self.concurrency.release(True)
+            else:
+                self.concurrency.release(None)
@@ -0,0 +1,34 @@
+import hashlib
+import json
+from typing import Any, Dict
+
+# 不影响上游输出的字段，不参与 key 计算
+_IGNORED_FIELDS = {"user_id"}
+
+
+def _strip(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in data.items() if k not in _IGNORED_FIELDS}
+
+
+def request_key(data: Dict[str, Any]) -> str:
+    """对 pipeline 处理之后的请求计算规范化哈希，字段顺序不影响结果。"""
+    data = _strip(data)
+    # 不支持的字段（包括 user_id）被并入了 extra_body
+    if isinstance(data.get("extra_body"), dict):
+        data["extra_body"] = _strip(data["extra_body"])
+    canonical = json.dumps(
+        data,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_deterministic(data: Dict[str, Any]) -> bool:
+    """temperature=0 或固定 seed 的请求视为可复现。"""
+    # Anthropic 不支持 seed，会被放进 extra_body
+    extra_body = data.get("extra_body") or dict()
+    seed = data.get("seed", extra_body.get("seed", None))
+    return data.get("temperature", None) == 0 or seed is not None
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class FlightCancelled(Exception):
+    """上游调用在流结束之前被取消，已缓存的帧不完整。"""
+
+
+class Flight:
+    """
+    一次进行中的上游调用，所有相同请求共享其结果。
+    非流式请求共享 result；流式请求共享按顺序缓存的帧，后加入者也从第一帧开始读。
+    """
+
+    def __init__(self, key: str, stream: bool, on_done):
+        self.key = key
+        self.stream = stream
+        self.frames: List[Any] = []
+        self.done = False
+        # 上游调用被取消（所有读者都已离开），之后的读者不能把缓存的帧当作完整的流
+        self.cancelled = False
+        # 领头请求观察到的 usage，用于给跟随者记账
+        self.usage: Optional[Any] = None
+        self.subscribers = 0
+        self.opened: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+
+    def start(self, fetch: Awaitable[Any], leader: Any):
+        self.task = asyncio.create_task(self._run(fetch, leader))
+
+    async def wait_opened(self) -> Any:
+        """
+        等待上游调用开始，非流式为完整结果。等待者都被取消（客户端断开）时取消上游调用。
+        流式请求成功返回后仍计为订阅者，直到 subscribe 接管；期间其他读者离开不会取消上游调用。
+        """
+        self.subscribers += 1
+        held = False
+        try:
+            result = await asyncio.shield(self.opened)
+            held = self.stream
+            return result
+        finally:
+            if not held:
+                self._leave()
+
+    def _leave(self):
+        self.subscribers -= 1
+        # 所有读者都离开后不再需要继续读取上游
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            self.task.cancel()
+
+    async def _run(self, fetch: Awaitable[Any], leader: Any):
+        try:
+            result = await fetch
+        except asyncio.CancelledError:
+            self.cancelled = True
+            self.opened.cancel()
+            self._finish(leader)
+            raise
+        except Exception as e:
+            # 异常交给 opened，由每个等待者各自抛出
+            self.opened.set_exception(e)
+            self._finish(leader)
+            return
+
+        if not self.stream:
+            self.opened.set_result(result)
+            self._finish(leader)
+            return
+
+        self.opened.set_result(None)
+        try:
+            async for frame in result:
+                self.frames.append(frame)
+                self._notify()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        finally:
+            await result.aclose()
+            self._finish(leader)
+
+    def _finish(self, leader: Any):
+        self.usage = getattr(leader, "usage", None)
+        self.done = True
+        self._notify()
+        self._on_done(self)
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """接管 wait_opened 留下的订阅，从第一帧开始读。上游调用被取消时抛出 FlightCancelled。"""
+        index = 0
+        try:
+            while True:
+                if index < len(self.frames):
+                    frame = self.frames[index]
+                    index += 1
+                    yield frame
+                elif self.done:
+                    if self.cancelled:
+                        raise FlightCancelled()
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self._leave()
+
+
+class SingleFlight:
+    """合并并发的相同请求，同一个 key 同时只有一次上游调用。"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = dict()
+
+    @classmethod
+    def from_env(cls) -> Optional["SingleFlight"]:
+        return cls() if os.getenv("UNIFY_COALESCE", "0") == "1" else None
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str, stream: bool) -> Tuple[Flight, bool]:
+        """返回 key 对应的 Flight，以及调用方是否为领头请求。"""
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            return flight, False
+        flight = Flight(key, stream, self._remove)
+        self._flights[key] = flight
+        return flight, True
+
+    def _remove(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
@@ -0,0 +1,246 @@
+"""
+本地 token 估计，用于在调用上游之前检查上下文窗口、估算花费和预留 TPM 额度，
+以及在流没有收到最终 usage 时估计用量。
+
+按模型系列计数：OpenAI 模型在安装了 tiktoken 时按其编码精确计数，其余按字符类别估计
+（ASCII 按每 token 的字符数，中日韩等其他字符按每字的 token 数，系数按系列调整）。
+每条消息的计数按内容哈希缓存，长对话每次只需计算新增的轮次。
+"""
+import functools
+import json
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+class ContextWindowExceeded(Exception):
+    """请求的输入估计已超过模型的上下文窗口。"""
+
+    def __init__(self, model: str, tokens: int, context_window: int):
+        self.model = model
+        self.tokens = tokens
+        self.context_window = context_window
+        super().__init__(f"Model {model} has a context window of {context_window} tokens, the request has about {tokens}")
+
+
+@dataclass(frozen=True)
+class Family:
+    name: str
+    # 每个 token 的 ASCII 字符数
+    ascii_chars_per_token: float
+    # 每个非 ASCII 字符的 token 数
+    other_tokens_per_char: float
+    # 每条消息的角色与分隔符开销
+    message_overhead: int = 4
+    # 每张图片或文档按固定 token 数计
+    attachment_tokens: int = 1000
+    # 安装了 tiktoken 时使用的编码
+    encoding: Optional[str] = None
+
+
+FAMILIES: Dict[str, Family] = {
+    family.name: family for family in (
+        Family("openai", 4.0, 0.8, message_overhead=3, attachment_tokens=765, encoding="o200k_base"),
+        Family("claude", 3.5, 1.2, attachment_tokens=1600),
+        Family("gemini", 4.0, 0.6, attachment_tokens=258),
+        Family("qwen", 4.0, 0.7),
+        Family("doubao", 4.0, 0.7),
+        Family("deepseek", 4.0, 0.6),
+        Family("default", 4.0, 1.0),
+    )
+}
+
+# 上游模型 id 前缀 -> 系列
+_PREFIXES: Tuple[Tuple[str, str], ...] = (
+    ("gpt-", "openai"), ("chatgpt-", "openai"), ("o1", "openai"), ("o3", "openai"), ("o4", "openai"),
+    ("claude", "claude"),
+    ("gemini", "gemini"),
+    ("qwen", "qwen"), ("qwq", "qwen"),
+    ("doubao", "doubao"),
+    ("deepseek", "deepseek"),
+)
+
+# 每次请求的固定开销（回复的起始标记等）
+_REQUEST_OVERHEAD = 3
+
+# 缓存的消息计数条数
+DEFAULT_CACHE_SIZE = 65536
+
+# 流的输出计数暂存的帧超过该字节数时解析并折算为 token 数
+STREAM_BUFFER_BYTES = 64 * 1024
+
+
+def family_for(target: str, name: Optional[str] = None) -> Family:
+    """name 为配置中指定的系列，为空时按上游模型 id 的前缀推断。"""
+    if name is not None:
+        return FAMILIES[name]
+    target = target.lower()
+    for prefix, family in _PREFIXES:
+        if target.startswith(prefix):
+            return FAMILIES[family]
+    return FAMILIES["default"]
+
+
+@functools.lru_cache(maxsize=None)
+def _tiktoken_encoding(name: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding(name)
+
+
+class TokenCache:
+    """(系列, 内容哈希) -> token 数的 LRU 缓存，只在事件循环线程中访问。"""
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, int]) -> Optional[int]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Tuple[str, int], value: int):
+        self._entries[key] = value
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_CACHE = TokenCache()
+
+
+class TokenEstimator:
+    """单个模型系列的 token 计数。同一系列的模型共享一个实例与缓存。"""
+
+    def __init__(self, family: Family, cache: Optional[TokenCache] = None):
+        self.family = family
+        self.cache = cache if cache is not None else _CACHE
+        self._encoding = _tiktoken_encoding(family.encoding) if family.encoding else None
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # UTF-8 中 ASCII 占 1 字节，中日韩字符占 3 字节，按多出的字节数近似非 ASCII 字符数
+        other = (len(text.encode("utf-8", "surrogatepass")) - len(text)) // 2
+        family = self.family
+        return math.ceil((len(text) - other) / family.ascii_chars_per_token + other * family.other_tokens_per_char)
+
+    def count_message(self, message: Any) -> int:
+        texts: Optional[List[str]] = None
+        content = message.get("content") if type(message) is dict and len(message) == 2 and "role" in message else None
+        if type(content) is str:
+            # 最常见的 role + 字符串 content：计数与 role 无关，直接使用字符串的哈希（字符串对象会缓存哈希值）
+            digest = hash(content)
+        else:
+            # 计数只取决于文本与附件个数，key 也只取这两项，图片等附件的内容不序列化也不哈希
+            texts = []
+            attachments = _collect(message, texts)
+            digest = hash((attachments, *texts))
+        key = (self.family.name, digest)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            if texts is None:
+                texts = []
+                attachments = _collect(message, texts)
+            tokens = self.count_text("\n".join(texts)) + attachments * self.family.attachment_tokens + self.family.message_overhead
+            self.cache.put(key, tokens)
+        return tokens
+
+    def count_request(self, request: Dict[str, Any]) -> int:
+        """SDK 参数（OpenAI 或 Anthropic 格式）的输入 token 估计。"""
+        tokens = _REQUEST_OVERHEAD
+        for message in request.get("messages") or ():
+            tokens += self.count_message(message)
+        # Anthropic 的 system 与两种格式的 tools 在多轮对话中通常不变，同样按哈希缓存
+        for key in ("system", "tools", "functions"):
+            value = request.get(key)
+            if value:
+                tokens += self.count_message(value)
+        return tokens
+
+    def count_chunk_lines(self, data: bytes) -> int:
+        """OpenAI 格式 SSE 数据行中生成内容的 token 估计，不完整的行被忽略。"""
+        texts: List[str] = []
+        for line in data.splitlines():
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                chunk = json.loads(line[5:])
+            except ValueError:
+                continue
+            if not isinstance(chunk, dict):
+                continue
+            for choice in chunk.get("choices") or ():
+                _collect(choice.get("delta"), texts)
+        return self.count_text("".join(texts))
+
+
+class StreamOutputCounter:
+    """
+    已发给客户端的帧中输出 token 的估计，只在没有收到 usage 时使用。
+    帧先暂存，超过 max_buffered 字节时解析并折算为 token 数，内存有上限；
+    较短的流不需要解析。透传的帧可能在行中间被切开，未完整的行留到下一批。
+    """
+
+    def __init__(self, estimator: TokenEstimator, max_buffered: int = STREAM_BUFFER_BYTES):
+        self.estimator = estimator
+        self.max_buffered = max_buffered
+        self._frames: List[bytes] = []
+        self._buffered = 0
+        self._tokens = 0
+
+    def add(self, frame: Union[bytes, str]):
+        if isinstance(frame, str):
+            frame = frame.encode()
+        self._frames.append(frame)
+        self._buffered += len(frame)
+        if self._buffered > self.max_buffered:
+            data = b"".join(self._frames)
+            end = data.rfind(b"\n") + 1
+            self._tokens += self.estimator.count_chunk_lines(data[:end])
+            self._frames = [data[end:]] if end < len(data) else []
+            self._buffered = len(data) - end
+
+    def tokens(self) -> int:
+        if self._frames:
+            self._tokens += self.estimator.count_chunk_lines(b"".join(self._frames))
+            self._frames, self._buffered = [], 0
+        return self._tokens
+
+
+# 计数时跳过的结构字段
+_SKIPPED_KEYS = frozenset(("type", "role", "id", "index", "cache_control", "signature", "tool_call_id", "tool_use_id"))
+
+
+def _collect(value: Any, texts: List[str]) -> int:
+    """收集消息中需要计数的文本，返回图片与文档等附件的个数。"""
+    if isinstance(value, str):
+        texts.append(value)
+        return 0
+    if isinstance(value, list):
+        return sum(_collect(item, texts) for item in value)
+    if not isinstance(value, dict):
+        return 0
+    if value.get("type") in ("image", "image_url", "input_image", "document", "file", "input_audio"):
+        return 1
+    attachments = 0
+    for key, item in value.items():
+        if key in _SKIPPED_KEYS or item is None:
+            continue
+        if key in ("input", "parameters", "input_schema") and not isinstance(item, str):
+            # 工具参数与 schema 按 JSON 文本计数
+            texts.append(json.dumps(item, ensure_ascii=False))
+        else:
+            attachments += _collect(item, texts)
+    return attachments